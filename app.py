@@ -1,136 +1,20 @@
 import sys
-import os
-import platform
 from dotenv import load_dotenv
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QLineEdit, QPushButton,
     QVBoxLayout, QGroupBox
 )
-from PyQt5.QtCore import pyqtSignal, QThread
 
-from multiprocessing import Process, Event, set_start_method
-from time import sleep
+from src.browser.browser_automator_v2 import get_user_ids
+from src.adb_helpers import get_connected_devices
+from src.engine import EngineConfig
+from src.qt_worker import EngineWorker
 
-from src.android.android_automator_v2 import AndroidAutomator, get_my_default_ui_automator2_options
-from src.browser.browser_automator_v2 import BrowserAutomator, get_my_default_chrome_options, get_user_ids
-from src.adb_helpers import run_adb_command, get_connected_devices
-
-
-def download_QRIS(browser_automator, continue_event, qris_downloaded_event):
-    browser_automator.loop_downloads(continue_event, qris_downloaded_event)
-
-
-def scan_QRIS(android_automator, qris_downloaded_event, continue_event, stop_event):
-    while not stop_event.is_set():
-        if qris_downloaded_event.wait(timeout=1):
-            android_automator.pay_qris_transaction()
-            continue_event.set()
-            qris_downloaded_event.clear()
-
-
-class PaymentWorker(QThread):
-    payment_finished = pyqtSignal()
-    log_message = pyqtSignal(str)
 
+class PaymentWorker(EngineWorker):
     def __init__(self, pin, device_udid):
-        super().__init__()
-        self.pin = pin
-        self.device_udid = device_udid
-        self._running = True
-        self.p_download_QRIS = None
-        self.p_scan_QRIS = None
-        self.stop_event = Event()
-
-    def stop(self):
-        self._running = False
-        self.stop_event.set()
-
-    def run(self):
-        browser_automator = None
-        android_automator = None
-        try:
-            self.log_message.emit("Loading configuration...")
-            load_dotenv()
-
-            appium_server_url = os.getenv("APPIUM_SERVER_URL")
-            neo_pin = os.getenv("NEO_PIN")
-            base_url = os.getenv("WEB_BASE_URL")
-            username = os.getenv("WEB_CRED_USERNAME")
-            password = os.getenv("WEB_CRED_PASSWORD")
-
-            user_ids = get_user_ids("user_ids_5.txt")
-            if not self._running:
-                self.log_message.emit("Stopped before browser setup.")
-                return
-
-            continue_event = Event()
-            qris_downloaded_event = Event()
-
-            browser_automator = BrowserAutomator(base_url, get_my_default_chrome_options())
-            browser_automator.set_credentials(username, password)
-            browser_automator.set_user_ids(user_ids)
-
-            self.log_message.emit("Setting up browser...")
-            browser_automator.setup()
-            if not self._running:
-                browser_automator.quit()
-                self.log_message.emit("Stopped before QRIS generation.")
-                return
-
-            self.log_message.emit("Generating QRIS...")
-            browser_automator.generate_QRIS()
-            self.log_message.emit("QRIS generated successfully.")
-            if not self._running:
-                browser_automator.quit()
-                self.log_message.emit("Stopped before launching processes.")
-                return
-
-            options = get_my_default_ui_automator2_options(self.device_udid)
-            android_automator = AndroidAutomator(appium_server_url, options)
-            android_automator.set_credentials(neo_pin)
-
-            self.log_message.emit("Launching QRIS processes...")
-
-            self.p_download_QRIS = Process(target=download_QRIS, args=(browser_automator, continue_event, qris_downloaded_event,))
-            self.p_scan_QRIS = Process(target=scan_QRIS, args=(android_automator, qris_downloaded_event, continue_event, self.stop_event,))
-
-            self.p_download_QRIS.start()
-            self.p_scan_QRIS.start()
-
-            sleep(3)
-            continue_event.set()
-
-            while self._running:
-                sleep(1)
-
-        except Exception as e:
-            self.log_message.emit(f"Error: {str(e)}")
-
-        finally:
-            self.log_message.emit("Stopping processes...")
-            self.stop_event.set()
-
-            if self.p_scan_QRIS and self.p_scan_QRIS.is_alive():
-                self.p_scan_QRIS.terminate()
-                self.p_scan_QRIS.join()
-
-            if self.p_download_QRIS and self.p_download_QRIS.is_alive():
-                self.p_download_QRIS.terminate()
-                self.p_download_QRIS.join()
-
-            try:
-                if browser_automator:
-                    browser_automator.quit()
-            except Exception:
-                pass
-            try:
-                if android_automator:
-                    android_automator.quit()
-            except Exception:
-                pass
-
-            self.log_message.emit("Payment automation stopped.")
-            self.payment_finished.emit()
+        load_dotenv()
+        super().__init__(EngineConfig.from_env(pin, [device_udid]), get_user_ids("user_ids_5.txt"))
 
 
 class QRISAutoPayApp(QWidget):
@@ -234,12 +118,6 @@ class QRISAutoPayApp(QWidget):
 
 # Run the app
 if __name__ == "__main__":
-    # Set multiprocessing start method
-    if platform.system() == "Windows":
-        set_start_method("spawn")
-    else:
-        set_start_method("fork")
-
     app = QApplication(sys.argv)
     window = QRISAutoPayApp()
     window.show()
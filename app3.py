@@ -1,273 +1,103 @@
 import sys
 import os
-import platform
+import threading
 from dotenv import load_dotenv
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QLineEdit, QPushButton,
-    QVBoxLayout, QGroupBox, QMessageBox, QFileDialog
+    QVBoxLayout, QGroupBox, QFileDialog, QCheckBox
 )
-from PyQt5.QtCore import pyqtSignal, QThread, QObject, QEventLoop, QTimer, Qt
-
-from time import sleep
+from PyQt5.QtCore import pyqtSignal, QThread
 
 from src.android.android_automator_v2 import AndroidAutomator, get_my_default_ui_automator2_options
-from src.browser.browser_automator_v2 import BrowserAutomator, get_my_default_chrome_options, get_user_ids
+from src.browser.browser_automator_v2 import get_user_ids
 from src.adb_helpers import get_connected_devices
+from src.browser.session_cache import DEFAULT_SESSION_CACHE_PATH
+from src.engine import EngineConfig, STAGE_GENERATE, STAGE_HARVEST, STAGE_FETCH, STAGE_STAGE, STAGE_PAY, STAGE_VERIFY
+from src.profiler import DEFAULT_PROFILE_DIR
+from src.qt_worker import EngineWorker
 
 from src.utils import get_resource_path
 
+BROWSER_STAGES = tuple(f"[{stage}]" for stage in (STAGE_GENERATE, STAGE_HARVEST, STAGE_FETCH))
+ANDROID_STAGES = tuple(f"[{stage}]" for stage in (STAGE_STAGE, STAGE_PAY, STAGE_VERIFY))
 
-def show_error_dialog(message):
-    app = QApplication.instance()
-    if app:
-        QMessageBox.critical(None, "Error", message)
-
-
-class BrowserWorker(QThread):
-    log_message = pyqtSignal(str)
-    qris_downloaded = pyqtSignal()
-    finished = pyqtSignal()
-
-    def __init__(self, base_url, username, password, user_ids):
-        super().__init__()
-        self.base_url = base_url
-        self.username = username
-        self.password = password
-        self.user_ids = user_ids
-        self._stop = False
-        self.browser_automator = None
-
-        self._wait_loop = None
-        self._continue = False
-
-    def stop(self):
-        self._stop = True
-        if self._wait_loop and self._wait_loop.isRunning():
-            self._continue = True
-            self._wait_loop.quit()
-
-    def run(self):
-        try:
-            self.log_message.emit("[Browser] Setting up browser...")
-            self.browser_automator = BrowserAutomator(self.base_url, get_my_default_chrome_options())
-            self.browser_automator.set_credentials(self.username, self.password)
-            self.browser_automator.set_user_ids(self.user_ids)
-
-            self.browser_automator.setup()
-
-            self.log_message.emit("[Browser] Generating QRIS...")
-            self.browser_automator.generate_QRIS()
-
-            count = 0
-            total = len(self.user_ids)
-            last_failed = False
-            retry_count = 0
-            max_retry = 3
-
-            while not self._stop and count < total:
-                self.log_message.emit(f"[Browser] Download QRIS #{count + 1}")
-                
-                should_click_next = count > 0
-                success = self.browser_automator.download_QRIS(idx=count, next=should_click_next, refresh=last_failed)
-
-                if success:
-                    count += 1
-                    retry_count = 0
-
-                    self.log_message.emit(f"[Browser] QRIS #{count} Downloaded")
-                    self.qris_downloaded.emit()
-                else:
-                    if retry_count <= max_retry:
-                        last_failed = True
-                        retry_count = retry_count + 1
-                        self.log_message.emit(f"[Browser] Failed to Download QRIS #{count}")
-                    else:
-                        count += 1
-                        last_failed = False
-                        retry_count = 0
-
-                # Wait for signal from Android worker before continuing
-                self._wait_for_continue()
 
-        except Exception as e:
-            self.log_message.emit(f"[Browser] Error: {e}")
-            show_error_dialog(f"Browser error: {e}")
-        finally:
-            try:
-                self.log_message.emit("[Browser] Quitting browser")
-                if self.browser_automator:
-                    self.browser_automator.quit()
-            except Exception:
-                pass
-            self.finished.emit()
-
-    def _wait_for_continue(self):
-        self._continue = False
-        loop = QEventLoop()
-        self._wait_loop = loop
-
-        timer = QTimer()
-        timer.setInterval(100)
-        timer.timeout.connect(lambda: loop.quit() if self._continue or self._stop else None)
-        timer.start()
-
-        loop.exec_()
-
-        timer.stop()
-        self._wait_loop = None
-
-    def continue_download(self):
-        self._continue = True
-        if self._wait_loop and self._wait_loop.isRunning():
-            self._wait_loop.quit()
-
-
-class AndroidWorker(QThread):
+class AndroidWarmup(QThread):
+    """
+    Creates the Appium session of the detected device with the fast profile
+    while the user is still filling in the form, so Start doesn't wait for it.
+    """
     log_message = pyqtSignal(str)
-    continue_signal = pyqtSignal()
-    finished = pyqtSignal()
 
-    def __init__(self, appium_server_url, neo_pin, device_udid):
-        super().__init__()
-        self.appium_server_url = appium_server_url
-        self.neo_pin = neo_pin
+    def __init__(self, device_udid, parent = None):
+        # The parent keeps a discarded warm-up alive until its thread is done
+        super().__init__(parent)
         self.device_udid = device_udid
-        self._stop = False
         self.android_automator = None
-
-        self._wait_loop = None
-        self._qris_ready = False
-
-    def stop(self):
-        self._stop = True
-        if self._wait_loop and self._wait_loop.isRunning():
-            self._qris_ready = True
-            self._wait_loop.quit()
+        self.__discarded = False
+        self.__lock = threading.Lock()
 
     def run(self):
-
+        load_dotenv(get_resource_path(".env"))
         try:
-            options = get_my_default_ui_automator2_options(self.device_udid)
-            self.android_automator = AndroidAutomator(self.appium_server_url, options)
-            self.android_automator.set_credentials(self.neo_pin)
-
-            while not self._stop:
-                self.log_message.emit("[Android] Waiting for QRIS to be downloaded...")
-                self._wait_for_qris_download()
-
-                if self._stop:
-                    break
-
-                self.log_message.emit("[Android] Pay QRIS transaction")
-                self.android_automator.pay_qris_transaction()
-                self.log_message.emit("[Android] Pay QRIS transaction done")
-
-                self.continue_signal.emit()
-
+            options = get_my_default_ui_automator2_options(self.device_udid, fast=True)
+            automator = AndroidAutomator(
+                os.getenv("APPIUM_SERVER_URL"), options, fast_profile=True,
+                direct_driver=os.getenv("ANDROID_DIRECT_DRIVER", "0") == "1"
+            )
         except Exception as e:
-            self.log_message.emit(f"[Android] Error: {e}")
-            show_error_dialog(f"Android error: {e}")
-        finally:
-            try:
-                self.log_message.emit("[Android] Quitting android")
-                if self.android_automator:
-                    self.android_automator.quit()
-            except Exception:
-                pass
-            self.finished.emit()
-
-    def _wait_for_qris_download(self):
-        self._qris_ready = False
-        loop = QEventLoop()
-        self._wait_loop = loop
-
-        timer = QTimer()
-        timer.setInterval(100)
-        timer.timeout.connect(lambda: loop.quit() if self._qris_ready or self._stop else None)
-        timer.start()
-
-        loop.exec_()
-
-        timer.stop()
-        self._wait_loop = None
-
-    def qris_downloaded(self):
-        self._qris_ready = True
-        if self._wait_loop and self._wait_loop.isRunning():
-            self._wait_loop.quit()
-
-
-class PaymentWorker(QObject):
-    """
-    Manages the two QThreads and connects their signals.
-    """
-    log_message = pyqtSignal(str)
-    payment_finished = pyqtSignal()
-
-    def __init__(self, pin, device_udid, user_id_file_path):
-        super().__init__()
-        self.pin = pin
-        self.device_udid = device_udid
-        self.user_id_file_path = user_id_file_path
-
-        dotenv_path = get_resource_path(".env")
-        load_dotenv(dotenv_path)
-
-        self.appium_server_url = os.getenv("APPIUM_SERVER_URL")
-        self.base_url = os.getenv("WEB_BASE_URL")
-        self.username = os.getenv("WEB_CRED_USERNAME")
-        self.password = os.getenv("WEB_CRED_PASSWORD")
-
-        self.user_ids = get_user_ids(self.user_id_file_path)
-
-        self.browser_worker = BrowserWorker(self.base_url, self.username, self.password, self.user_ids)
-        self.android_worker = AndroidWorker(self.appium_server_url, self.pin, self.device_udid)
-
-        self._setup_connections()
-
-    def _setup_connections(self):
-        self.browser_worker.log_message.connect(self.log_message)
-        self.android_worker.log_message.connect(self.log_message)
-
-        # Connect finished signal of browser to stop the android worker
-        self.browser_worker.finished.connect(self.stop_android_worker)
-
-        self.browser_worker.finished.connect(self._on_finished)
-        self.android_worker.finished.connect(self._on_finished)
-
-        self.browser_worker.qris_downloaded.connect(self.android_worker.qris_downloaded)
-
-        self.android_worker.continue_signal.connect(self.browser_worker.continue_download)
-
-        self._finished_count = 0
+            self.log_message.emit(f"[Android] Warm-up failed: {e}")
+            return
 
-    def start(self):
-        self.log_message.emit("[PaymentWorker] Starting workers...")
-        self.browser_worker.start()
-        self.android_worker.start()
+        with self.__lock:
+            discarded = self.__discarded
+            if not discarded:
+                self.android_automator = automator
+        if discarded:
+            automator.quit()
+            return
+        session_time = automator.timings()["session"]
+        self.log_message.emit(f"[Android] Session warmed up in {session_time:.1f}s")
+
+    def take(self):
+        """
+        Hands the warmed up automator over (None if warm-up failed); it is not
+        quit here anymore. Call it once the thread has finished.
+        """
+        with self.__lock:
+            automator = self.android_automator
+            self.android_automator = None
+        return automator
+
+    def discard(self):
+        """Quits the automator without waiting: a warm-up still running quits it itself."""
+        with self.__lock:
+            self.__discarded = True
+            automator = self.android_automator
+            self.android_automator = None
+        if self.isRunning():
+            self.finished.connect(self.deleteLater)
+        else:
+            self.deleteLater()
+        if automator:
+            automator.quit()
 
-    def stop_android_worker(self):
-        """Stop the Android worker when the browser finishes."""
-        self.log_message.emit("[PaymentWorker] Stopping Android Worker due to Browser finishing.")
-        self.android_worker.stop()
 
-    def stop(self):
-        self.log_message.emit("[PaymentWorker] Stopping workers...")
-        self.browser_worker.stop()
-        self.android_worker.stop()
+class PaymentWorker(EngineWorker):
+    """Pays the user ids of the selected file on the payment engine."""
 
-        # Quit and wait for clean shutdown
-        self.browser_worker.quit()
-        self.android_worker.quit()
+    def __init__(self, pin, device_udid, user_id_file_path, android_automator = None, profile = False):
+        load_dotenv(get_resource_path(".env"))
 
-        self.browser_worker.wait()
-        self.android_worker.wait()
+        config = EngineConfig.from_env(pin, [device_udid])
+        if os.getenv("SESSION_CACHE_PATH") is None:
+            # An empty SESSION_CACHE_PATH turns the cache off, as in the headless runner
+            config.session_cache_path = DEFAULT_SESSION_CACHE_PATH
+        if profile:
+            config.profile_dir = config.profile_dir or DEFAULT_PROFILE_DIR
+        warm = {device_udid: android_automator} if android_automator else None
 
-    def _on_finished(self):
-        self._finished_count += 1
-        if self._finished_count >= 2:
-            self.log_message.emit("[PaymentWorker] Both workers finished.")
-            self.payment_finished.emit()
+        super().__init__(config, get_user_ids(user_id_file_path), android_automators=warm)
 
 
 class QRISAutoPayApp(QWidget):
@@ -278,6 +108,8 @@ class QRISAutoPayApp(QWidget):
         self.setFixedSize(600, 500)
 
         self.worker = None
+        self.warmup = None
+        self.pending_start = None
         self.user_id_file_path = ""
         self.init_ui()
 
@@ -311,6 +143,10 @@ class QRISAutoPayApp(QWidget):
         self.browse_button.clicked.connect(self.browse_user_id_file)
         config_layout.addWidget(self.browse_button)
 
+        self.profile_checkbox = QCheckBox("Profile this run", self)
+        self.profile_checkbox.setToolTip(f"Writes a flame graph and the hotspots of the run to {DEFAULT_PROFILE_DIR}/")
+        config_layout.addWidget(self.profile_checkbox)
+
         config_group.setLayout(config_layout)
         main_layout.addWidget(config_group)
 
@@ -350,30 +186,87 @@ class QRISAutoPayApp(QWidget):
 
         if self.toggle_button.text() == "Start":
             self.pin_input.setDisabled(True)
+            self.profile_checkbox.setDisabled(True)
             self.toggle_button.setText("Stop")
             self.device_label.setText(f"Detected: {self.get_device_udid()}")
 
-            self.worker = PaymentWorker(pin, self.get_device_udid(), self.user_id_file_path)
-            self.worker.payment_finished.connect(self.on_payment_finished)
-            self.worker.log_message.connect(self.update_status_label)
-            self.worker.start()
+            device_udid = self.get_device_udid()
+            self.pending_start = (pin, device_udid, self.profile_checkbox.isChecked())
+            if self.warmup and self.warmup.device_udid == device_udid and self.warmup.isRunning():
+                # Starts once the session is up instead of blocking the window on it
+                self.status_android_label.setText("Android Status: Waiting for the warm-up session...")
+                self.warmup.finished.connect(self.start_worker)
+            else:
+                self.start_worker()
         else:
             self.stop_worker()
 
+    def start_worker(self):
+        if self.pending_start is None:
+            return
+        pin, device_udid, profile = self.pending_start
+        self.pending_start = None
+
+        android_automator = None
+        if self.warmup:
+            if self.warmup.device_udid == device_udid:
+                android_automator = self.warmup.take()
+            else:
+                self.warmup.discard()
+            self.warmup = None
+
+        self.worker = PaymentWorker(pin, device_udid, self.user_id_file_path, android_automator, profile)
+        self.worker.payment_finished.connect(self.on_payment_finished)
+        self.worker.log_message.connect(self.update_status_label)
+        self.worker.start()
+
     def stop_worker(self):
-        if self.worker:
+        if self.pending_start is not None:
+            self.pending_start = None
+            self.on_payment_finished()
+        elif self.worker:
             self.worker.stop()
 
     def on_payment_finished(self):
         self.pin_input.setDisabled(False)
+        self.profile_checkbox.setDisabled(False)
         self.toggle_button.setText("Start")
         self.worker = None
+        self.start_warmup()
+
+    def start_warmup(self):
+        """Pre-creates the next Appium session when ANDROID_FAST_PROFILE=1."""
+        load_dotenv(get_resource_path(".env"))
+        if os.getenv("ANDROID_FAST_PROFILE", "0") != "1" or os.getenv("ANDROID_DEVICE_POOL", "0") == "1":
+            return
 
-    def detect_android_device(self):
         device_udid = self.get_device_udid()
-        if device_udid:
+        if not device_udid or (self.warmup and self.warmup.device_udid == device_udid):
+            return
+
+        if self.warmup:
+            self.warmup.discard()
+        self.warmup = AndroidWarmup(device_udid, self)
+        self.warmup.log_message.connect(self.update_status_label)
+        self.warmup.start()
+
+    def closeEvent(self, event):
+        if self.warmup:
+            self.warmup.discard()
+            self.warmup.wait()
+        super().closeEvent(event)
+
+    def detect_android_device(self):
+        devices = get_connected_devices()
+        device_udid = devices[0] if devices else ""
+        if len(devices) > 1:
+            self.device_label.setText(f"Detected: {device_udid} (+{len(devices) - 1} more)")
+            self.toggle_button.setEnabled(True)
+            self.start_warmup()
+        elif device_udid:
             self.device_label.setText(f"Detected: {device_udid}")
             self.toggle_button.setEnabled(True)
+            self.start_warmup()
         else:
             self.device_label.setText("Device not detected")
             self.toggle_button.setEnabled(False)
@@ -383,10 +276,9 @@ class QRISAutoPayApp(QWidget):
         return devices[0] if devices else ""
 
     def update_status_label(self, message):
-        lower_msg = message.lower()
-        if "[browser]" in lower_msg:
+        if message.startswith(BROWSER_STAGES):
             self.status_browser_label.setText(f"Browser Status: {message}")
-        elif "[android]" in lower_msg:
+        elif message.startswith(ANDROID_STAGES):
             self.status_android_label.setText(f"Android Status: {message}")
         else:
             self.status_browser_label.setText(f"Browser Status: {message}")
@@ -0,0 +1,67 @@
+"""
+Compares the latency of the commands the payment flow uses through the Appium
+server and directly against the device's UiAutomator2 server. Needs a connected
+device with the bank app open on its main screen; nothing is tapped.
+
+    python -m benchmarks.bench_android_driver --udid <device> --iterations 20
+"""
+import argparse
+import os
+from time import perf_counter
+
+from appium import webdriver
+from appium.webdriver.common.appiumby import AppiumBy
+from dotenv import load_dotenv
+
+from src.android.android_automator_v2 import get_my_default_ui_automator2_options
+from src.android.ui_state import QRIS_BUTTON_ID
+from src.android.uiautomator2_driver import UiAutomator2Driver
+
+COMMANDS = [
+    ("source", lambda d: d.page_source),
+    ("current_activity", lambda d: d.current_activity),
+    ("find by id", lambda d: d.find_element(AppiumBy.ID, QRIS_BUTTON_ID)),
+    ("find by xpath", lambda d: d.find_element(AppiumBy.XPATH, f"//*[@resource-id='{QRIS_BUTTON_ID}']")),
+]
+
+
+def measure(driver, iterations):
+    results = {}
+    for name, command in COMMANDS:
+        command(driver)
+        start = perf_counter()
+        for _ in range(iterations):
+            command(driver)
+        results[name] = (perf_counter() - start) / iterations
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--udid", default=None)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    load_dotenv()
+    udid = args.udid or os.getenv("DEVICE_UDID")
+
+    # The Appium session installs and starts the UiAutomator2 server the direct driver reuses
+    appium = webdriver.Remote(os.getenv("APPIUM_SERVER_URL"), options=get_my_default_ui_automator2_options(udid))
+    try:
+        via_appium = measure(appium, args.iterations)
+    finally:
+        appium.quit()
+
+    direct = UiAutomator2Driver(udid)
+    try:
+        via_direct = measure(direct, args.iterations)
+    finally:
+        direct.quit()
+
+    print(f"{'command':<18} {'appium':>10} {'direct':>10}")
+    for name, _ in COMMANDS:
+        print(f"{name:<18} {via_appium[name] * 1000:>8.1f}ms {via_direct[name] * 1000:>8.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Measures Appium session startup and screen transition latency on a connected
+device, with the default options and with the fast profile. Nothing is paid:
+each round opens the QRIS scanner from the bank app's main screen and goes back.
+
+    python -m benchmarks.bench_android_profile --udid <device> --rounds 5
+"""
+import argparse
+import os
+from time import perf_counter
+
+from appium import webdriver
+from dotenv import load_dotenv
+
+from src.android.android_automator_v2 import get_my_default_ui_automator2_options
+from src.android.fast_profile import FastProfile
+from src.android.ui_state import UIStateDetector, center_of, QRIS_BUTTON_ID, SCREEN_MAIN, SCREEN_SCAN
+
+
+def run_case(appium_server_url, udid, fast, rounds):
+    options = get_my_default_ui_automator2_options(udid, fast=fast)
+
+    start = perf_counter()
+    driver = webdriver.Remote(appium_server_url, options=options)
+    session_time = perf_counter() - start
+
+    profile = FastProfile(udid) if fast else None
+    try:
+        if profile:
+            profile.apply(driver)
+        detector = UIStateDetector(driver)
+
+        opens, backs = [], []
+        for _ in range(rounds):
+            snapshot = detector.wait_for(SCREEN_MAIN, 30)
+            driver.tap([center_of(snapshot.find(resource_id=QRIS_BUTTON_ID))])
+
+            start = perf_counter()
+            detector.wait_for(SCREEN_SCAN, 15)
+            opens.append(perf_counter() - start)
+
+            driver.back()
+            start = perf_counter()
+            detector.wait_for(SCREEN_MAIN, 15)
+            backs.append(perf_counter() - start)
+
+        return session_time, sum(opens) / rounds, sum(backs) / rounds, detector.stats()["mean"]
+    finally:
+        if profile:
+            profile.restore()
+        driver.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--udid", default=None)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    load_dotenv()
+    appium_server_url = os.getenv("APPIUM_SERVER_URL")
+    udid = args.udid or os.getenv("DEVICE_UDID")
+
+    print(f"{'profile':<10} {'session':>10} {'open scan':>10} {'back':>10} {'snapshot':>10}")
+    for name, fast in (("default", False), ("fast", True)):
+        session_time, open_time, back_time, snapshot_time = run_case(appium_server_url, udid, fast, args.rounds)
+        print(f"{name:<10} {session_time:>9.2f}s {open_time:>9.2f}s {back_time:>9.2f}s {snapshot_time * 1000:>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+"""
+End-to-end throughput of the payment automation without a portal or phones:
+the real PaymentEngine, BrowserAutomator and AndroidAutomator run against the
+fake portal, a fake adb server and a fake Appium server whose devices walk the
+bank app's screens with configurable latencies. Reports payments per minute
+and p50/p95 per stage, and compares them with a stored baseline.
+
+    python -m benchmarks.bench_end_to_end --payments 20 --devices 2 --speed 0.1
+    python -m benchmarks.bench_end_to_end --android-only --intent --save-baseline
+
+--android-only pays pre-generated QR images with AndroidAutomator and
+MediaStager alone, for machines without Chrome. baseline.json only holds
+--android-only scenarios so far; end-to-end ones need a run with Chrome and
+--save-baseline.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+from time import perf_counter
+
+# adb_client reads the server address when src.adb_helpers is imported, so
+# it has to point at the fake server before any src module is loaded
+FAKE_ADB_PORT = int(os.getenv("FAKE_ADB_PORT", 5038))
+os.environ["ADB_SERVER_SOCKET"] = f"tcp:127.0.0.1:{FAKE_ADB_PORT}"
+
+from src.android.android_automator_v2 import AndroidAutomator, get_my_default_ui_automator2_options
+from src.android.device_pool import DEFAULT_SYSTEM_PORT
+from src.android.receipts import STATUS_SUCCESS
+from src.engine import EngineConfig, PaymentEngine
+from src.media_staging import MediaStager
+from src.metrics import metrics
+from .fake_adb import FakeAdbServer
+from .fake_appium import FakeDriverServer
+from .fake_device import FakeDevice
+from .fake_portal import FakePortal, make_png
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+PIN = "123456"
+
+
+def scenario_name(args):
+    """Baseline key; runs are only compared with the same scenario."""
+    mode = "android" if args.android_only else "e2e"
+    return "-".join([
+        mode, f"{args.devices}dev", "intent" if args.intent else "gallery", "direct" if args.direct else "appium"
+    ])
+
+
+def print_event(event):
+    print(f"[{event['stage'].upper()}] {event['message']}")
+
+
+def run_engine(args, appium, serials, user_ids, workdir):
+    portal = FakePortal(latency=args.portal_latency).start()
+    config = EngineConfig(
+        portal.base_url, portal.username, portal.password, appium.url, PIN, devices=serials,
+        prefetch_depth=args.prefetch, browser_pool_size=args.browsers,
+        receipts_path=os.path.join(workdir, "receipts.jsonl"), fast_profile=True, direct_driver=args.direct
+    )
+    try:
+        listener = print_event if args.verbose else None
+        summary = PaymentEngine(config, listener=listener).run(user_ids)
+    finally:
+        portal.stop()
+    return summary["paid"], summary["failed"], summary["elapsed"]
+
+
+def run_android(args, appium, serials, user_ids, workdir):
+    counts = {"paid": 0, "failed": 0}
+    lock = threading.Lock()
+    queue = list(user_ids)
+
+    def pay_all(index, serial):
+        options = get_my_default_ui_automator2_options(serial, DEFAULT_SYSTEM_PORT + index, fast=True)
+        automator = AndroidAutomator(appium.url, options, fast_profile=True, direct_driver=args.direct)
+        automator.set_credentials(PIN)
+        stager = MediaStager(serial)
+        stager.purge()
+        try:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    user_id = queue.pop(0)
+                filename = os.path.join(workdir, f"{user_id}.png")
+                with open(filename, "wb") as f:
+                    f.write(make_png())
+
+                with metrics.span("engine.payment", device=serial):
+                    remote_path, _, latency = stager.stage_file(filename)
+                    receipt = automator.pay_qris_transaction(remote_path if latency is not None else None, user_id)
+                    stager.release(remote_path)
+                with lock:
+                    counts["paid" if receipt.status == STATUS_SUCCESS else "failed"] += 1
+        finally:
+            automator.quit()
+
+    start = perf_counter()
+    threads = [threading.Thread(target=pay_all, args=(i, serial)) for i, serial in enumerate(serials)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts["paid"], counts["failed"], perf_counter() - start
+
+
+def compare(result, baseline, tolerance):
+    """Prints the change against baseline; returns the names of what regressed beyond tolerance."""
+    regressions = []
+    before, after = baseline["tx_per_min"], result["tx_per_min"]
+    change = (after - before) / before if before else 0.0
+    flag = change < -tolerance
+    if flag:
+        regressions.append("tx_per_min")
+    print(f"\n{'vs baseline':<22} {'before':>9} {'after':>9} {'change':>8}")
+    print(f"{'tx/min':<22} {before:>9.1f} {after:>9.1f} {change:>+7.0%}{'  REGRESSION' if flag else ''}")
+
+    for stage, stats in sorted(result["stages"].items()):
+        old = baseline["stages"].get(stage)
+        if old is None or not old["p95"]:
+            continue
+        change = (stats["p95"] - old["p95"]) / old["p95"]
+        # Sub-10ms stages are mostly scheduling noise
+        flag = change > tolerance and stats["p95"] - old["p95"] > 0.01
+        if flag:
+            regressions.append(stage)
+        print(f"{stage + ' p95':<22} {old['p95']:>8.3f}s {stats['p95']:>8.3f}s {change:>+7.0%}{'  REGRESSION' if flag else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--payments", type=int, default=20)
+    parser.add_argument("--devices", type=int, default=1)
+    parser.add_argument("--browsers", type=int, default=1)
+    parser.add_argument("--prefetch", type=int, default=3)
+    parser.add_argument("--speed", type=float, default=0.1,
+                        help="scales the simulated screen latencies (1.0 is a real mid-range phone)")
+    parser.add_argument("--portal-latency", type=float, default=0.0, help="seconds added to every portal request")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="share of payments the bank app rejects")
+    parser.add_argument("--intent", action="store_true", help="devices accept the QR image by SEND intent")
+    parser.add_argument("--direct", action="store_true", help="use the direct UiAutomator2 driver")
+    parser.add_argument("--android-only", action="store_true", help="skip the browser stage (no Chrome needed)")
+    parser.add_argument("--verbose", action="store_true", help="print the engine's events")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the scenario's baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="relative slowdown reported as a regression (exit status 1)")
+    args = parser.parse_args()
+
+    devices = [
+        FakeDevice(f"fake-{i + 1}", speed=args.speed, fail_rate=args.fail_rate, intent=args.intent, seed=i)
+        for i in range(args.devices)
+    ]
+    adb = FakeAdbServer(devices, port=FAKE_ADB_PORT).start()
+    drivers = [FakeDriverServer([device]).start() for device in devices]
+    for device, driver in zip(devices, drivers):
+        device.driver_port = driver.port
+    appium = FakeDriverServer(devices).start()
+
+    serials = [device.serial for device in devices]
+    user_ids = [f"U{i:06d}" for i in range(args.payments)]
+    scenario = scenario_name(args)
+    print(f"Scenario {scenario}: {args.payments} payments, speed {args.speed}")
+
+    metrics.reset()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            run = run_android if args.android_only else run_engine
+            paid, failed, elapsed = run(args, appium, serials, user_ids, workdir)
+    finally:
+        for server in [appium, adb] + drivers:
+            server.stop()
+
+    snapshot = metrics.snapshot(by_stage=True)
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "tolerance", "verbose")},
+        "tx_per_min": paid / elapsed * 60 if elapsed else 0.0,
+        "stages": {s["stage"]: {"p50": s["p50"], "p95": s["p95"], "count": s["count"]} for s in snapshot["spans"]},
+    }
+
+    print(f"\n{paid} paid, {failed} failed in {elapsed:.1f}s: {result['tx_per_min']:.1f} tx/min\n")
+    print(f"{'stage':<22} {'count':>6} {'p50':>9} {'p95':>9}")
+    for stage, stats in sorted(result["stages"].items()):
+        print(f"{stage:<22} {stats['count']:>6} {stats['p50']:>8.3f}s {stats['p95']:>8.3f}s")
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baselines = json.load(f)
+
+    regressions = []
+    baseline = baselines.get(scenario)
+    if baseline is None:
+        print(f"\nNo baseline for {scenario} in {args.baseline}, store one with --save-baseline")
+    elif baseline["config"] != result["config"]:
+        print(f"\nThe baseline for {scenario} was taken with other settings, not comparing: {baseline['config']}")
+    else:
+        regressions = compare(result, baseline, args.tolerance)
+
+    if args.save_baseline:
+        baselines[scenario] = result
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline for {scenario} saved to {args.baseline}")
+
+    if regressions:
+        print(f"\nRegressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
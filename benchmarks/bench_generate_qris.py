@@ -0,0 +1,72 @@
+"""
+Benchmarks QRIS generation against the local fake portal: typing the user ids
+with send_keys versus setting the field in one JS call, and the time until the
+first QRIS is downloaded with and without chunked submission.
+
+    python -m benchmarks.bench_generate_qris --sizes 100 1000 10000
+"""
+import argparse
+import os
+from time import perf_counter
+
+from src.browser.browser_automator_v2 import BrowserAutomator, get_my_default_chrome_options
+from .fake_portal import FakePortal
+
+
+def run_case(portal, user_ids, bulk_input, chunk_size):
+    automator = BrowserAutomator(
+        portal.base_url, get_my_default_chrome_options(), http_fetch=True,
+        bulk_input=bulk_input, chunk_size=chunk_size
+    )
+    try:
+        automator.set_credentials(portal.username, portal.password)
+        automator.setup()
+        automator.set_user_ids(user_ids)
+
+        start = perf_counter()
+        automator.generate_QRIS()
+        generated = perf_counter() - start
+
+        filename = automator.download_QRIS(0, next=False)
+        first_qris = perf_counter() - start
+
+        return generated, first_qris, filename is not None
+    finally:
+        automator.quit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--send-keys-max", type=int, default=1000,
+                        help="skip send_keys above this many ids, it takes minutes")
+    args = parser.parse_args()
+
+    os.makedirs("screenshots", exist_ok=True)
+    portal = FakePortal().start()
+
+    cases = [
+        ("send_keys", False, None),
+        ("js", True, None),
+        (f"js+chunk{args.chunk_size}", True, args.chunk_size),
+    ]
+
+    print(f"{'ids':>6}  {'mode':<14} {'generate':>10} {'first QRIS':>11}")
+    try:
+        for size in args.sizes:
+            user_ids = [f"U{i:06d}" for i in range(size)]
+            for name, bulk_input, chunk_size in cases:
+                if not bulk_input and size > args.send_keys_max:
+                    print(f"{size:>6}  {name:<14} {'skipped':>10}")
+                    continue
+
+                generated, first_qris, ok = run_case(portal, user_ids, bulk_input, chunk_size)
+                status = "" if ok else "  (download failed)"
+                print(f"{size:>6}  {name:<14} {generated:>9.2f}s {first_qris:>10.2f}s{status}")
+    finally:
+        portal.stop()
+
+
+if __name__ == "__main__":
+    main()
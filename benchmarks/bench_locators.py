@@ -0,0 +1,70 @@
+"""
+Compares element lookup cost on the fake portal's result page: re-resolving the
+original absolute XPaths on every call versus the cached LocatorRegistry.
+
+    python -m benchmarks.bench_locators --iterations 200
+"""
+import argparse
+from time import perf_counter
+
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+
+from src.browser.browser_automator_v2 import get_my_default_chrome_options
+from src.browser.locators import LocatorRegistry, NEXT_BUTTON, TOPUP_NAV
+from .fake_portal import FakePortal
+
+CASES = [
+    (NEXT_BUTTON, "//*[@id='paginationControls']/button[2]"),
+    (TOPUP_NAV, "//*[@id='navbarNav']/ul/li[4]/a"),
+]
+
+
+def open_result_page(driver, portal):
+    driver.implicitly_wait(5)
+    driver.get(portal.base_url)
+    driver.find_element(By.XPATH, "/html/body/div/form/div[1]/input").send_keys(portal.username)
+    driver.find_element(By.XPATH, "/html/body/div/form/div[2]/input").send_keys(portal.password)
+    driver.find_element(By.XPATH, "/html/body/div/form/button").click()
+    driver.get(f"{portal.base_url}/topup.php")
+    driver.find_element(By.ID, "user_ids").send_keys("U1\nU2\nU3")
+    driver.find_element(By.XPATH, "/html/body/div/form/div[2]/input").click()
+    driver.find_element(By.ID, "paginationControls")
+    driver.implicitly_wait(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    portal = FakePortal().start()
+    driver = webdriver.Chrome(options=get_my_default_chrome_options())
+    try:
+        open_result_page(driver, portal)
+        registry = LocatorRegistry(driver)
+
+        print(f"{'element':<16} {'xpath':>10} {'registry':>10}")
+        for locator, x_path in CASES:
+            start = perf_counter()
+            for _ in range(args.iterations):
+                driver.find_element(By.XPATH, x_path)
+            before = (perf_counter() - start) / args.iterations
+
+            start = perf_counter()
+            for _ in range(args.iterations):
+                registry.find(locator)
+            after = (perf_counter() - start) / args.iterations
+
+            print(f"{locator.name:<16} {before * 1000:>8.2f}ms {after * 1000:>8.2f}ms")
+
+        print()
+        for name, s in registry.stats().items():
+            print(f"{name}: {s}")
+    finally:
+        driver.quit()
+        portal.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+A stand-in for the adb server, speaking the host protocol AdbClient uses
+(host:devices, transport, forward and killforward, exec, a persistent exec:sh and sync SEND)
+for a set of FakeDevices. exec understands the device commands the
+automation runs: MediaStore content insert/query/delete, media scans,
+resolve-activity and am start for the image intent, settings, and a
+streaming logcat of activity resumes.
+
+    adb = FakeAdbServer([FakeDevice("fake-1")]).start()
+    os.environ["ADB_SERVER_SOCKET"] = f"tcp:127.0.0.1:{adb.port}"
+"""
+import re
+import shlex
+import socket
+import socketserver
+import struct
+import threading
+
+from src.android.ui_state import BANK_PKG
+
+from .fake_device import PAY_ACTIVITY
+
+SHELL_LINE = re.compile(r"^\( (.*) \) </dev/null 2>&1; echo (\S+) \$\?$")
+LOGCAT_LINE = "{timestamp:.3f}  1234  1250 I wm_on_resume_called: [87241321,{activity},RESUME_ACTIVITY]\n"
+
+
+class ShellError(Exception):
+    """A command that fails on the device, with its output and exit status."""
+
+    def __init__(self, output, status):
+        super().__init__(output)
+        self.output = output
+        self.status = status
+
+
+def _okay(payload = None):
+    if payload is None:
+        return b"OKAY"
+    data = payload.encode("utf-8")
+    return b"OKAY" + f"{len(data):04x}".encode("ascii") + data
+
+
+def _fail(message):
+    data = message.encode("utf-8")
+    return b"FAIL" + f"{len(data):04x}".encode("ascii") + data
+
+
+class AdbRequestHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.device = None
+
+    def read_exactly(self, n):
+        chunks = []
+        while n > 0:
+            chunk = self.request.recv(n)
+            if not chunk:
+                raise ConnectionError("client went away")
+            chunks.append(chunk)
+            n -= len(chunk)
+        return b"".join(chunks)
+
+    def read_request(self):
+        length = int(self.read_exactly(4), 16)
+        return self.read_exactly(length).decode("utf-8")
+
+    def handle(self):
+        try:
+            while True:
+                request = self.read_request()
+                if not self.dispatch(request):
+                    return
+        except (ConnectionError, OSError, ValueError):
+            return
+
+    def dispatch(self, request):
+        """Answers one request; True if the connection carries another one."""
+        server = self.server
+        if request == "host:devices":
+            listing = "".join(f"{serial}\tdevice\n" for serial in server.devices)
+            self.request.sendall(_okay(listing))
+            return False
+
+        if request.startswith("host:transport"):
+            serial = request.split(":", 2)[2] if request.startswith("host:transport:") else None
+            self.device = server.device(serial)
+            if self.device is None:
+                self.request.sendall(_fail(f"device '{serial}' not found"))
+                return False
+            self.request.sendall(_okay())
+            return True
+
+        match = re.match(r"host(?:-serial:([^:]+))?:forward:tcp:(\d+);tcp:\d+$", request)
+        if match:
+            device = server.device(match.group(1))
+            if device is None or device.driver_port is None:
+                self.request.sendall(_fail("cannot forward"))
+                return False
+            # Acknowledges the request, then the forward and its bound port
+            server.forwards[f"tcp:{device.driver_port}"] = device.serial
+            self.request.sendall(b"OKAY" + _okay(str(device.driver_port)))
+            return False
+
+        match = re.match(r"host(?:-serial:[^:]+)?:killforward:(tcp:\d+)$", request)
+        if match:
+            if server.forwards.pop(match.group(1), None) is None:
+                self.request.sendall(_fail(f"listener '{match.group(1)}' not found"))
+            else:
+                self.request.sendall(_okay())
+            return False
+
+        if self.device is None:
+            self.request.sendall(_fail(f"unknown host service {request}"))
+            return False
+
+        if request.startswith("exec:"):
+            self.request.sendall(_okay())
+            self.exec(request[len("exec:"):])
+            return False
+
+        if request == "sync:":
+            self.request.sendall(_okay())
+            self.sync()
+            return False
+
+        self.request.sendall(_fail(f"closed: {request}"))
+        return False
+
+    # exec
+
+    def exec(self, command):
+        if command.startswith("logcat"):
+            self.stream_logcat()
+        elif command == "sh":
+            self.interactive_shell()
+        elif command.startswith("am instrument"):
+            # The instrumentation lives as long as the connection
+            while self.request.recv(4096):
+                pass
+        else:
+            match = SHELL_LINE.match(command)
+            if match is None:
+                self.request.sendall(self.run_all(command)[0].encode("utf-8"))
+            else:
+                self.request.sendall(self.run_marked(*match.groups()))
+
+    def interactive_shell(self):
+        """Runs the `( command ) </dev/null 2>&1; echo <marker> $?` lines AdbShell writes."""
+        buffer = b""
+        while True:
+            chunk = self.request.recv(4096)
+            if not chunk:
+                return
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                match = SHELL_LINE.match(line.decode("utf-8"))
+                if match is None:
+                    self.request.sendall(f"/system/bin/sh: syntax error: {line!r}\n".encode("utf-8"))
+                    continue
+                self.request.sendall(self.run_marked(*match.groups()))
+
+    def run_marked(self, command, marker):
+        output, status = self.run_all(command)
+        return f"{output}{marker} {status}\n".encode("utf-8")
+
+    def run_all(self, command):
+        """Runs the ;-separated parts of command; returns the output and the last part's status."""
+        output, status = "", 0
+        for part in command.split(";"):
+            if part.strip():
+                try:
+                    output, status = output + self.run(part.strip()), 0
+                except ShellError as e:
+                    output, status = output + e.output, e.status
+        return output, status
+
+    def run(self, command):
+        device = self.device
+        try:
+            args = shlex.split(command)
+        except ValueError:
+            raise ShellError(f"/system/bin/sh: syntax error: {command}\n", 2)
+        if not args:
+            return ""
+
+        if args[:2] == ["content", "insert"]:
+            binds = [args[i + 1] for i, arg in enumerate(args[:-1]) if arg == "--bind"]
+            path = next((b.split(":", 2)[2] for b in binds if b.startswith("_data:")), "")
+            if path in device.files:
+                device.index(path)
+            return ""
+
+        if args[:2] == ["content", "query"]:
+            where = self.option(args, "--where") or ""
+            projection = self.option(args, "--projection") or "_id"
+            paths = {p.replace("''", "'") for p in re.findall(r"'((?:[^']|'')*)'", where)}
+            rows = []
+            for media_id, path in sorted(device.media.items()):
+                if path in paths:
+                    value = path if projection == "_data" else media_id
+                    rows.append(f"Row: {len(rows)} {projection}={value}\n")
+            return "".join(rows) or "No result found.\n"
+
+        if args[:2] == ["content", "delete"]:
+            where = self.option(args, "--where") or ""
+            match = re.search(r"_data LIKE '(.*)%'", where)
+            if match:
+                device.delete(prefix=match.group(1).replace("''", "'"))
+            else:
+                match = re.search(r"_data='(.*)'", where)
+                if match:
+                    device.delete(path=match.group(1).replace("''", "'"))
+            return ""
+
+        if args[:2] == ["am", "broadcast"]:
+            uri = self.option(args, "-d") or ""
+            if uri.startswith("file://"):
+                device.index(uri[len("file://"):])
+            return "Broadcast completed: result=0\n"
+
+        if args[:2] == ["am", "start"]:
+            uri = self.option(args, "android.intent.extra.STREAM") or self.option(args, "-d") or ""
+            if device.intent and device.open_by_intent(uri):
+                return f"Starting: Intent {{ cmp={self.option(args, '-n')} }}\n"
+            return "Error: Activity not started, unable to resolve Intent\n"
+
+        if args[:3] == ["cmd", "package", "resolve-activity"]:
+            action = self.option(args, "-a")
+            if device.intent and action == "android.intent.action.SEND":
+                return f"priority=0 preferredOrder=0 match=0x608000 specificIndex=-1 isDefault=true\n{BANK_PKG}/{PAY_ACTIVITY}\n"
+            return "No activity found\n"
+
+        if args[:2] == ["settings", "get"]:
+            return device.settings.get(args[3], "1.0") + "\n"
+        if args[:2] == ["settings", "put"]:
+            device.settings[args[3]] = args[4]
+            return ""
+        if args[:2] == ["settings", "delete"]:
+            device.settings.pop(args[3], None)
+            return "Deleted 1 rows\n"
+
+        if args[0] == "rm":
+            for path in args[1:]:
+                if path.endswith("/*"):
+                    for name in [f for f in device.files if f.startswith(path[:-1])]:
+                        del device.files[name]
+                else:
+                    device.files.pop(path, None)
+            return ""
+
+        if args[0] in ("mkdir", "echo", "true"):
+            return " ".join(args[1:]) + "\n" if args[0] == "echo" else ""
+
+        raise ShellError(f"/system/bin/sh: {args[0]}: not found\n", 127)
+
+    @staticmethod
+    def option(args, name):
+        """The argument after the last name in args, or None."""
+        for i in range(len(args) - 2, -1, -1):
+            if args[i] == name:
+                return args[i + 1]
+        return None
+
+    def stream_logcat(self):
+        stop = threading.Event()
+
+        def watch_disconnect():
+            try:
+                while self.request.recv(4096):
+                    pass
+            except OSError:
+                pass
+            stop.set()
+
+        threading.Thread(target=watch_disconnect, daemon=True).start()
+        try:
+            for timestamp, activity in self.device.follow_resumes(stop):
+                self.request.sendall(LOGCAT_LINE.format(timestamp=timestamp, activity=activity).encode("utf-8"))
+        except OSError:
+            stop.set()
+
+    # sync
+
+    def sync(self):
+        path = None
+        chunks = []
+        while True:
+            command = self.read_exactly(4)
+            length = struct.unpack("<I", self.read_exactly(4))[0]
+            if command == b"SEND":
+                path = self.read_exactly(length).decode("utf-8").rsplit(",", 1)[0]
+                chunks = []
+            elif command == b"DATA":
+                chunks.append(self.read_exactly(length))
+            elif command == b"DONE":
+                self.device.files[path] = b"".join(chunks)
+                self.request.sendall(b"OKAY" + struct.pack("<I", 0))
+            elif command == b"QUIT":
+                return
+            else:
+                message = f"unknown sync command {command!r}".encode("utf-8")
+                self.request.sendall(b"FAIL" + struct.pack("<I", len(message)) + message)
+                return
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, devices, host = "127.0.0.1", port = 0):
+        super().__init__((host, port), AdbRequestHandler)
+        self.devices = {device.serial: device for device in devices}
+        # Host side of every forward still in place, to its device's serial
+        self.forwards = {}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def device(self, serial = None):
+        if serial is None:
+            return next(iter(self.devices.values()), None)
+        return self.devices.get(serial)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
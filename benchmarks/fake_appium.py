@@ -0,0 +1,168 @@
+"""
+A stand-in for the Appium server and the UiAutomator2 server on the device,
+answering the WebDriver commands the payment flow sends for FakeDevices:
+session create/delete, page source, current activity, settings, finding the
+PIN field and typing into it, taps (W3C actions from the Appium client or
+/appium/tap from UiAutomator2Driver) and back. Paths work with and without
+the /wd/hub prefix.
+
+One server for all devices plays Appium (sessions pick their device by
+appium:udid); one per device plays its UiAutomator2 server, reached through
+the fake adb forward.
+"""
+import json
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.android.uiautomator2_driver import ELEMENT_KEY
+
+PIN_ELEMENT = "pin-field"
+
+
+def _capability(capabilities, name):
+    for caps in [capabilities.get("alwaysMatch", {})] + capabilities.get("firstMatch", [{}]):
+        for key in (f"appium:{name}", name):
+            if key in caps:
+                return caps[key]
+    return None
+
+
+def _tap_point(actions):
+    """(x, y) of the first pointer move of a W3C actions body, or None."""
+    for source in actions:
+        if source.get("type") != "pointer":
+            continue
+        for action in source.get("actions", []):
+            if action.get("type") == "pointerMove":
+                return action.get("x"), action.get("y")
+    return None
+
+
+class DriverRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    def reply(self, value, status = 200, session_id = None):
+        payload = {"value": value}
+        if session_id is not None:
+            payload["sessionId"] = session_id
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, error, message):
+        self.reply({"error": error, "message": message, "stacktrace": ""}, status)
+
+    def route(self, method):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}") if length else {}
+        path = self.path.split("?")[0]
+        if path.startswith("/wd/hub"):
+            path = path[len("/wd/hub"):]
+
+        if path == "/status":
+            self.reply({"ready": True, "message": "fake driver ready"})
+            return
+
+        if path == "/session" and method == "POST":
+            capabilities = body.get("capabilities", {})
+            device = self.server.device(_capability(capabilities, "udid"))
+            if device is None:
+                self.error(500, "session not created", "no such device")
+                return
+            session_id = uuid.uuid4().hex
+            self.server.sessions[session_id] = device
+            self.reply({"sessionId": session_id, "capabilities": {"platformName": "Android",
+                                                                  "deviceUDID": device.serial}},
+                       session_id=session_id)
+            return
+
+        match = re.match(r"^/session/([^/]+)(/.*)?$", path)
+        device = self.server.sessions.get(match.group(1)) if match else None
+        if device is None:
+            self.error(404, "invalid session id", f"unknown session for {path}")
+            return
+        command = match.group(2) or ""
+
+        if command == "" and method == "DELETE":
+            self.server.sessions.pop(match.group(1), None)
+            self.reply(None)
+        elif command == "/source":
+            self.reply(device.source())
+        elif command == "/appium/device/current_activity":
+            self.reply(device.current_activity())
+        elif command == "/appium/device/current_package":
+            self.reply(device.current_activity().split("/")[0])
+        elif command == "/appium/settings":
+            self.reply(None if method == "POST" else {})
+        elif command == "/element" and method == "POST":
+            value = body.get("value") or body.get("selector")
+            if value == "android.widget.EditText" and device.screen == "pin":
+                self.reply({ELEMENT_KEY: PIN_ELEMENT, "ELEMENT": PIN_ELEMENT})
+            else:
+                self.error(404, "no such element", f"{value} not found")
+        elif command == f"/element/{PIN_ELEMENT}/value":
+            text = body.get("text") or "".join(body.get("value", []))
+            device.enter_text(text)
+            self.reply(None)
+        elif command == "/actions" and method == "POST":
+            point = _tap_point(body.get("actions", []))
+            if point is not None:
+                device.tap(*point)
+            self.reply(None)
+        elif command == "/actions" and method == "DELETE":
+            self.reply(None)
+        elif command == "/appium/tap":
+            device.tap(body.get("x"), body.get("y"))
+            self.reply(None)
+        elif command == "/back":
+            device.back()
+            self.reply(None)
+        else:
+            self.error(404, "unknown command", f"{method} {command} is not supported by the fake driver")
+
+
+class FakeDriverServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, devices, host = "127.0.0.1", port = 0):
+        super().__init__((host, port), DriverRequestHandler)
+        self.devices = {device.serial: device for device in devices}
+        self.sessions = {}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def device(self, udid = None):
+        if udid is None and len(self.devices) == 1:
+            return next(iter(self.devices.values()))
+        return self.devices.get(udid)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
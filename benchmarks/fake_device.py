@@ -0,0 +1,234 @@
+"""
+Simulated phone running the bank app, shared by the fake adb server and the
+fake Appium/UiAutomator2 endpoint. It walks the same screens as the real
+com.bnc.finance payment flow (main, scanner, gallery, pay, PIN, result), each
+appearing a configurable latency after the tap that leads to it, and logs an
+activity resume for every screen like logcat's events buffer does.
+"""
+import random
+import threading
+from datetime import datetime
+from time import monotonic, sleep, time
+
+from src.android.ui_state import BANK_PKG, QRIS_BUTTON_ID, CONFIRM_BUTTON_ID, PIN_DIALOG_TEXT
+
+GALLERY_PKG = "com.google.android.apps.photos"
+PAY_ACTIVITY = ".qrcode.activity.QrisPayActivity"
+
+# Seconds from the tap to the next screen, roughly what a mid-range phone shows
+DEFAULT_LATENCIES = {
+    "open_scan": 0.8,
+    "open_gallery": 0.6,
+    "decode": 1.0,
+    "intent": 0.7,
+    "confirm": 0.5,
+    "pay": 1.5,
+    "finish": 0.5,
+    "back": 0.3,
+}
+
+ACTIVITIES = {
+    "main": "com.bnc.finance.MainActivity",
+    "scan": "com.bnc.finance.qrcode.activity.ScanQrisActivity",
+    "gallery": "com.google.android.apps.photos.picker.PickerActivity",
+    "pay": "com.bnc.finance" + PAY_ACTIVITY,
+    "pin": "com.bnc.finance.pin.PinActivity",
+    "result": "com.bnc.finance.qrcode.activity.PayResultActivity",
+    "error": "com.bnc.finance.qrcode.activity.PayResultActivity",
+}
+
+SCREEN_BOUNDS = "[0,0][1080,2400]"
+QRIS_BUTTON_BOUNDS = (440, 2150, 640, 2350)
+GALLERY_BUTTON_BOUNDS = (480, 1240, 630, 1380)
+FIRST_ITEM_BOUNDS = (0, 480, 360, 840)
+CONFIRM_BUTTON_BOUNDS = (60, 2180, 1020, 2320)
+
+
+def _bounds(box):
+    x1, y1, x2, y2 = box
+    return f"[{x1},{y1}][{x2},{y2}]"
+
+
+def _inside(box, x, y):
+    x1, y1, x2, y2 = box
+    return x1 <= x <= x2 and y1 <= y <= y2
+
+
+def _node(package, resource_id = "", text = "", class_name = "android.widget.TextView", bounds = SCREEN_BOUNDS):
+    return (f'<node text="{text}" resource-id="{resource_id}" class="{class_name}" package="{package}" '
+            f'clickable="true" bounds="{bounds}"/>')
+
+
+def _hierarchy(nodes):
+    return '<?xml version="1.0" encoding="UTF-8"?><hierarchy rotation="0">' + "".join(nodes) + "</hierarchy>"
+
+
+class FakeDevice:
+    """
+    One phone. latencies override DEFAULT_LATENCIES (scaled by speed);
+    fail_rate is the share of payments that end on the error screen and
+    intent makes the bank app accept the QR image by SEND intent.
+    """
+
+    def __init__(self, serial, latencies = None, speed = 1.0, fail_rate = 0.0, intent = False, seed = None):
+        self.serial = serial
+        self.latencies = {k: v * speed for k, v in dict(DEFAULT_LATENCIES, **(latencies or {})).items()}
+        self.fail_rate = fail_rate
+        self.intent = intent
+        self.driver_port = None
+
+        self.files = {}
+        self.media = {}
+        self.settings = {}
+        self.payments = 0
+
+        self.__random = random.Random(seed)
+        self.__media_ids = 0
+        self.__screen = "main"
+        self.__pending = None
+        self.__amount = 0
+        self.__reference = ""
+        self.__resumes = []
+        self.__condition = threading.Condition()
+
+    # Screens
+
+    def __advance(self):
+        # Called with the condition held
+        if self.__pending is not None and monotonic() >= self.__pending[1]:
+            self.__screen = self.__pending[0]
+            self.__pending = None
+            self.__resumes.append((time(), ACTIVITIES[self.__screen]))
+            self.__condition.notify_all()
+
+    def __go(self, screen, latency):
+        self.__pending = (screen, monotonic() + self.latencies[latency])
+
+    @property
+    def screen(self):
+        with self.__condition:
+            self.__advance()
+            return self.__screen
+
+    def source(self):
+        with self.__condition:
+            self.__advance()
+            screen = self.__screen
+            amount = self.__amount
+            reference = self.__reference
+
+        bank = BANK_PKG
+        if screen == "main":
+            nodes = [_node(bank, text="Saldo"), _node(bank, QRIS_BUTTON_ID, class_name="android.widget.ImageView",
+                                                      bounds=_bounds(QRIS_BUTTON_BOUNDS))]
+        elif screen == "scan":
+            nodes = [_node(bank, f"{bank}:id/scan_preview", class_name="android.view.View"),
+                     _node(bank, f"{bank}:id/iv_album", class_name="android.widget.ImageView",
+                           bounds=_bounds(GALLERY_BUTTON_BOUNDS))]
+        elif screen == "gallery":
+            nodes = [_node(GALLERY_PKG, text="Photos"),
+                     _node(GALLERY_PKG, class_name="android.widget.ImageView", bounds=_bounds(FIRST_ITEM_BOUNDS))]
+        elif screen == "pay":
+            nodes = [_node(bank, text="Toko Sukses Jaya"), _node(bank, text=f"Rp{amount:,}".replace(",", ".")),
+                     _node(bank, CONFIRM_BUTTON_ID, "Bayar", "android.widget.Button", _bounds(CONFIRM_BUTTON_BOUNDS))]
+        elif screen == "pin":
+            nodes = [_node(bank, text=PIN_DIALOG_TEXT), _node(bank, class_name="android.widget.EditText")]
+        elif screen == "result":
+            nodes = [_node(bank, text="Transaksi Berhasil"), _node(bank, text="Total"),
+                     _node(bank, text=f"Rp{amount:,}".replace(",", ".")), _node(bank, text="Merchant"),
+                     _node(bank, text="Toko Sukses Jaya"), _node(bank, text="No. Referensi"), _node(bank, text=reference),
+                     _node(bank, text="Waktu"), _node(bank, text=datetime.now().strftime("%d %b %Y %H:%M")),
+                     _node(bank, CONFIRM_BUTTON_ID, "Selesai", "android.widget.Button", _bounds(CONFIRM_BUTTON_BOUNDS))]
+        else:
+            nodes = [_node(bank, text="Transaksi Gagal"), _node(bank, text="Merchant"),
+                     _node(bank, text="Toko Sukses Jaya"),
+                     _node(bank, CONFIRM_BUTTON_ID, "Tutup", "android.widget.Button", _bounds(CONFIRM_BUTTON_BOUNDS))]
+        return _hierarchy(nodes)
+
+    def current_activity(self):
+        with self.__condition:
+            self.__advance()
+            return ACTIVITIES[self.__screen].replace(BANK_PKG, "")
+
+    def tap(self, x, y):
+        with self.__condition:
+            self.__advance()
+            if self.__pending is not None:
+                return
+            screen = self.__screen
+            if screen == "main" and _inside(QRIS_BUTTON_BOUNDS, x, y):
+                self.__go("scan", "open_scan")
+            elif screen == "scan" and _inside(GALLERY_BUTTON_BOUNDS, x, y):
+                self.__go("gallery", "open_gallery")
+            elif screen == "gallery" and _inside(FIRST_ITEM_BOUNDS, x, y):
+                self.__new_payment()
+                self.__go("pay", "decode")
+            elif screen == "pay" and _inside(CONFIRM_BUTTON_BOUNDS, x, y):
+                self.__go("pin", "confirm")
+            elif screen in ("result", "error") and _inside(CONFIRM_BUTTON_BOUNDS, x, y):
+                self.__go("main", "finish")
+
+    def back(self):
+        with self.__condition:
+            self.__advance()
+            if self.__screen != "main":
+                self.__go("main", "back")
+
+    def enter_text(self, text):
+        with self.__condition:
+            self.__advance()
+            if self.__screen == "pin" and self.__pending is None and text:
+                self.payments += 1
+                failed = self.__random.random() < self.fail_rate
+                self.__go("error" if failed else "result", "pay")
+
+    def open_by_intent(self, uri):
+        """`am start` of the pay activity with a media URI; True if the image exists."""
+        media_id = uri.rsplit("/", 1)[-1]
+        with self.__condition:
+            self.__advance()
+            if not media_id.isdigit() or int(media_id) not in self.media:
+                return False
+            self.__new_payment()
+            self.__go("pay", "intent")
+            return True
+
+    def __new_payment(self):
+        self.__amount = self.__random.randrange(10, 500) * 1000
+        self.__reference = f"{self.__random.randrange(10 ** 11, 10 ** 12)}"
+
+    # Storage
+
+    def index(self, path):
+        if path not in self.files:
+            return None
+        for media_id, media_path in self.media.items():
+            if media_path == path:
+                return media_id
+        self.__media_ids += 1
+        self.media[self.__media_ids] = path
+        return self.__media_ids
+
+    def delete(self, path = None, prefix = None):
+        for media_id, media_path in list(self.media.items()):
+            if media_path == path or (prefix is not None and media_path.startswith(prefix)):
+                del self.media[media_id]
+
+    # logcat
+
+    def follow_resumes(self, stop):
+        """Yields (timestamp, activity) for every screen shown from now on, until stop is set."""
+        with self.__condition:
+            seen = len(self.__resumes)
+        while not stop.is_set():
+            with self.__condition:
+                self.__advance()
+                if len(self.__resumes) == seen:
+                    # Transitions are lazy, so wake up to apply a due one
+                    self.__condition.wait(0.02)
+                    self.__advance()
+                resumes = self.__resumes[seen:]
+            seen += len(resumes)
+            yield from resumes
+            if not resumes:
+                sleep(0)
@@ -0,0 +1,264 @@
+"""
+Local stand-in for the topup web portal, serving the same page structure the
+BrowserAutomator drives: login form, navbar, #user_ids topup form, and a result
+page with #iframeContainer and #paginationControls.
+
+    python -m benchmarks.fake_portal --port 8000
+"""
+import argparse
+import json
+import secrets
+import struct
+import threading
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlsplit
+
+from src.qris import crc16_ccitt
+
+LOGIN_PAGE = """<!DOCTYPE html>
+<html><body>
+<div><form method="post" action="/login">
+<div><input name="username" type="text"></div>
+<div><input name="password" type="password"></div>
+<button type="submit">Login</button>
+</form></div>
+</body></html>"""
+
+NAVBAR = """<nav><div id="navbarNav"><ul>
+<li><a href="/">Home</a></li><li><a href="/">History</a></li><li><a href="/">Users</a></li>
+<li><a href="/topup.php">Topup</a></li>
+</ul></div></nav>"""
+
+HOME_PAGE = """<!DOCTYPE html>
+<html><body>""" + NAVBAR + """<div><p>Welcome</p></div></body></html>"""
+
+TOPUP_PAGE = """<!DOCTYPE html>
+<html><body>""" + NAVBAR + """
+<div><form method="post" action="/topup.php">
+<div><textarea id="user_ids" name="user_ids"></textarea></div>
+<div><input type="submit" value="Generate"></div>
+</form></div>
+</body></html>"""
+
+RESULT_PAGE = """<!DOCTYPE html>
+<html><body>""" + NAVBAR + """
+<div id="iframeContainer"></div>
+<div id="paginationControls"><button onclick="show(page - 1)">Prev</button><button onclick="show(page + 1)">Next</button></div>
+<script>
+var payments = __PAYMENTS__;
+var page = 0;
+function show(i) {
+    if (i < 0 || i >= payments.length) return;
+    page = i;
+    setTimeout(function () {
+        document.getElementById('iframeContainer').innerHTML =
+            '<a href="' + payments[i].url + '" target="_blank">Pay ' + payments[i].user_id + '</a>';
+    }, __RENDER_DELAY_MS__);
+}
+show(0);
+</script>
+</body></html>"""
+
+PAYMENT_PAGE = """<!DOCTYPE html>
+<html><body>
+<h3>Scan to pay</h3>
+<img id="qr" src="/qr/__TOKEN__.png" width="300" height="300">
+<p class="payload" style="display:none">__PAYLOAD__</p>
+</body></html>"""
+
+
+def _tlv(tag, value):
+    return f"{tag}{len(value):02d}{value}"
+
+
+def make_payload(user_id: str):
+    """Builds a CRC-valid EMVCo QRIS payload carrying user_id as the bill number."""
+    body = (
+        _tlv("00", "01") + _tlv("01", "12")
+        + _tlv("26", _tlv("00", "ID.CO.FAKE.WWW") + _tlv("01", "FAKE01"))
+        + _tlv("52", "4814") + _tlv("53", "360") + _tlv("58", "ID")
+        + _tlv("59", "FAKE SHOP") + _tlv("60", "JAKARTA")
+        + _tlv("62", _tlv("01", user_id[:25]))
+        + "6304"
+    )
+    return body + f"{crc16_ccitt(body):04X}"
+
+
+def make_png(size = 64):
+    """A plain white grayscale PNG, enough for the screenshot/image code paths."""
+    raw = b"".join(b"\x00" + b"\xff" * size for _ in range(size))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+class FakePortal:
+    """
+    Threaded HTTP server holding per-session state in memory. latency is added
+    to every request, render_delay to each pagination step.
+    """
+
+    def __init__(self, host = "127.0.0.1", port = 0, latency = 0.0, render_delay = 0.0,
+                 username = "user", password = "pass"):
+        self.latency = latency
+        self.render_delay = render_delay
+        self.username = username
+        self.password = password
+
+        self.sessions = {}
+        self.payments = {}
+        self.request_count = 0
+        self.__lock = threading.Lock()
+
+        handler = type("Handler", (PortalRequestHandler,), {"portal": self})
+        self.__server = ThreadingHTTPServer((host, port), handler)
+        self.__thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.__server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+
+    def create_session(self):
+        token = secrets.token_hex(16)
+        with self.__lock:
+            self.sessions[token] = {"payments": []}
+        return token
+
+    def generate(self, session, user_ids):
+        payments = []
+        with self.__lock:
+            for user_id in user_ids:
+                token = secrets.token_hex(8)
+                self.payments[token] = {"user_id": user_id, "payload": make_payload(user_id)}
+                payments.append({"user_id": user_id, "url": f"{self.base_url}/pay/{token}"})
+            session["payments"] = payments
+        return payments
+
+    def count_request(self):
+        with self.__lock:
+            self.request_count += 1
+
+
+class PortalRequestHandler(BaseHTTPRequestHandler):
+    portal = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def __session(self):
+        cookies = self.headers.get("Cookie", "")
+        for part in cookies.split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == "PHPSESSID":
+                return self.portal.sessions.get(value)
+        return None
+
+    def __send(self, status, body, content_type = "text/html; charset=utf-8", headers = None):
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __redirect(self, location, headers = None):
+        self.__send(302, "", headers=dict(headers or {}, Location=location))
+
+    def __form(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return parse_qs(self.rfile.read(length).decode("utf-8"))
+
+    def do_GET(self):
+        self.portal.count_request()
+        if self.portal.latency:
+            sleep(self.portal.latency)
+
+        path = urlsplit(self.path).path
+        session = self.__session()
+
+        if path.startswith("/pay/"):
+            token = path[len("/pay/"):]
+            payment = self.portal.payments.get(token)
+            if payment is None:
+                return self.__send(404, "not found")
+            page = PAYMENT_PAGE.replace("__TOKEN__", token).replace("__PAYLOAD__", payment["payload"])
+            return self.__send(200, page)
+
+        if path.startswith("/qr/"):
+            return self.__send(200, make_png(), content_type="image/png")
+
+        if session is None:
+            return self.__send(200, LOGIN_PAGE)
+
+        if path == "/topup.php":
+            return self.__send(200, TOPUP_PAGE)
+
+        return self.__send(200, HOME_PAGE)
+
+    def do_POST(self):
+        self.portal.count_request()
+        if self.portal.latency:
+            sleep(self.portal.latency)
+
+        path = urlsplit(self.path).path
+        form = self.__form()
+
+        if path == "/login":
+            username = form.get("username", [""])[0]
+            password = form.get("password", [""])[0]
+            if (username, password) != (self.portal.username, self.portal.password):
+                return self.__send(200, LOGIN_PAGE)
+            token = self.portal.create_session()
+            return self.__redirect("/", {"Set-Cookie": f"PHPSESSID={token}; Path=/"})
+
+        session = self.__session()
+        if session is None:
+            return self.__redirect("/")
+
+        if path == "/topup.php":
+            user_ids = [u.strip() for u in form.get("user_ids", [""])[0].splitlines() if u.strip()]
+            payments = self.portal.generate(session, user_ids)
+            page = (
+                RESULT_PAGE
+                .replace("__PAYMENTS__", json.dumps(payments))
+                .replace("__RENDER_DELAY_MS__", str(int(self.portal.render_delay * 1000)))
+            )
+            return self.__send(200, page)
+
+        return self.__send(404, "not found")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--render-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    portal = FakePortal(port=args.port, latency=args.latency, render_delay=args.render_delay).start()
+    print(f"Fake portal on {portal.base_url} (user/pass)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        portal.stop()
@@ -0,0 +1,318 @@
+import os
+import socket
+import struct
+import threading
+import uuid
+from time import time
+
+DEFAULT_ADB_HOST = "127.0.0.1"
+DEFAULT_ADB_PORT = 5037
+
+SYNC_DATA_MAX = 64 * 1024
+DEFAULT_FILE_MODE = 0o100644
+
+
+class AdbError(Exception):
+    pass
+
+
+class AdbResultLost(AdbError):
+    """The command reached the device but its result did not come back, so it may have run."""
+
+
+def get_adb_server_address():
+    """Honours ADB_SERVER_SOCKET=tcp:<host>:<port> like the adb binary does."""
+    value = os.getenv("ADB_SERVER_SOCKET", "")
+    if value.startswith("tcp:"):
+        host, _, port = value[len("tcp:"):].rpartition(":")
+        return host or DEFAULT_ADB_HOST, int(port)
+    return DEFAULT_ADB_HOST, int(os.getenv("ANDROID_ADB_SERVER_PORT", DEFAULT_ADB_PORT))
+
+
+class AdbConnection:
+    """One socket to the adb server, speaking the host protocol."""
+
+    def __init__(self, host, port, timeout = 10):
+        try:
+            self.sock = socket.create_connection((host, port), timeout=timeout)
+        except OSError as e:
+            raise AdbError(f"adb server not reachable on {host}:{port}: {e}")
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+    # A timeout or a reset (the adb server restarted) is an AdbError like any
+    # other failure, so callers fall back to the adb binary
+
+    def send(self, data: bytes):
+        try:
+            self.sock.sendall(data)
+        except OSError as e:
+            raise AdbError(f"adb server connection failed: {e}")
+
+    def recv(self, n):
+        try:
+            return self.sock.recv(n)
+        except OSError as e:
+            raise AdbError(f"adb server connection failed: {e}")
+
+    def read_exactly(self, n):
+        chunks = []
+        while n > 0:
+            chunk = self.recv(n)
+            if not chunk:
+                raise AdbError("connection closed by adb server")
+            chunks.append(chunk)
+            n -= len(chunk)
+        return b"".join(chunks)
+
+    def read_all(self):
+        chunks = []
+        while True:
+            chunk = self.recv(65536)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def send_request(self, request: str):
+        data = request.encode("utf-8")
+        self.send(f"{len(data):04x}".encode("ascii") + data)
+        self.check_status()
+
+    def check_status(self):
+        status = self.read_exactly(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbError(self.read_hex_prefixed().decode("utf-8", errors="replace"))
+        raise AdbError(f"unexpected adb response {status!r}")
+
+    def read_hex_prefixed(self):
+        length = int(self.read_exactly(4), 16)
+        return self.read_exactly(length)
+
+
+def _new_marker():
+    return f"__ADB_DONE_{uuid.uuid4().hex}__"
+
+
+def _marked_line(command, marker):
+    # The subshell keeps compound commands together and off the shell's stdin;
+    # the marker carries the exit code, which exec: does not report
+    return f"( {command} ) </dev/null 2>&1; echo {marker} $?"
+
+
+def _split_marked(data: bytes, marker):
+    """(exit code, output) from output ending in the marker line."""
+    index = data.rfind(marker.encode("ascii") + b" ")
+    if index == -1:
+        raise AdbError("command output ended early")
+    return int(data[index + len(marker) + 1:].strip()), data[:index]
+
+
+class AdbShell:
+    """
+    A long-lived `sh` on the device. Commands are written to its stdin and their
+    output is read back up to a marker, so running one costs no new connection.
+    One command runs at a time; after an error the shell is in an unknown state
+    and must be closed.
+    """
+
+    def __init__(self, connection: AdbConnection):
+        self.__connection = connection
+        self.__buffer = b""
+        self.lock = threading.Lock()
+
+    def run(self, command: str):
+        """Runs command and returns its exit code and output (stdout and stderr)."""
+        return self.read_result(self.send(command))
+
+    def send(self, command: str):
+        """Writes command to the shell and returns the marker its result ends with."""
+        marker = _new_marker()
+        self.__connection.send(_marked_line(command, marker).encode("utf-8") + b"\n")
+        return marker
+
+    def read_result(self, marker):
+        needle = marker.encode("ascii") + b" "
+        while True:
+            index = self.__buffer.find(needle)
+            if index != -1:
+                end = self.__buffer.find(b"\n", index)
+                if end != -1:
+                    break
+            chunk = self.__connection.recv(65536)
+            if not chunk:
+                raise AdbError("device shell closed")
+            self.__buffer += chunk
+
+        output = self.__buffer[:index]
+        exit_code = int(self.__buffer[index + len(needle):end])
+        self.__buffer = self.__buffer[end + 1:]
+        return exit_code, output
+
+    def close(self):
+        self.__connection.close()
+
+
+class AdbClient:
+    """
+    In-process client for the local adb server (the same server the adb binary
+    starts), so devices, shell commands and pushes don't spawn an adb process.
+    """
+
+    def __init__(self, host = None, port = None, timeout = 10):
+        default_host, default_port = get_adb_server_address()
+        self.__host = host or default_host
+        self.__port = port or default_port
+        self.__timeout = timeout
+        self.__shells = {}
+        self.__shells_lock = threading.Lock()
+
+    def __connect(self):
+        return AdbConnection(self.__host, self.__port, self.__timeout)
+
+    def __transport(self, serial = None):
+        connection = self.__connect()
+        try:
+            connection.send_request(f"host:transport:{serial}" if serial else "host:transport-any")
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def forward(self, local: str, remote: str, serial = None):
+        """Forwards e.g. local "tcp:0" to remote "tcp:6790". Returns the host port actually bound."""
+        prefix = f"host-serial:{serial}" if serial else "host"
+        with self.__connect() as connection:
+            connection.send_request(f"{prefix}:forward:{local};{remote}")
+            # The server acknowledges the request and then the forward itself
+            connection.check_status()
+            if local == "tcp:0":
+                return int(connection.read_hex_prefixed())
+        return int(local.split(":", 1)[1])
+
+    def remove_forward(self, local: str, serial = None):
+        """Removes the forward of local, e.g. "tcp:40123", like `adb forward --remove`."""
+        prefix = f"host-serial:{serial}" if serial else "host"
+        with self.__connect() as connection:
+            connection.send_request(f"{prefix}:killforward:{local}")
+
+    def devices(self):
+        """List of (serial, state) pairs, as in `adb devices`."""
+        with self.__connect() as connection:
+            connection.send_request("host:devices")
+            data = connection.read_hex_prefixed().decode("utf-8")
+
+        devices = []
+        for line in data.splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                devices.append((parts[0], parts[1]))
+        return devices
+
+    def shell(self, command: str, serial = None):
+        """
+        Runs command and returns its exit code and raw output. It goes through
+        the device's persistent shell, opened on first use, so a command costs
+        no new connection. Only a command that never reached that shell runs
+        through its own exec connection instead; once it was written, a lost
+        result raises AdbResultLost rather than running it twice.
+        """
+        try:
+            shell = self.__shell(serial)
+        except AdbError:
+            shell = None
+
+        if shell is not None:
+            with shell.lock:
+                try:
+                    marker = shell.send(command)
+                except AdbError:
+                    self.__drop_shell(serial, shell)
+                else:
+                    try:
+                        return shell.read_result(marker)
+                    except AdbError as e:
+                        self.__drop_shell(serial, shell)
+                        raise AdbResultLost(str(e))
+
+        marker = _new_marker()
+        with self.__transport(serial) as connection:
+            connection.send_request(f"exec:{_marked_line(command, marker)}")
+            try:
+                return _split_marked(connection.read_all(), marker)
+            except AdbError as e:
+                raise AdbResultLost(str(e))
+
+    def __shell(self, serial):
+        with self.__shells_lock:
+            shell = self.__shells.get(serial)
+            if shell is None:
+                shell = self.__shells[serial] = self.open_shell(serial)
+            return shell
+
+    def __drop_shell(self, serial, shell):
+        with self.__shells_lock:
+            if self.__shells.get(serial) is shell:
+                del self.__shells[serial]
+        shell.close()
+
+    def close(self):
+        """Closes the persistent shells."""
+        with self.__shells_lock:
+            shells = list(self.__shells.values())
+            self.__shells.clear()
+        for shell in shells:
+            shell.close()
+
+    def open_exec(self, command: str, serial = None):
+        """Starts command and returns its connection, for output that is read as it streams."""
+        connection = self.__transport(serial)
+        try:
+            connection.send_request(f"exec:{command}")
+        except Exception:
+            connection.close()
+            raise
+        return connection
+
+    def open_shell(self, serial = None):
+        return AdbShell(self.open_exec("sh", serial))
+
+    def push_bytes(self, data: bytes, remote_path: str, serial = None, mode = DEFAULT_FILE_MODE, mtime = None):
+        """Writes data to remote_path on the device with the sync protocol."""
+        with self.__transport(serial) as connection:
+            connection.send_request("sync:")
+
+            path_mode = f"{remote_path},{mode}".encode("utf-8")
+            connection.send(b"SEND" + struct.pack("<I", len(path_mode)) + path_mode)
+
+            for offset in range(0, len(data), SYNC_DATA_MAX):
+                chunk = data[offset:offset + SYNC_DATA_MAX]
+                connection.send(b"DATA" + struct.pack("<I", len(chunk)) + chunk)
+
+            connection.send(b"DONE" + struct.pack("<I", int(mtime if mtime is not None else time())))
+
+            status = connection.read_exactly(4)
+            length = struct.unpack("<I", connection.read_exactly(4))[0]
+            if status == b"FAIL":
+                raise AdbError(connection.read_exactly(length).decode("utf-8", errors="replace"))
+            if status != b"OKAY":
+                raise AdbError(f"unexpected sync response {status!r}")
+
+            connection.send(b"QUIT" + struct.pack("<I", 0))
+
+    def push(self, filename: str, remote_path: str, serial = None):
+        with open(filename, "rb") as f:
+            data = f.read()
+        self.push_bytes(data, remote_path, serial, mtime=os.path.getmtime(filename))
@@ -1,13 +1,32 @@
+import os
+import shutil
 import subprocess
 from .utils import get_resource_path
+from .adb_client import AdbClient, AdbError, AdbResultLost
 import platform
 
 if platform.system() == "Windows": 
     adb_path = get_resource_path("embed\\adb\\windows\\adb.exe")
-else:
+elif platform.system() == "Darwin":
     adb_path = get_resource_path("embed/adb/macos/adb")
+else:
+    adb_path = get_resource_path("embed/adb/linux/adb")
+
+if not os.path.exists(adb_path):
+    adb_path = shutil.which("adb") or adb_path
+
+PICTURES_DIR = "/storage/emulated/0/Pictures"
+
+# Talks to the adb server directly; the adb binary is only spawned when the
+# server is not reachable (it also starts the server for the next call).
+adb_client = AdbClient()
 
 def get_connected_devices():
+    try:
+        return [serial for serial, state in adb_client.devices() if state == "device"]
+    except AdbError:
+        pass
+
     try:
         result = subprocess.run(
             [adb_path, "devices"],
@@ -35,10 +54,11 @@ def get_connected_devices():
         print("ADB not found. Make sure it's installed and in your PATH.")
         return []
     
-def run_adb_command(command):
+def run_adb_command(command, serial = None):
+    args = ["-s", serial] if serial else []
     try:
         result = subprocess.run(
-            [adb_path] + command.split(),
+            [adb_path] + args + command.split(),
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             text=True
@@ -48,4 +68,58 @@ def run_adb_command(command):
         else:
             print("Error:\n", result.stderr)
     except FileNotFoundError:
-        print("ADB not found. Make sure it's installed and in your PATH.")
\ No newline at end of file
+        print("ADB not found. Make sure it's installed and in your PATH.")
+
+def run_shell(command, serial = None):
+    """Runs a device shell command and returns its output, or None if it failed or could not run."""
+    try:
+        exit_code, output = adb_client.shell(command, serial)
+    except AdbResultLost as e:
+        # The command may have run, so running it again through adb could repeat it
+        print("ADB command result lost:", e)
+        return None
+    except AdbError as e:
+        print("ADB client error, falling back to adb binary:", e)
+    else:
+        output = output.decode("utf-8", errors="replace")
+        if exit_code != 0:
+            print(f"Error (exit {exit_code}):\n", output)
+            return None
+        return output
+
+    try:
+        result = subprocess.run(
+            [adb_path] + (["-s", serial] if serial else []) + ["shell", command],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+    except FileNotFoundError:
+        print("ADB not found. Make sure it's installed and in your PATH.")
+        return None
+
+    if result.returncode != 0:
+        print("Error:\n", result.stderr)
+        return None
+    return result.stdout
+
+def push_bytes_to_android(data: bytes, remote_path, serial = None):
+    """Writes in-memory bytes to remote_path on the device, without a local file."""
+    try:
+        adb_client.push_bytes(data, remote_path, serial)
+        return True
+    except AdbError as e:
+        print("ADB push failed:", e)
+        return False
+
+def push_file_to_android(filename, dest, serial = None):
+    remote_path = f"{dest.rstrip('/')}/{os.path.basename(filename)}"
+    try:
+        adb_client.push(filename, remote_path, serial)
+        return
+    except AdbError as e:
+        print("ADB client error, falling back to adb binary:", e)
+    run_adb_command(f"push {filename} {dest}", serial)
+
+def trigger_scan_file(path, serial = None):
+    run_shell(f"am broadcast -a android.intent.action.MEDIA_SCANNER_SCAN_FILE -d file://{path}", serial)
@@ -0,0 +1,166 @@
+import re
+import socket
+import subprocess
+import threading
+from time import perf_counter
+
+from ..adb_client import AdbError
+from ..adb_helpers import adb_client, adb_path
+
+# Activity resumes are logged to the events buffer as
+#   1718000000.123  1234  1250 I wm_on_resume_called: [87241321,com.byb.main.MainActivity,RESUME_ACTIVITY]
+# (am_on_resume_called before Android 9). -T 1 skips the backlog.
+LOGCAT_COMMAND = "logcat -b events -v epoch -T 1 wm_on_resume_called:I am_on_resume_called:I *:S"
+
+RESUME_PATTERN = re.compile(r"^\s*(\d+\.\d+)\s+\d+\s+\d+\s+\w\s+(?:wm|am)_on_resume_called:\s*\[(.*)\]")
+ACTIVITY_PATTERN = re.compile(r"^[A-Za-z_][\w$]*(\.[\w$]+)+(/\.?[\w$.]+)?$")
+
+MAX_EVENTS = 1000
+
+
+class ActivityEvent:
+    """An activity that resumed, with the device timestamp of the log line and the local receive time."""
+
+    def __init__(self, seq, timestamp, activity, received):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.activity = activity
+        self.received = received
+
+    def __repr__(self):
+        return f"ActivityEvent({self.activity} @ {self.timestamp:.3f})"
+
+
+def parse_resume_line(line):
+    """(device timestamp, activity class name) of a resume log line, or None."""
+    match = RESUME_PATTERN.match(line)
+    if match is None:
+        return None
+
+    for field in match.group(2).split(","):
+        field = field.strip()
+        if not ACTIVITY_PATTERN.match(field):
+            continue
+        if "/" in field:
+            package, name = field.split("/", 1)
+            field = package + name if name.startswith(".") else name
+        return float(match.group(1)), field
+    return None
+
+
+class ActivityWatcher:
+    """
+    Streams the device's activity resumes from logcat over one persistent adb
+    connection (the adb binary when the server can't be reached) and publishes
+    them as ActivityEvents. Waiters are woken the moment a resume is logged.
+    """
+
+    def __init__(self, serial = None, logger = None):
+        self.__serial = serial
+        self.__events = []
+        self.__seq = 0
+        self.__condition = threading.Condition()
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__process = None
+        self.__logger = logger
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[ActivityWatcher] {msg}")
+
+    @property
+    def running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return self
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stop.set()
+        if self.__process is not None:
+            self.__process.terminate()
+        if self.__thread is not None:
+            self.__thread.join(timeout=2)
+
+    def last_seq(self):
+        with self.__condition:
+            return self.__seq
+
+    def current(self):
+        with self.__condition:
+            return self.__events[-1] if self.__events else None
+
+    def events(self, since = 0):
+        """Events with a sequence number above since, oldest first."""
+        with self.__condition:
+            return [e for e in self.__events if e.seq > since]
+
+    def wait_any(self, timeout, since):
+        """Blocks until an event newer than since is logged. Returns False on timeout."""
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__seq > since, timeout)
+
+    def __publish(self, line):
+        parsed = parse_resume_line(line)
+        if parsed is None:
+            return
+
+        timestamp, activity = parsed
+        with self.__condition:
+            self.__seq += 1
+            self.__events.append(ActivityEvent(self.__seq, timestamp, activity, perf_counter()))
+            del self.__events[:-MAX_EVENTS]
+            self.__condition.notify_all()
+        self.__log(f"resumed {activity}")
+
+    def __run(self):
+        try:
+            self.__stream_from_server()
+        except AdbError as e:
+            if self.__stop.is_set():
+                return
+            self.__log(f"[WARN] adb server stream failed ({e}), using the adb binary")
+            self.__stream_from_binary()
+
+    def __stream_from_server(self):
+        connection = adb_client.open_exec(LOGCAT_COMMAND, self.__serial)
+        connection.sock.settimeout(1)
+        buffer = b""
+        try:
+            while not self.__stop.is_set():
+                try:
+                    chunk = connection.sock.recv(4096)
+                except socket.timeout:
+                    continue
+                except OSError as e:
+                    # A reset (adb server restarted) falls back to the adb binary like any AdbError
+                    raise AdbError(f"logcat stream failed: {e}")
+                if not chunk:
+                    raise AdbError("logcat stream closed")
+
+                buffer += chunk
+                *lines, buffer = buffer.split(b"\n")
+                for line in lines:
+                    self.__publish(line.decode("utf-8", errors="replace"))
+        finally:
+            connection.close()
+
+    def __stream_from_binary(self):
+        args = [adb_path] + (["-s", self.__serial] if self.__serial else []) + ["shell", LOGCAT_COMMAND]
+        try:
+            self.__process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        except FileNotFoundError:
+            self.__log("[ERROR] ADB not found, activity events are not available.")
+            return
+
+        for line in self.__process.stdout:
+            if self.__stop.is_set():
+                break
+            self.__publish(line)
+        self.__process.terminate()
@@ -1,34 +1,85 @@
 from appium import webdriver
 from appium.options.android import UiAutomator2Options
 from appium.webdriver.common.appiumby import AppiumBy
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-
-from selenium.webdriver.common.actions.pointer_input import PointerInput
-from selenium.webdriver.common.actions.action_builder import ActionBuilder
-
-from time import sleep
-
-PERMISSION_PKG = "com.google.android.permissioncontroller"
-
-GALLERY_ACTIVITY = "com.samsung.android.gallery.app.activity.external.GalleryExternalActivity"
-
-def get_my_default_ui_automator2_options(device_udid):
+from selenium.common.exceptions import TimeoutException
+
+import shlex
+from time import perf_counter
+
+from ..adb_helpers import run_shell
+from ..media_staging import IMAGES_URI, _sql_quote
+from ..metrics import metrics
+from .fast_profile import FastProfile, apply_fast_options
+from .activity_watcher import ActivityWatcher
+from .uiautomator2_driver import UiAutomator2Driver
+from .receipts import parse_receipt, STATUS_FAILED
+from .ui_state import (
+    UIStateDetector, center_of, BANK_PKG, QRIS_BUTTON_ID, CONFIRM_BUTTON_ID,
+    SCREEN_MAIN, SCREEN_SCAN, SCREEN_GALLERY, SCREEN_PAY, SCREEN_PIN, SCREEN_RESULT, SCREEN_PERMISSION, SCREEN_ERROR
+)
+
+# Intents that can hand an image straight to the bank app, tried in order.
+# {uri} is the MediaStore content URI of the pushed QR image.
+IMAGE_INTENTS = [
+    ("android.intent.action.SEND", "--eu android.intent.extra.STREAM {uri}"),
+    ("android.intent.action.VIEW", "-d {uri}"),
+]
+
+# How long the camera permission dialog may take to show up over the scanner
+PERMISSION_DIALOG_TIMEOUT = 2
+
+def get_my_default_ui_automator2_options(device_udid, system_port = None, fast = False):
     options = UiAutomator2Options()
     options.platform_name = "Android"
     options.udid = device_udid
 
+    # Needed to drive several devices from one Appium server
+    if system_port is not None:
+        options.system_port = system_port
+
     options.app_package = "com.sec.android.app.launcher"
     options.app_activity = "com.sec.android.app.launcher.activities.LauncherActivity"
 
     options.no_reset = True
 
+    if fast:
+        apply_fast_options(options)
+
     return options
 
 class AndroidAutomator:
-    def __init__(self, appium_server_url, options, logger = None):
-        self.__driver = webdriver.Remote(appium_server_url, options=options)
+    def __init__(self, appium_server_url, options, logger = None, intent_fast_path = True, fast_profile = False,
+                 watch_activities = True, direct_driver = False):
+        """
+        direct_driver talks to the UiAutomator2 server on the device without the
+        Appium server in between; appium_server_url is then not used.
+        """
+        self.__serial = options.udid or None
+
+        start = perf_counter()
+        if direct_driver:
+            self.__driver = UiAutomator2Driver(self.__serial, logger=logger)
+        else:
+            self.__driver = webdriver.Remote(appium_server_url, options=options)
+        self.__session_time = perf_counter() - start
+        metrics.observe("android.session", self.__session_time, device=self.__serial)
+
         self.__logger = logger
+        self.__watcher = ActivityWatcher(self.__serial, logger).start() if watch_activities else None
+        self.__detector = UIStateDetector(self.__driver, watcher=self.__watcher, logger=logger, serial=self.__serial)
+        self.__step_timings = {}
+        self.__activity_timings = {}
+
+        self.__fast_profile = None
+        if fast_profile:
+            self.__fast_profile = FastProfile(self.__serial, logger)
+            self.__fast_profile.apply(self.__driver)
+
+        # None until resolved, then (action, component, extra) or False if unsupported
+        self.__image_intent = None if intent_fast_path else False
+        self.__submitted = False
+        # Once the scanner opened without the dialog, the camera is granted for good
+        self.__camera_granted = False
 
     def __log(self, msg):
         if self.__logger is None: return
@@ -37,44 +88,69 @@ class AndroidAutomator:
     def set_credentials(self, pin: str):
         self.__pin = pin
 
-    def __wait(self, duration = 10):
-        return WebDriverWait(self.__driver, duration)
-    
-    def __wait_permission_dialog_appear(self, duration):
-        self.__wait(duration).until(lambda d: d.current_package == PERMISSION_PKG)
-
-    def __click_on_coordinate(self, x, y):
-        finger = PointerInput("touch", "finger")
-        click_actions = ActionBuilder(self.__driver, mouse=finger)
-        click_actions.pointer_action.move_to_location(x, y)
-        click_actions.pointer_action.pointer_down()
-        click_actions.pointer_action.pause(0.1)  # Short pause to simulate tap
-        click_actions.pointer_action.pointer_up()
-        click_actions.perform()
-
-    def __grant_permission(self):
-        allow_btn = self.__wait().until(
-            EC.presence_of_element_located((AppiumBy.XPATH, "(//android.widget.Button)[1]"))
-        )
-        allow_btn.click()
-
-    def __open_qris(self):
-        qris_iv = self.__wait(15).until(
-            EC.presence_of_element_located((AppiumBy.ID, "com.bnc.finance:id/iv_qris"))
-        )
-        qris_iv.click()
-
-        self.__wait_qris_scan_activity_opened()
-
-        require_permission = False
+    def is_alive(self):
+        """Whether the session still answers; Appium ends one left idle past newCommandTimeout."""
         try:
-            self.__wait_permission_dialog_appear(2)
-            require_permission = True
-        except:
-            pass
+            self.__driver.current_activity
+            return True
+        except Exception as e:
+            self.__log(f"Session is gone: {e}")
+            return False
+
+    def timings(self):
+        """
+        Seconds the Appium session took to create, the durations of each payment
+        step so far, and per activity the seconds into a payment it resumed at.
+        """
+        return {
+            "session": self.__session_time,
+            "steps": {k: list(v) for k, v in self.__step_timings.items()},
+            "activities": {k: list(v) for k, v in self.__activity_timings.items()},
+        }
+
+    def __record_activities(self, since, start):
+        for event in self.__watcher.events(since):
+            name = event.activity.rsplit(".", 1)[-1]
+            self.__activity_timings.setdefault(name, []).append(event.received - start)
+
+    def __record_step(self, name, start):
+        now = perf_counter()
+        self.__step_timings.setdefault(name, []).append(now - start)
+        metrics.observe(f"android.{name}", now - start, device=self.__serial)
+        return now
 
-        if require_permission:
-            self.__grant_permission()
+    def __click_on_coordinate(self, x, y):
+        # 100ms press, short enough to register as a tap
+        self.__driver.tap([(x, y)], 100)
+
+    def __tap(self, snapshot, resource_id = None, text = None, class_name = None):
+        """Taps a node of an already taken snapshot, without looking the element up again."""
+        node = snapshot.find(resource_id, text, class_name)
+        point = center_of(node) if node is not None else None
+        if point is None:
+            raise RuntimeError(f"{resource_id or text or class_name} not found on the {snapshot.screen} screen")
+        self.__click_on_coordinate(*point)
+
+    def __open_qris(self, snapshot):
+        with metrics.span("android.open_scan", device=self.__serial):
+            self.__scan_qris(snapshot)
+
+    def __scan_qris(self, snapshot):
+        self.__tap(snapshot, resource_id=QRIS_BUTTON_ID)
+
+        snapshot = self.__detector.wait_for((SCREEN_SCAN, SCREEN_PERMISSION), 15)
+        if snapshot.screen == SCREEN_SCAN and not self.__camera_granted:
+            # The permission dialog can show up a moment after the scanner
+            try:
+                snapshot = self.__detector.wait_for(SCREEN_PERMISSION, PERMISSION_DIALOG_TIMEOUT)
+            except TimeoutException:
+                self.__camera_granted = True
+
+        if snapshot.screen == SCREEN_PERMISSION:
+            self.__log("[INFO] Granting camera permission..")
+            self.__tap(snapshot, class_name="android.widget.Button")
+            self.__detector.wait_for(SCREEN_SCAN)
+            self.__camera_granted = True
     
     def __print_current_activity(self):
         current_activity = self.__driver.current_activity
@@ -86,97 +162,175 @@ class AndroidAutomator:
     def __click_first_item_in_gallery(self):
         self.__click_on_coordinate(18, 570)
 
-    def __click_pay_button(self):
-        pay_btn = self.__wait().until(
-            EC.presence_of_element_located((AppiumBy.ID, "com.bnc.finance:id/btn_confirm"))
-        )
-        pay_btn.click()
-
     def __fill_pin(self):
-        pin_et = self.__wait().until(
-            EC.presence_of_element_located((AppiumBy.XPATH, "//android.widget.EditText"))
-        )
-        pin_et.send_keys(self.__pin)
-
-    def __click_confirm_button(self):
-        confirm_btn = self.__wait().until(
-            EC.presence_of_element_located((AppiumBy.ID, "com.bnc.finance:id/btn_confirm"))
-        )
-        confirm_btn.click()
-
-    def __wait_qris_scan_activity_opened(self):
-        self.__wait().until(
-            lambda d: d.current_activity == "com.bnc.business.qrcode.activity.QrcodeScanActivity"
-        )
-
-    def __wait_gallery_opened(self):
-        self.__wait().until(
-            lambda d: d.current_activity == GALLERY_ACTIVITY
-        )
-
-    def __wait_pay_result_activity_opened(self):
-        self.__wait().until(
-            lambda d: d.current_activity == ".qrcode.activity.PayResultActivity"
-        )
-
-    def __wait_QRIS_pay_activity_opened(self):
-        self.__wait().until(
-            lambda d: d.current_activity == ".qrcode.activity.QrisPayActivity"
-        )
-
-    def __wait_main_activity(self, timeout = 60):
-        self.__wait(timeout).until(
-            lambda d: d.current_activity == "com.byb.main.MainActivity"
-        )
-   
-    def __wait_verify_pin_dialog_appear(self):
-        x_path = "//android.widget.TextView[@text='Verifikasi PIN']"
-        self.__wait().until(
-            EC.presence_of_element_located((AppiumBy.XPATH, x_path))
+        with metrics.span("android.fill_pin", device=self.__serial):
+            pin_et = self.__driver.find_element(AppiumBy.CLASS_NAME, "android.widget.EditText")
+            # From here on the payment may have gone through, whatever happens next
+            self.__submitted = True
+            pin_et.send_keys(self.__pin)
+
+    def payment_submitted(self):
+        """True once the PIN of the current (or last) payment was typed, so it must not be paid again."""
+        return self.__submitted
+
+    def return_to_main(self, attempts = 4):
+        """Presses back until the bank app's main screen shows. Returns False if it never did."""
+        for _ in range(attempts):
+            try:
+                self.__detector.wait_for(SCREEN_MAIN, 2)
+                return True
+            except (TimeoutException, RuntimeError):
+                self.__driver.back()
+        try:
+            self.__detector.wait_for(SCREEN_MAIN, 2)
+            return True
+        except (TimeoutException, RuntimeError):
+            return False
+
+    def __resolve_image_intent(self):
+        if self.__image_intent is not None:
+            return self.__image_intent
+
+        self.__image_intent = False
+        for action, extra in IMAGE_INTENTS:
+            output = run_shell(
+                f"cmd package resolve-activity --brief -a {action} -t image/png {BANK_PKG}", self.__serial
+            ) or ""
+            component = output.strip().splitlines()[-1] if output.strip() else ""
+            if component.startswith(BANK_PKG + "/"):
+                self.__log(f"[INFO] {BANK_PKG} accepts {action} via {component}")
+                self.__image_intent = (action, component, extra)
+                break
+        else:
+            self.__log(f"[INFO] {BANK_PKG} accepts no image intent, using the gallery")
+
+        return self.__image_intent
+
+    def __media_uri(self, image_path):
+        output = run_shell(
+            f"content query --uri {IMAGES_URI} --projection _id --where {shlex.quote(f'_data={_sql_quote(image_path)}')}",
+            self.__serial
+        ) or ""
+        for line in output.splitlines():
+            if "_id=" in line:
+                return f"{IMAGES_URI}/{line.rsplit('_id=', 1)[1].strip()}"
+        return None
+
+    def __deliver_image_by_intent(self, image_path):
+        """Opens the QRIS pay screen for image_path without the gallery. Returns False if it didn't work."""
+        intent = self.__resolve_image_intent()
+        if not intent:
+            return False
+
+        uri = self.__media_uri(image_path)
+        if uri is None:
+            # The gallery would show some other image first
+            raise RuntimeError(f"{image_path} is not in the media store")
+
+        action, component, extra = intent
+        run_shell(
+            f"am start -n {component} -a {action} -t image/png --grant-read-uri-permission {extra.format(uri=uri)}",
+            self.__serial
         )
 
-    def pay_qris_transaction(self):
-        # wait current activity is main activity
-        self.__wait_main_activity()
+        try:
+            self.__detector.wait_for(SCREEN_PAY, 5)
+            return True
+        except TimeoutException:
+            self.__log(f"[WARN] {action} did not open the pay screen, falling back to the gallery")
+            self.__image_intent = False
+            self.__driver.back()
+            return False
 
-        # wait stable
-        sleep(1) 
+    def __pick_qris_from_gallery(self):
+        snapshot = self.__detector.wait_for(SCREEN_MAIN, 10)
 
         self.__log("[INFO] Opening QRIS scan activity..")
-        self.__open_qris()
-        self.__log("[INFO] Done.")
-
-        sleep(1) # wait QRIS activity is stable
-        
-        self.__log("[INFO] Opening gallery..")
-        self.__click_gallery()
-        self.__wait_gallery_opened()
-        self.__log("[INFO] Done.")
-        
-        self.__log("[INFO] Picking first item in gallery..")
-        self.__click_first_item_in_gallery()
+        self.__open_qris(snapshot)
         self.__log("[INFO] Done.")
 
-        sleep(1)
+        with metrics.span("android.gallery_pick", device=self.__serial):
+            self.__log("[INFO] Opening gallery..")
+            self.__click_gallery()
+            self.__detector.wait_for(SCREEN_GALLERY)
+            self.__log("[INFO] Done.")
+
+            self.__log("[INFO] Picking first item in gallery..")
+            self.__click_first_item_in_gallery()
+            self.__log("[INFO] Done.")
+
+    def pay_qris_transaction(self, image_path = None, user_id = None):
+        """
+        Pays the QRIS pushed to image_path on the device. With a path the image is
+        handed to the bank app by intent when it supports one; otherwise the
+        newest gallery item is picked. Each step waits on the screen classified
+        from one hierarchy snapshot per poll.
+
+        Returns the PaymentReceipt read from the result screen, whose status is
+        failed if the bank app rejected the payment.
+        """
+        self.__submitted = False
+        start = perf_counter()
+        # The last payment's error screen may still be closing
+        self.__detector.wait_for(SCREEN_MAIN, 60, raise_on_error=False)
+        start = self.__record_step("ready", start)
+
+        payment_start = start
+        seq = self.__watcher.last_seq() if self.__watcher else 0
+
+        delivered = False
+        if image_path is not None and self.__image_intent is not False:
+            with metrics.span("android.intent", device=self.__serial):
+                delivered = self.__deliver_image_by_intent(image_path)
+
+        if delivered:
+            self.__log("[INFO] QRIS delivered by intent.")
+        else:
+            self.__pick_qris_from_gallery()
         
         self.__log("[INFO] Waiting QRIS pay activity..")
-        self.__wait_QRIS_pay_activity_opened()
+        snapshot = self.__detector.wait_for(SCREEN_PAY)
+        start = self.__record_step("open", start)
         self.__log("[INFO] Done.")
 
         self.__log("[INFO] Paying..")
-        self.__click_pay_button()
+        self.__tap(snapshot, resource_id=CONFIRM_BUTTON_ID)
         self.__log("[INFO] Waiting PIN dialog..")
-        self.__wait_verify_pin_dialog_appear()
+        self.__detector.wait_for(SCREEN_PIN)
+        start = self.__record_step("confirm", start)
         self.__log("[INFO] Filling PIN..")
         self.__fill_pin()
         self.__log("[INFO] Waiting payment result..")
-        self.__wait_pay_result_activity_opened()
+        with metrics.span("android.result", device=self.__serial):
+            snapshot = self.__detector.wait_for((SCREEN_RESULT, SCREEN_ERROR))
+        start = self.__record_step("pin", start)
         self.__log("[INFO] Done.")
-        sleep(1)
-        self.__click_confirm_button()
 
+        # Read from the snapshot we already have, so no extra round trip
+        receipt = parse_receipt(snapshot, user_id)
+        if snapshot.screen == SCREEN_ERROR:
+            receipt.status = STATUS_FAILED
+        self.__log(f"[INFO] Receipt: {receipt}")
+
+        if snapshot.find(resource_id=CONFIRM_BUTTON_ID) is not None:
+            self.__tap(snapshot, resource_id=CONFIRM_BUTTON_ID)
+        else:
+            self.__driver.back()
+        self.__record_step("finish", start)
+
+        if self.__watcher:
+            self.__record_activities(seq, payment_start)
+
+        return receipt
 
     def quit(self):
+        if self.__watcher is not None:
+            self.__watcher.stop()
+        if self.__fast_profile is not None:
+            try:
+                self.__fast_profile.restore()
+            except Exception as e:
+                self.__log(f"[WARN] Could not restore device settings: {e}")
         self.__driver.quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,31 @@
+from time import monotonic
+
+from ..recovery import CircuitBreaker
+
+DEFAULT_SYSTEM_PORT = 8200
+
+
+class DeviceSlot:
+    """One connected phone of a payment run and what it has paid so far."""
+
+    def __init__(self, udid, system_port, breaker = None):
+        self.udid = udid
+        self.system_port = system_port
+        self.paid = 0
+        self.failed = []
+        self.busy_time = 0.0
+        self.started_at = monotonic()
+        self.restarts = 0
+        self.dropped = False
+        self.gave_up = False
+        self.task = None
+        # Opens when the device keeps failing, so it stops taking QRIS for a while
+        self.breaker = breaker or CircuitBreaker()
+
+    def is_running(self):
+        return self.task is not None and not self.task.done()
+
+    def throughput(self):
+        """Payments per minute since the device joined."""
+        elapsed = monotonic() - self.started_at
+        return self.paid * 60 / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,74 @@
+from ..adb_helpers import run_shell
+
+ANIMATION_SCALES = ("window_animation_scale", "transition_animation_scale", "animator_duration_scale")
+
+# UiAutomator2 settings applied to the session. The defaults wait up to 10s for
+# the UI to go idle and 3s for every action to be acknowledged, the payment flow
+# waits on classified screens instead.
+FAST_SETTINGS = {
+    "waitForIdleTimeout": 100,
+    "waitForSelectorTimeout": 0,
+    "actionAcknowledgmentTimeout": 100,
+    "scrollAcknowledgmentTimeout": 100,
+    "ignoreUnimportantViews": True,
+}
+
+
+def apply_fast_options(options):
+    """Capabilities that skip the per-session setup a known device doesn't need."""
+    options.skip_server_installation = True
+    options.skip_device_initialization = True
+    options.skip_unlock = True
+    options.ignore_hidden_api_policy_error = True
+    options.new_command_timeout = 600
+    return options
+
+
+class FastProfile:
+    """
+    Turns the device animations off over adb and tunes the UiAutomator2
+    settings of a session. restore() puts the animation scales back the way
+    they were before apply().
+    """
+
+    def __init__(self, serial = None, logger = None):
+        self.__serial = serial
+        self.__saved_scales = None
+        self.__logger = logger
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[FastProfile] {msg}")
+
+    def apply(self, driver = None):
+        if self.__saved_scales is None:
+            output = run_shell("; ".join(f"settings get global {name}" for name in ANIMATION_SCALES), self.__serial)
+            values = (output or "").split()
+            if len(values) == len(ANIMATION_SCALES):
+                self.__saved_scales = dict(zip(ANIMATION_SCALES, values))
+            else:
+                self.__saved_scales = {name: "1.0" for name in ANIMATION_SCALES}
+
+        run_shell("; ".join(f"settings put global {name} 0" for name in ANIMATION_SCALES), self.__serial)
+        self.__log(f"[INFO] Animations off (were {self.__saved_scales}).")
+
+        if driver is not None:
+            try:
+                driver.update_settings(FAST_SETTINGS)
+            except Exception as e:
+                self.__log(f"[WARN] Could not apply session settings: {e}")
+
+    def restore(self):
+        if self.__saved_scales is None:
+            return
+
+        commands = []
+        for name, value in self.__saved_scales.items():
+            if value == "null":
+                commands.append(f"settings delete global {name}")
+            else:
+                commands.append(f"settings put global {name} {value}")
+        run_shell("; ".join(commands), self.__serial)
+
+        self.__log(f"[INFO] Animations restored to {self.__saved_scales}.")
+        self.__saved_scales = None
@@ -0,0 +1,120 @@
+import json
+import re
+import threading
+from datetime import datetime
+
+from .ui_state import result_status, SCREEN_RESULT, SCREEN_ERROR
+
+DEFAULT_RECEIPTS_PATH = "receipts.jsonl"
+
+STATUS_SUCCESS = "success"
+STATUS_FAILED = "failed"
+STATUS_UNKNOWN = "unknown"
+
+AMOUNT_PATTERN = re.compile(r"Rp\s?[\d.,]+", re.IGNORECASE)
+DATE_PATTERN = re.compile(r"\d{1,2}[ /-](\w{3,9}|\d{1,2})[ /-]\d{2,4}.*\d{1,2}[:.]\d{2}")
+
+# Labels shown on the result screen, matched case-insensitively at the start of
+# a text; the value is the next text that isn't a label itself.
+FIELD_LABELS = {
+    "amount": ("total", "nominal", "jumlah", "amount"),
+    "merchant": ("merchant", "nama merchant", "penerima", "tujuan", "nama toko"),
+    "reference": ("no. referensi", "no referensi", "referensi", "reference", "ref", "id transaksi", "no. transaksi"),
+    "timestamp": ("waktu", "tanggal", "waktu transaksi", "date", "time"),
+}
+
+
+class PaymentReceipt:
+    """What the bank app's result screen said about one payment."""
+
+    def __init__(self, user_id = None, status = STATUS_UNKNOWN, amount = None, merchant = None, reference = None,
+                 timestamp = None, captured_at = None, texts = None):
+        self.user_id = user_id
+        self.status = status
+        self.amount = amount
+        self.merchant = merchant
+        self.reference = reference
+        self.timestamp = timestamp
+        self.captured_at = captured_at or datetime.now().isoformat(timespec="seconds")
+        self.texts = texts or []
+
+    def amount_value(self):
+        """The amount as an integer of rupiah, or None."""
+        if not self.amount:
+            return None
+        digits = re.sub(r"[^\d,]", "", self.amount).split(",")[0]
+        return int(digits) if digits else None
+
+    def to_dict(self):
+        return {
+            "user_id": self.user_id,
+            "status": self.status,
+            "amount": self.amount,
+            "merchant": self.merchant,
+            "reference": self.reference,
+            "timestamp": self.timestamp,
+            "captured_at": self.captured_at,
+            "texts": self.texts,
+        }
+
+    def __repr__(self):
+        return f"PaymentReceipt({self.user_id}, {self.status}, {self.amount}, {self.reference})"
+
+
+def _label_of(text):
+    lowered = text.strip().rstrip(":").lower()
+    for field, labels in FIELD_LABELS.items():
+        if lowered in labels:
+            return field
+    return None
+
+
+def parse_receipt(snapshot, user_id = None):
+    """
+    Builds a PaymentReceipt from the UISnapshot of the result screen, without
+    further device calls. The status is read from the screen's title node
+    alone, since the merchant name may well contain "Sukses" or "Gagal".
+    """
+    texts = [n["text"].strip() for n in snapshot.nodes if n.get("text", "").strip()]
+    receipt = PaymentReceipt(user_id, texts=texts)
+
+    status = result_status(snapshot.nodes)
+    if status == SCREEN_RESULT:
+        receipt.status = STATUS_SUCCESS
+    elif status == SCREEN_ERROR:
+        receipt.status = STATUS_FAILED
+
+    for i, text in enumerate(texts):
+        field = _label_of(text)
+        if field is None or getattr(receipt, field) is not None:
+            continue
+        for value in texts[i + 1:]:
+            if _label_of(value) is None:
+                setattr(receipt, field, value)
+                break
+
+    if receipt.amount is None:
+        match = AMOUNT_PATTERN.search(" ".join(texts))
+        receipt.amount = match.group(0) if match else None
+    if receipt.timestamp is None:
+        receipt.timestamp = next((t for t in texts if DATE_PATTERN.search(t)), None)
+
+    return receipt
+
+
+class ReceiptWriter:
+    """Appends receipts to a JSON lines file as they arrive. Safe to share between device threads."""
+
+    def __init__(self, path):
+        self.__file = open(path, "a", encoding="utf-8")
+        self.__lock = threading.Lock()
+
+    def write(self, receipt: PaymentReceipt):
+        line = json.dumps(receipt.to_dict(), ensure_ascii=False)
+        with self.__lock:
+            self.__file.write(line + "\n")
+            self.__file.flush()
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
@@ -0,0 +1,218 @@
+import re
+from time import perf_counter, sleep
+
+from selenium.common.exceptions import TimeoutException
+
+from ..metrics import metrics
+
+try:
+    from lxml import etree
+except ImportError:
+    import xml.etree.ElementTree as etree
+
+BANK_PKG = "com.bnc.finance"
+PERMISSION_PKG = "com.google.android.permissioncontroller"
+GALLERY_PKGS = ("com.samsung.android.gallery", "com.sec.android.gallery3d", "com.google.android.apps.photos",
+                "com.android.documentsui")
+
+SCREEN_MAIN = "main"
+SCREEN_SCAN = "scan"
+SCREEN_GALLERY = "gallery"
+SCREEN_PAY = "pay"
+SCREEN_PIN = "pin"
+SCREEN_RESULT = "result"
+SCREEN_PERMISSION = "permission"
+SCREEN_ERROR = "error"
+SCREEN_UNKNOWN = "unknown"
+
+QRIS_BUTTON_ID = f"{BANK_PKG}:id/iv_qris"
+CONFIRM_BUTTON_ID = f"{BANK_PKG}:id/btn_confirm"
+PIN_DIALOG_TEXT = "Verifikasi PIN"
+
+# The pay and result screens both have the confirm button. The result screen
+# runs its own activity and is titled with the status alone ("Transaksi
+# Berhasil", "Pembayaran Gagal"), while any other text may be a merchant name
+# like "Toko Sukses Jaya", so only a whole title counts.
+PAY_ACTIVITY = ".qrcode.activity.QrisPayActivity"
+RESULT_ACTIVITY = ".qrcode.activity.PayResultActivity"
+STATUS_TITLE_PATTERN = re.compile(
+    r"(?:(?:transaksi|pembayaran|transfer|qris|payment|transaction)\s+)*"
+    r"(?:(berhasil|sukses|success|successful)|(gagal|tidak berhasil|ditolak|failed))\s*[!.]?",
+    re.IGNORECASE
+)
+
+SCAN_ID_PATTERN = re.compile(r"scan|zxing|barcode|viewfinder|preview|album", re.IGNORECASE)
+ERROR_TEXT_PATTERN = re.compile(r"gagal|kesalahan|tidak valid|failed|error", re.IGNORECASE)
+
+BOUNDS_PATTERN = re.compile(r"\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]")
+
+
+class UISnapshot:
+    """
+    One parsed page_source: every node's attributes, the activity resumed last
+    when known, and the screen they were classified as.
+    """
+
+    def __init__(self, nodes: list, activity = None):
+        self.nodes = nodes
+        self.activity = activity
+        self.screen = classify(nodes, activity)
+
+    def find(self, resource_id = None, text = None, class_name = None):
+        """First node matching all the given attributes, or None."""
+        for node in self.nodes:
+            if resource_id is not None and node.get("resource-id") != resource_id:
+                continue
+            if text is not None and node.get("text") != text:
+                continue
+            if class_name is not None and node.get("class") != class_name:
+                continue
+            return node
+        return None
+
+    def __repr__(self):
+        return f"UISnapshot({self.screen}, {len(self.nodes)} nodes)"
+
+
+def parse_hierarchy(xml):
+    if isinstance(xml, str):
+        xml = xml.encode("utf-8")
+    root = etree.fromstring(xml)
+    return [dict(node.attrib) for node in root.iter() if node.attrib]
+
+
+def center_of(node):
+    match = BOUNDS_PATTERN.match(node.get("bounds", ""))
+    if match is None:
+        return None
+    x1, y1, x2, y2 = (int(v) for v in match.groups())
+    return (x1 + x2) // 2, (y1 + y2) // 2
+
+
+def result_status(nodes: list):
+    """SCREEN_RESULT or SCREEN_ERROR as the status title among nodes says, None without one."""
+    for node in nodes:
+        match = STATUS_TITLE_PATTERN.fullmatch(node.get("text", "").strip())
+        if match is not None:
+            return SCREEN_RESULT if match.group(1) else SCREEN_ERROR
+    return None
+
+
+def classify(nodes: list, activity = None):
+    """
+    Screen of the bank payment flow that the hierarchy nodes show. activity,
+    the activity resumed last, tells the result screen from the pay screen
+    when its status title isn't recognised.
+    """
+    packages = set()
+    ids = set()
+    texts = []
+    message = ""
+    for node in nodes:
+        packages.add(node.get("package", ""))
+        ids.add(node.get("resource-id", ""))
+        if node.get("text"):
+            texts.append(node["text"])
+            if node.get("resource-id") == "android:id/message":
+                message = node["text"]
+
+    if PERMISSION_PKG in packages:
+        return SCREEN_PERMISSION
+    if PIN_DIALOG_TEXT in texts:
+        return SCREEN_PIN
+    if any(p.startswith(GALLERY_PKGS) for p in packages):
+        return SCREEN_GALLERY
+    if BANK_PKG not in packages:
+        return SCREEN_UNKNOWN
+
+    status = result_status(nodes)
+    if CONFIRM_BUTTON_ID in ids:
+        if status is not None:
+            return status
+        if activity is not None and activity.endswith(RESULT_ACTIVITY):
+            return SCREEN_RESULT
+        return SCREEN_PAY
+    if ERROR_TEXT_PATTERN.search(message):
+        return SCREEN_ERROR
+    if QRIS_BUTTON_ID in ids:
+        return SCREEN_MAIN
+    if any(SCAN_ID_PATTERN.search(i) for i in ids if i.startswith(BANK_PKG)):
+        return SCREEN_SCAN
+    if status == SCREEN_ERROR:
+        return SCREEN_ERROR
+
+    return SCREEN_UNKNOWN
+
+
+class UIStateDetector:
+    """
+    Classifies the device screen from a single page_source round trip per poll,
+    instead of separate current_activity and find_element queries. The
+    compressed hierarchy (ignoreUnimportantViews) keeps the snapshot small. With
+    an ActivityWatcher, a wait polls again as soon as an activity resumes
+    instead of sleeping out the poll interval.
+    """
+
+    def __init__(self, driver, compressed = True, watcher = None, logger = None, serial = None):
+        self.__driver = driver
+        self.__watcher = watcher
+        self.__serial = serial
+        self.__polls = 0
+        self.__snapshot_time = 0.0
+        self.__logger = logger
+
+        if compressed:
+            try:
+                self.__driver.update_settings({"ignoreUnimportantViews": True})
+            except Exception as e:
+                self.__log(f"[WARN] Compressed hierarchy not available: {e}")
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[UIStateDetector] {msg}")
+
+    def snapshot(self):
+        start = perf_counter()
+        event = self.__watcher.current() if self.__watcher is not None else None
+        snapshot = UISnapshot(parse_hierarchy(self.__driver.page_source), event.activity if event else None)
+        elapsed = perf_counter() - start
+        self.__polls += 1
+        self.__snapshot_time += elapsed
+        metrics.observe("android.snapshot", elapsed, device=self.__serial)
+        return snapshot
+
+    def wait_for(self, screens, timeout = 10, poll_interval = 0.2, raise_on_error = True):
+        """
+        Polls until the screen is one of screens and returns that snapshot.
+        Raises RuntimeError on an error screen that wasn't asked for (unless
+        raise_on_error is False), and TimeoutException after timeout seconds.
+        """
+        if isinstance(screens, str):
+            screens = (screens,)
+
+        deadline = perf_counter() + timeout
+        last = None
+        while True:
+            watching = self.__watcher is not None and self.__watcher.running
+            seq = self.__watcher.last_seq() if watching else 0
+            last = self.snapshot()
+            if last.screen in screens:
+                return last
+            if last.screen == SCREEN_ERROR and raise_on_error:
+                message = " ".join(n["text"] for n in last.nodes if n.get("text"))
+                raise RuntimeError(f"Bank app shows an error: {message}")
+            if perf_counter() >= deadline:
+                break
+            if watching:
+                self.__watcher.wait_any(poll_interval, seq)
+            else:
+                sleep(poll_interval)
+
+        raise TimeoutException(f"Waited {timeout}s for {'/'.join(screens)}, screen is {last.screen}")
+
+    def stats(self):
+        """Number of snapshots taken and their mean round trip plus parse time in seconds."""
+        return {
+            "polls": self.__polls,
+            "mean": self.__snapshot_time / self.__polls if self.__polls else 0.0,
+        }
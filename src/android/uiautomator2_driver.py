@@ -0,0 +1,157 @@
+import json
+from time import perf_counter, sleep
+
+import urllib3
+from appium.webdriver.common.appiumby import AppiumBy
+from selenium.common.exceptions import NoSuchElementException, WebDriverException
+
+from ..adb_client import AdbError
+from ..adb_helpers import adb_client
+
+UIA2_SERVER_PORT = 6790
+UIA2_INSTRUMENTATION = "io.appium.uiautomator2.server.test/androidx.test.runner.AndroidJUnitRunner"
+ELEMENT_KEY = "element-6066-11e4-a52e-4f735466cecf"
+
+STRATEGIES = {
+    AppiumBy.ID: "id",
+    AppiumBy.XPATH: "xpath",
+    AppiumBy.CLASS_NAME: "class name",
+    AppiumBy.ACCESSIBILITY_ID: "accessibility id",
+}
+
+
+class DirectElement:
+    def __init__(self, driver, element_id):
+        self.__driver = driver
+        self.id = element_id
+
+    def click(self):
+        self.__driver.execute("POST", f"/element/{self.id}/click")
+
+    def send_keys(self, text):
+        self.__driver.execute("POST", f"/element/{self.id}/value", {"text": text, "replace": False})
+
+    @property
+    def text(self):
+        return self.__driver.execute("GET", f"/element/{self.id}/text")
+
+
+class UiAutomator2Driver:
+    """
+    Talks to the UiAutomator2 server on the device over an adb port forward,
+    skipping the Appium server hop. It only implements what AndroidAutomator
+    uses: page_source, current_activity, update_settings, find_element by
+    id/xpath/class name, tap, back and quit. The server has to be installed on
+    the device already, which any earlier Appium session does.
+    """
+
+    def __init__(self, serial = None, start_timeout = 20, logger = None):
+        self.__serial = serial
+        self.__logger = logger
+        self.__instrumentation = None
+
+        self.__port = adb_client.forward("tcp:0", f"tcp:{UIA2_SERVER_PORT}", serial)
+        self.__http = urllib3.HTTPConnectionPool(
+            "127.0.0.1", self.__port, maxsize=1, timeout=urllib3.Timeout(connect=2, read=60)
+        )
+
+        try:
+            if not self.__is_running():
+                self.__start_server(start_timeout)
+
+            response = self.__request("POST", "/wd/hub/session", {"capabilities": {}})
+            self.session_id = response.get("sessionId") or response["value"]["sessionId"]
+        except Exception:
+            self.__release()
+            raise
+        self.__log(f"[INFO] Session {self.session_id} on port {self.__port}.")
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[UiAutomator2Driver] {msg}")
+
+    def __request(self, method, path, body = None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        response = self.__http.request(
+            method, path, body=data, headers={"Content-Type": "application/json"}, retries=False
+        )
+        payload = json.loads(response.data or b"{}")
+
+        value = payload.get("value")
+        if response.status >= 400 or (isinstance(value, dict) and "error" in value):
+            error = value.get("error", "") if isinstance(value, dict) else ""
+            message = value.get("message", response.status) if isinstance(value, dict) else response.status
+            if error == "no such element":
+                raise NoSuchElementException(message)
+            raise WebDriverException(f"{method} {path}: {message}")
+        return payload
+
+    def __is_running(self):
+        try:
+            self.__request("GET", "/wd/hub/status")
+            return True
+        except (urllib3.exceptions.HTTPError, WebDriverException, ValueError):
+            return False
+
+    def __start_server(self, timeout):
+        self.__log("[INFO] Starting the UiAutomator2 server..")
+        # The instrumentation runs as long as this connection stays open
+        self.__instrumentation = adb_client.open_exec(
+            f"am instrument -w -e disableAnalytics true {UIA2_INSTRUMENTATION}", self.__serial
+        )
+
+        deadline = perf_counter() + timeout
+        while perf_counter() < deadline:
+            if self.__is_running():
+                return
+            sleep(0.2)
+        raise AdbError(f"UiAutomator2 server did not start within {timeout}s")
+
+    def execute(self, method, path, body = None):
+        """Runs a command of this session and returns its value."""
+        return self.__request(method, f"/wd/hub/session/{self.session_id}{path}", body).get("value")
+
+    @property
+    def page_source(self):
+        return self.execute("GET", "/source")
+
+    @property
+    def current_activity(self):
+        return self.execute("GET", "/appium/device/current_activity")
+
+    @property
+    def current_package(self):
+        return self.execute("GET", "/appium/device/current_package")
+
+    def update_settings(self, settings: dict):
+        self.execute("POST", "/appium/settings", {"settings": settings})
+
+    def find_element(self, by, value):
+        strategy = STRATEGIES.get(by, by)
+        element = self.execute("POST", "/element", {"strategy": strategy, "selector": value, "context": ""})
+        return DirectElement(self, element.get(ELEMENT_KEY) or element.get("ELEMENT"))
+
+    def tap(self, positions, duration = None):
+        for x, y in positions:
+            self.execute("POST", "/appium/tap", {"x": x, "y": y})
+
+    def back(self):
+        self.execute("POST", "/back")
+
+    def quit(self):
+        try:
+            self.__request("DELETE", f"/wd/hub/session/{self.session_id}")
+        except Exception as e:
+            self.__log(f"[WARN] Could not delete session: {e}")
+        finally:
+            self.__release()
+
+    def __release(self):
+        self.__http.close()
+        if self.__instrumentation is not None:
+            self.__instrumentation.close()
+        try:
+            # Each session forwards a new host port, which would otherwise stay bound until adb restarts
+            adb_client.remove_forward(f"tcp:{self.__port}", self.__serial)
+        except AdbError as e:
+            self.__log(f"[WARN] Could not remove the port forward: {e}")
@@ -1,16 +1,115 @@
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
 
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 
 from selenium.webdriver.chrome.options import Options
 
-from time import sleep
 from datetime import datetime
 
-from multiprocessing import Event
+from ..metrics import metrics
+from ..qris import decode_data_url, save_QRIS_from_html
+from .http_fetcher import PaymentPageFetcher
+from .waits import BrowserWaiter
+from .capture import QRCapture, DEFAULT_QR_IMAGE_SIZE
+from .session_cache import SessionCache, derive_key
+from .locators import (
+    LocatorRegistry, LOGIN_USERNAME, LOGIN_PASSWORD, LOGIN_BUTTON, TOPUP_NAV, USER_IDS_FIELD, TOPUP_SUBMIT, NEXT_BUTTON
+)
+
+QRIS_MODE_PAYLOAD = "payload"
+QRIS_MODE_SCREENSHOT = "screenshot"
+
+PAYMENT_LINK_SELECTOR = "#iframeContainer > a, #iframeContainer > iframe"
+LOGGED_IN_SELECTOR = "#navbarNav"
+
+SET_FIELD_VALUE_JS = """
+var field = arguments[0];
+field.value = arguments[1];
+field.dispatchEvent(new Event('input', {bubbles: true}));
+field.dispatchEvent(new Event('change', {bubbles: true}));
+"""
+
+# Collects every payment URL the result page already holds: arrays of records
+# or URLs in window globals, and URLs written into inline scripts. Only URLs
+# under the same path as the payment link currently shown are kept.
+HARVEST_PAYMENT_URLS_JS = """
+var link = document.querySelector(arguments[0]);
+var sample = link ? (link.href || link.src || null) : null;
+if (!sample) return null;
+
+var sampleUrl = new URL(sample, location.href);
+var prefix = sampleUrl.origin + sampleUrl.pathname.substring(0, sampleUrl.pathname.lastIndexOf('/') + 1);
+var seen = {}, urls = [], records = [];
+
+function addUrl(s) {
+    var abs;
+    try { abs = new URL(s, location.href).href; } catch (e) { return null; }
+    if (abs.indexOf(prefix) !== 0) return null;
+    if (!seen[abs]) { seen[abs] = true; urls.push(abs); }
+    return abs;
+}
+
+Object.keys(window).forEach(function (key) {
+    var value;
+    try { value = window[key]; } catch (e) { return; }
+    if (!Array.isArray(value)) return;
+    value.forEach(function (item) {
+        if (typeof item === 'string') { addUrl(item); return; }
+        if (!item || typeof item !== 'object') return;
+        var record = {url: null, values: []};
+        Object.keys(item).forEach(function (field) {
+            var x = item[field];
+            if (typeof x !== 'string' && typeof x !== 'number') return;
+            x = String(x);
+            var abs = x.indexOf('/') !== -1 ? addUrl(x) : null;
+            if (abs && !record.url) record.url = abs; else record.values.push(x);
+        });
+        if (record.url) records.push(record);
+    });
+});
+
+var urlPattern = /(?:https?:\\/\\/|\\/)[^\\s"'<>\\\\]+/g;
+Array.prototype.forEach.call(document.scripts, function (script) {
+    (script.textContent.match(urlPattern) || []).forEach(addUrl);
+});
+
+return {sample: sampleUrl.href, urls: urls, records: records};
+"""
+
+GET_LOCAL_STORAGE_JS = "return Object.assign({}, window.localStorage);"
+SET_LOCAL_STORAGE_JS = """
+var items = arguments[0];
+Object.keys(items).forEach(function (k) { window.localStorage.setItem(k, items[k]); });
+"""
+
+# Clicks the given element and returns the payment URL shown before the click
+CLICK_AND_GET_LINK_JS = """
+var link = document.querySelector(arguments[0]);
+var previous = link ? (link.href || link.src || null) : null;
+arguments[1].click();
+return previous;
+"""
+
+# Fetches a URL from inside the logged-in page so the portal cookies are sent
+# along, and hands the body back either as text or as a data URL.
+FETCH_URL_JS = """
+var url = arguments[0];
+var asDataUrl = arguments[1];
+var done = arguments[arguments.length - 1];
+fetch(url, {credentials: 'include'})
+    .then(function (r) {
+        if (!r.ok) throw new Error('HTTP ' + r.status);
+        return asDataUrl ? r.blob() : r.text();
+    })
+    .then(function (body) {
+        if (!asDataUrl) { done({body: body}); return; }
+        var reader = new FileReader();
+        reader.onloadend = function () { done({body: reader.result}); };
+        reader.readAsDataURL(body);
+    })
+    .catch(function (e) { done({error: String(e)}); });
+"""
 
 def get_user_ids(filename):
     ids = []
@@ -40,8 +139,18 @@ def get_my_default_chrome_options(headless=True):
     return chrome_options
 
 class BrowserAutomator:
-    def __init__(self, base_url: str, chrome_options: Options, logger = None):
+    def __init__(self, base_url: str, chrome_options: Options, logger = None, qris_mode = QRIS_MODE_PAYLOAD, http_fetch = True, session_cache_path = None,
+                 chunk_size = None, bulk_input = True, qr_image_size = DEFAULT_QR_IMAGE_SIZE):
         self.__base_url = base_url
+        self.__chunk_size = chunk_size
+        self.__bulk_input = bulk_input
+        self.__chunk_start = 0
+        self.__generated_until = 0
+        self.__qris_mode = qris_mode
+        self.__http_fetch = http_fetch
+        self.__http_fetcher = None
+        self.__session_cache_path = session_cache_path
+        self.__session_cache = None
 
         # Optional: Set the path to your ChromeDriver if it's not in your PATH
         # self.__service = Service('/path/to/chromedriver')
@@ -50,74 +159,149 @@ class BrowserAutomator:
         self.__driver.set_window_size(1280, 1000)
 
         self.__logger = logger
+        self.__waiter = BrowserWaiter(self.__driver, logger=logger)
+        self.__locators = LocatorRegistry(self.__driver, logger=logger)
+        self.__capture = QRCapture(self.__driver, qr_image_size, logger=logger)
 
     def __log(self, msg):
         if self.__logger is None: return
         self.__logger.debug(f"[BrowserAutomator] {msg}")
 
-    def __wait(self, timeout = 15):
-        return WebDriverWait(self.__driver, timeout)
-
     def set_credentials(self, username: str, password: str):
         self.__username = username
         self.__password = password
 
+        if self.__session_cache_path:
+            key = derive_key(self.__base_url, username, password)
+            self.__session_cache = SessionCache(self.__session_cache_path, key, logger=self.__logger)
+
     def setup(self):
-        # Open a URL
+        with metrics.span("browser.login"):
+            # Open a URL
+            self.__driver.get(self.__base_url)
+
+            if self.__restore_session():
+                self.__log("[INFO] Restored cached session.")
+                return
+
+            self.__login(self.__username, self.__password)
+            self.__save_session()
+
+    def __is_logged_in(self, timeout):
+        try:
+            self.__waiter.element(LOGGED_IN_SELECTOR, timeout)
+            return True
+        except TimeoutException:
+            return False
+
+    def __restore_session(self):
+        if self.__session_cache is None:
+            return False
+
+        session = self.__session_cache.load()
+        if session is None:
+            return False
+
+        for cookie in session["cookies"]:
+            try:
+                self.__driver.add_cookie(cookie)
+            except Exception as e:
+                self.__log(f"[WARN] Skipping cookie {cookie.get('name')}: {e}")
+        self.__driver.execute_script(SET_LOCAL_STORAGE_JS, session["local_storage"])
+
+        # Reloading is the one request that both applies and validates the session
+        self.__driver.refresh()
+        self.__locators.invalidate()
+        if self.__is_logged_in(timeout=3):
+            return True
+
+        self.__log("[INFO] Cached session is no longer valid.")
+        self.__session_cache.clear()
+        self.__driver.delete_all_cookies()
         self.__driver.get(self.__base_url)
-        self.__login(self.__username, self.__password)
+        return False
 
-    def __login(self, username, password):
-        username_field = self.__wait().until(
-            EC.presence_of_element_located((By.XPATH, "/html/body/div/form/div[1]/input"))
-        )
-        password_field = self.__driver.find_element(By.XPATH, "/html/body/div/form/div[2]/input")
-        login_button = self.__driver.find_element(By.XPATH, "/html/body/div/form/button")
+    def __save_session(self):
+        if self.__session_cache is None or not self.__is_logged_in(timeout=15):
+            return
+
+        local_storage = self.__driver.execute_script(GET_LOCAL_STORAGE_JS)
+        self.__session_cache.save(self.__driver.get_cookies(), local_storage)
 
-        username_field.send_keys(username)
-        password_field.send_keys(password)
-        login_button.click()
+    @property
+    def http_fetcher(self):
+        """PaymentPageFetcher sharing this browser's session, created on first use."""
+        if self.__http_fetcher is None:
+            user_agent = self.__driver.execute_script("return navigator.userAgent")
+            self.__http_fetcher = PaymentPageFetcher(user_agent=user_agent, logger=self.__logger)
+            self.sync_http_cookies()
+        return self.__http_fetcher
+
+    def sync_http_cookies(self):
+        """Copies the current browser cookies into the HTTP session."""
+        if self.__http_fetcher is not None:
+            self.__http_fetcher.load_cookies(self.__driver.get_cookies())
+
+    def __login(self, username, password):
+        self.__locators.invalidate()
+        self.__locators.with_element(LOGIN_USERNAME, lambda el: el.send_keys(username))
+        self.__locators.with_element(LOGIN_PASSWORD, lambda el: el.send_keys(password), timeout=0)
+        self.__locators.with_element(LOGIN_BUTTON, lambda el: el.click(), timeout=0)
 
     def set_user_ids(self, user_ids: list):
         self.__user_ids = user_ids
+        self.__chunk_start = 0
+        self.__generated_until = 0
 
     def __js_click_element(self, element):
         self.__driver.execute_script("arguments[0].click();", element)
 
-    def generate_QRIS(self):
-        self.__log("[INFO] Navigating to topup page..")
+    def generate_QRIS(self, start = 0):
+        """
+        Submits the user ids to the topup form. With a chunk_size only the chunk
+        beginning at start is submitted here, download_QRIS submits the next
+        chunk once it reaches it, so downloading starts without waiting for the
+        whole batch.
+        """
+        self.__generate_chunk(start)
 
-        topup_nav_x_path = "//*[@id='navbarNav']/ul/li[4]/a"
-        topup_nav = self.__wait().until(
-            EC.presence_of_element_located((By.XPATH, topup_nav_x_path))
-        )
-        #topup_nav.click()
-        self.__js_click_element(topup_nav)
- 
-        self.__wait_page_loaded()
+    def generated_range(self):
+        """(first, end) indexes of the user ids shown on the current result page."""
+        return self.__chunk_start, self.__generated_until
 
-        self.__log("[INFO] Done.")
+    def __generate_chunk(self, start):
+        size = self.__chunk_size or len(self.__user_ids)
+        user_ids = self.__user_ids[start:start + size]
+        self.__chunk_start = start
+        self.__generated_until = start + len(user_ids)
 
-        serialized_user_ids = "\n".join( self.__user_ids)
+        if self.__chunk_size:
+            self.__log(f"[INFO] Generating QRIS {start + 1}-{self.__generated_until} of {len(self.__user_ids)}..")
 
-        x_path = "//*[@id='user_ids']"
-        user_ids_field = self.__wait().until(
-            EC.presence_of_element_located((By.XPATH, x_path))
-        )
+        self.__log("[INFO] Navigating to topup page..")
+
+        with metrics.span("browser.navigate"):
+            self.__locators.invalidate()
+            self.__locators.with_element(TOPUP_NAV, self.__js_click_element)
+            self.__locators.invalidate()
+
+            self.__wait_page_loaded()
 
-        user_ids_field.send_keys(serialized_user_ids)
+        self.__log("[INFO] Done.")
 
-        x_path = "/html/body/div/form/div[2]/input"
-        submit_button = self.__wait().until(
-            EC.presence_of_element_located((By.XPATH, x_path))
-        )
+        serialized_user_ids = "\n".join(user_ids)
 
-        submit_button.click()
-        #self.__js_click_element(submit_button)
+        with metrics.span("browser.submit"):
+            if self.__bulk_input:
+                # One round trip instead of send_keys typing every character
+                self.__locators.with_element(
+                    USER_IDS_FIELD, lambda el: self.__driver.execute_script(SET_FIELD_VALUE_JS, el, serialized_user_ids)
+                )
+            else:
+                self.__locators.with_element(USER_IDS_FIELD, lambda el: el.send_keys(serialized_user_ids))
 
-        # x_path = "/html/body/div/form/div[2]/input"
-        # submit_button = self.__driver.find_element(By.XPATH, x_path)
-        # submit_button.click()
+            self.__locators.with_element(TOPUP_SUBMIT, lambda el: el.click())
+            self.__locators.invalidate()
 
     def __generate_filename(self, user_id):
         # Get current date
@@ -129,101 +313,231 @@ class BrowserAutomator:
         return f"screenshots/QPA_{formatted_datetime}_{user_id}.png" 
 
     def __wait_page_loaded(self):
-        self.__wait().until(
-            lambda d: d.execute_script('return document.readyState') == 'complete'
-        )
+        self.__waiter.page_loaded()
 
-    def __download_QRIS(self, filename):
-        original_window = self.__driver.current_window_handle
-
-        self.__log("[INFO] Getting payment URL..")
+    def __get_payment_url(self):
         try:
-            qr_link = self.__wait().until(
-                EC.presence_of_element_located((By.XPATH, "//*[@id='iframeContainer']/a"))
-            )
-            payment_url = qr_link.get_attribute("href")
-        except:
-            try:
-                iframe = self.__wait().until(
-                    EC.presence_of_element_located((By.XPATH, "//*[@id='iframeContainer']/iframe"))
-                )
-                payment_url = iframe.get_attribute("src")
-            except:
-                return False
+            # Resolves with the href of the link or the src of the iframe, whichever shows up
+            with metrics.span("browser.payment_url"):
+                return self.__waiter.link_changed(PAYMENT_LINK_SELECTOR, None)
+        except TimeoutException:
+            return None
 
-        self.__log(f"[INFO] URL: {payment_url}")
-        self.__log("[INFO] Done.")
+    def __fetch_url(self, url, as_data_url = False):
+        try:
+            self.__driver.set_script_timeout(10)
+            result = self.__driver.execute_async_script(FETCH_URL_JS, url, as_data_url)
+        except Exception as e:
+            self.__log(f"[WARN] Fetch failed: {e}")
+            return None
+
+        if not result or "error" in result:
+            self.__log(f"[WARN] Fetch failed: {(result or {}).get('error')}")
+            return None
+
+        return result["body"]
+
+    def __save_QRIS_from_payload(self, payment_url, filename):
+        with metrics.span("browser.fetch"):
+            return self.__fetch_QRIS_payload(payment_url, filename)
+
+    def __fetch_QRIS_payload(self, payment_url, filename):
+        if self.__http_fetch:
+            if self.http_fetcher.save_QRIS(payment_url, filename):
+                self.__log("[INFO] Saved QRIS over HTTP.")
+                return True
+            # Session cookies may have rotated since the last copy
+            self.sync_http_cookies()
+
+        html = self.__fetch_url(payment_url)
+        if html is None:
+            return False
+
+        fetch_bytes = lambda url: decode_data_url(self.__fetch_url(url, as_data_url=True))
+        if save_QRIS_from_html(html, payment_url, filename, fetch_bytes):
+            self.__log("[INFO] Saved QRIS from page.")
+            return True
+
+        return False
+
+    def __screenshot_QRIS(self, payment_url, filename):
+        with metrics.span("browser.capture"):
+            return self.__capture_QRIS(payment_url, filename)
+
+    def __capture_QRIS(self, payment_url, filename):
+        original_window = self.__driver.current_window_handle
+        known_windows = self.__driver.window_handles
 
         self.__driver.execute_script(f"window.open('{payment_url}', '_blank');")
-        
-        sleep(1)  # Wait for tab to open
 
-        # Switch to the new tab (usually index 1)
-        self.__driver.switch_to.window(self.__driver.window_handles[1])
+        self.__driver.switch_to.window(self.__waiter.new_window(known_windows))
 
         self.__wait_page_loaded()
 
-        sleep(2)         
+        try:
+            self.__waiter.images_ready(timeout=5)
+        except TimeoutException:
+            self.__log("[WARN] QR image not ready, taking screenshot anyway..")
 
-        # Take a screenshot of the new tab
-        self.__driver.save_screenshot(filename)
+        # Capture just the QR element, falling back to the whole tab
+        saved = True
+        try:
+            size = self.__capture.capture(filename)
+            if size is None:
+                self.__driver.save_screenshot(filename)
+            else:
+                self.__log(f"[INFO] QRIS image {size} bytes.")
+        except OSError as e:
+            self.__log(f"[ERROR] Failed to encode QRIS image: {e}")
+            saved = False
         self.__driver.close()
 
         self.__driver.switch_to.window(original_window)
 
-        return True
+        return saved
+
+    def __download_QRIS(self, filename):
+        self.__log("[INFO] Getting payment URL..")
+        payment_url = self.__get_payment_url()
+        if payment_url is None:
+            return False
+
+        self.__log(f"[INFO] URL: {payment_url}")
+        self.__log("[INFO] Done.")
+
+        return self.__download_QRIS_from_url(payment_url, filename)
+
+    def __download_QRIS_from_url(self, payment_url, filename):
+        if self.__qris_mode == QRIS_MODE_PAYLOAD:
+            if self.__save_QRIS_from_payload(payment_url, filename):
+                return True
+            self.__log("[INFO] QRIS not found in page, falling back to screenshot..")
+
+        return self.__screenshot_QRIS(payment_url, filename)
 
     def __next_QRIS(self):
-        next_button = self.__driver.find_element(By.XPATH, "//*[@id='paginationControls']/button[2]")
-        self.__js_click_element(next_button)
-        #next_button.click()
+        with metrics.span("browser.next"):
+            # The button handle stays cached while paging through the same result page
+            previous_url = self.__locators.with_element(
+                NEXT_BUTTON, lambda el: self.__driver.execute_script(CLICK_AND_GET_LINK_JS, PAYMENT_LINK_SELECTOR, el)
+            )
+
+            # Wait for the pagination to actually swap in the next payment link
+            try:
+                self.__waiter.link_changed(PAYMENT_LINK_SELECTOR, previous_url)
+            except TimeoutException:
+                self.__log("[WARN] Payment link did not change after clicking next.")
 
     def download_QRIS(self, idx, next = True, refresh = False):
+        """Returns the saved filename, or None if the QRIS could not be downloaded."""
+        if idx >= self.__generated_until:
+            # First QRIS of a chunk that has not been submitted yet
+            self.__generate_chunk(idx)
+            next = False
+            refresh = False
+
         if refresh:
             self.__driver.refresh()
+            self.__locators.invalidate()
             self.__wait_page_loaded()
 
         if next:
             self.__next_QRIS()
 
         filename = self.__generate_filename(self.__user_ids[idx])
-        return self.__download_QRIS(filename)
+        return filename if self.__download_QRIS(filename) else None
+
+    def harvest_payment_urls(self):
+        """
+        Reads the payment URL of every QRIS of the current chunk straight from
+        the result page, without clicking through the pagination. Must be called
+        while the first QRIS of the chunk is shown. Returns an ordered manifest
+        of (user_id, payment_url), or None if the page data could not be matched
+        to the user ids.
+        """
+        user_ids = self.__user_ids[self.__chunk_start:self.__generated_until]
+
+        # Waits for the result page to show its first payment link
+        if self.__get_payment_url() is None:
+            return None
+
+        with metrics.span("browser.harvest"):
+            result = self.__driver.execute_script(HARVEST_PAYMENT_URLS_JS, PAYMENT_LINK_SELECTOR)
+        if not result:
+            return None
+
+        # Records that carry the user id next to the URL can be matched exactly
+        wanted = set(user_ids)
+        urls_by_user = {}
+        for record in result["records"]:
+            for value in record["values"]:
+                if value in wanted and value not in urls_by_user:
+                    urls_by_user[value] = record["url"]
+                    break
+        if len(urls_by_user) == len(user_ids):
+            return [(user_id, urls_by_user[user_id]) for user_id in user_ids]
+
+        # Otherwise trust the page order, as long as it lines up with what is shown
+        urls = result["urls"]
+        if len(urls) == len(user_ids) and urls[0] == result["sample"]:
+            return list(zip(user_ids, urls))
+
+        self.__log(f"[INFO] Found {len(urls)} payment URLs for {len(user_ids)} user ids, not using them.")
+        return None
+
+    def download_manifest(self, manifest: list, max_workers = 4):
+        """
+        Downloads the QRIS of every (user_id, payment_url) in manifest, over
+        parallel HTTP when possible and through the browser otherwise. Yields
+        (user_id, filename or None) in manifest order as they complete.
+        """
+        items = [(payment_url, self.__generate_filename(user_id)) for user_id, payment_url in manifest]
+
+        if self.__http_fetch and self.__qris_mode == QRIS_MODE_PAYLOAD:
+            results = self.http_fetcher.save_many(items, max_workers)
+        else:
+            results = (False for _ in items)
+
+        for (user_id, _), (payment_url, filename), saved in zip(manifest, items, results):
+            if not saved:
+                saved = self.__download_QRIS_from_url(payment_url, filename)
+            yield user_id, filename if saved else None
 
     def loop_downloads(self, continue_event = None, qris_downloaded_event = None):
+        """
+        Downloads every QRIS in order, waiting for continue_event before each
+        one and setting qris_downloaded_event after it. A QRIS that fails three
+        retries in a row is skipped.
+        """
         self.__log("[DOWNLOAD QRIS] Loop downloads started.")
         count = 0
         retry_count = 0
-        while True:
-            if continue_event is not None: 
+        while count < len(self.__user_ids):
+            if continue_event is not None:
                 self.__log("[DOWNLOAD QRIS] waiting for continue signal..")
                 continue_event.wait()
                 self.__log("[DOWNLOAD QRIS] got the signal, continuing..")
                 # unset it
                 continue_event.clear()
 
-            if count > 0:
-                self.__next_QRIS()
-
-            filename = self.__generate_filename(self.__user_ids[count])
+            retry = retry_count > 0
+            filename = self.download_QRIS(count, next=not retry and count > self.__chunk_start, refresh=retry)
 
-            success = self.__download_QRIS(filename)
-
-            if success:
+            if filename:
                 retry_count = 0
                 count = count + 1
-                
-                if qris_downloaded_event is not None: 
+
+                if qris_downloaded_event is not None:
                     qris_downloaded_event.set()
+            elif retry_count < 3:
+                retry_count = retry_count + 1
             else:
-                if retry_count < 3:
-                    self.__driver.refresh()
-                else:
-                    count = count + 1
-
-            if count >= len(self.__user_ids):
-                break
+                retry_count = 0
+                count = count + 1
 
     def quit(self):
+        if self.__http_fetcher is not None:
+            self.__http_fetcher.close()
         self.__driver.quit()
 
 if __name__ == "__main__":
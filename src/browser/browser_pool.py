@@ -0,0 +1,31 @@
+from ..recovery import CircuitBreaker
+
+
+class BrowserShard:
+    """A contiguous slice of the user id list owned by one browser of a payment run."""
+
+    def __init__(self, index, user_ids, breaker = None):
+        self.index = index
+        self.user_ids = list(user_ids)
+        self.done = 0
+        self.failed = []
+        self.restarts = 0
+        self.finished = False
+        # Opens when the browser keeps crashing, so restarts back off
+        self.breaker = breaker or CircuitBreaker()
+
+    def remaining_ids(self):
+        return self.user_ids[self.done:]
+
+
+def split_shards(user_ids, size):
+    size = max(1, min(size, len(user_ids)))
+    chunk, extra = divmod(len(user_ids), size)
+
+    shards = []
+    start = 0
+    for i in range(size):
+        end = start + chunk + (1 if i < extra else 0)
+        shards.append(BrowserShard(i, user_ids[start:end]))
+        start = end
+    return shards
@@ -0,0 +1,82 @@
+import base64
+import io
+import os
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+DEFAULT_QR_IMAGE_SIZE = 480
+QUIET_ZONE = 24
+
+# Page coordinates of the largest visible <img> or <canvas>, which on the
+# payment page is the QR code.
+QR_ELEMENT_RECT_JS = """
+var best = null, bestArea = 0;
+document.querySelectorAll('img, canvas').forEach(function (el) {
+    var r = el.getBoundingClientRect();
+    var area = r.width * r.height;
+    if (area > bestArea) { best = r; bestArea = area; }
+});
+if (!best || bestArea < 100) return null;
+return {x: best.left + window.scrollX, y: best.top + window.scrollY, width: best.width, height: best.height};
+"""
+
+
+def encode_qr_png(png_bytes: bytes, filename: str, target_size = DEFAULT_QR_IMAGE_SIZE):
+    """
+    Writes a tightly cropped capture as a 1-bit PNG whose longer side is scaled
+    to target_size, keeping the aspect ratio, with a white quiet zone. Without
+    Pillow the capture is written as is. Returns the size of the written file
+    in bytes.
+    """
+    if Image is None:
+        with open(filename, "wb") as f:
+            f.write(png_bytes)
+        return len(png_bytes)
+
+    image = Image.open(io.BytesIO(png_bytes)).convert("L")
+    scale = target_size / max(image.size)
+    image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+    image = image.point(lambda v: 255 if v > 127 else 0, mode="1")
+    image = ImageOps.expand(image, border=QUIET_ZONE, fill=1)
+    image.save(filename, format="PNG", optimize=True)
+
+    return os.path.getsize(filename)
+
+
+class QRCapture:
+    """
+    Captures only the QR element of the current page through CDP
+    Page.captureScreenshot and encodes it as a small 1-bit PNG.
+    """
+
+    def __init__(self, driver, target_size = DEFAULT_QR_IMAGE_SIZE, logger = None):
+        self.__driver = driver
+        self.__target_size = target_size
+        self.__logger = logger
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[QRCapture] {msg}")
+
+    def capture(self, filename):
+        """Returns the written size in bytes, or None if no QR element was found."""
+        rect = self.__driver.execute_script(QR_ELEMENT_RECT_JS)
+        if rect is None:
+            return None
+
+        try:
+            result = self.__driver.execute_cdp_cmd("Page.captureScreenshot", {
+                "format": "png",
+                "clip": dict(rect, scale=1),
+                "captureBeyondViewport": True,
+            })
+        except Exception as e:
+            self.__log(f"[WARN] CDP capture failed: {e}")
+            return None
+
+        # The crop encodes in a few milliseconds, and the file has to exist
+        # before the QRIS is handed on anyway
+        return encode_qr_png(base64.b64decode(result["data"]), filename, self.__target_size)
@@ -0,0 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import urllib3
+
+from ..qris import save_QRIS_from_html
+
+
+def path_matches(request_path, cookie_path):
+    """RFC 6265 path-match: /pay matches /pay and /pay/qr, not /payment."""
+    if request_path == cookie_path:
+        return True
+    if not request_path.startswith(cookie_path):
+        return False
+    return cookie_path.endswith("/") or request_path[len(cookie_path)] == "/"
+
+
+class PaymentPageFetcher:
+    """
+    Fetches payment pages over a pooled keep-alive HTTP session that reuses the
+    cookies of a logged-in Selenium driver, so QRIS can be downloaded without
+    opening a browser tab. Pages that only build the QR with JavaScript are not
+    supported here and should fall back to the browser.
+    """
+
+    def __init__(self, user_agent = None, max_connections = 8, timeout = 10, logger = None):
+        self.__max_connections = max_connections
+        self.__http = urllib3.PoolManager(
+            maxsize=max_connections,
+            block=True,
+            timeout=urllib3.Timeout(total=timeout),
+            retries=urllib3.Retry(total=2, backoff_factor=0.2, redirect=3),
+        )
+        self.__headers = {"User-Agent": user_agent} if user_agent else {}
+        self.__cookies = []
+        self.__logger = logger
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[PaymentPageFetcher] {msg}")
+
+    def load_cookies(self, cookies: list):
+        """Replaces the session cookies with Selenium's driver.get_cookies() output."""
+        self.__cookies = list(cookies)
+
+    def __cookie_header(self, url):
+        parts = urlsplit(url)
+        host = parts.hostname or ""
+        path = parts.path or "/"
+
+        pairs = []
+        for cookie in self.__cookies:
+            domain = cookie.get("domain", host).lstrip(".")
+            if host != domain and not host.endswith("." + domain):
+                continue
+            if not path_matches(path, cookie.get("path") or "/"):
+                continue
+            if cookie.get("secure") and parts.scheme != "https":
+                continue
+            pairs.append(f"{cookie['name']}={cookie['value']}")
+
+        return "; ".join(pairs)
+
+    def fetch(self, url):
+        """Returns the response body as bytes, or None on any error."""
+        headers = dict(self.__headers)
+        cookie = self.__cookie_header(url)
+        if cookie:
+            headers["Cookie"] = cookie
+
+        try:
+            response = self.__http.request("GET", url, headers=headers)
+        except urllib3.exceptions.HTTPError as e:
+            self.__log(f"[WARN] GET {url} failed: {e}")
+            return None
+
+        if response.status != 200:
+            self.__log(f"[WARN] GET {url} returned {response.status}")
+            return None
+
+        return response.data
+
+    def fetch_text(self, url):
+        data = self.fetch(url)
+        return data.decode("utf-8", errors="replace") if data is not None else None
+
+    def save_QRIS(self, payment_url, filename):
+        """Downloads the QRIS of a payment page to filename. Returns False if it needs the browser."""
+        html = self.fetch_text(payment_url)
+        if html is None:
+            return False
+        return save_QRIS_from_html(html, payment_url, filename, self.fetch)
+
+    def save_many(self, items: list, max_workers = None):
+        """
+        Downloads many (payment_url, filename) pairs concurrently over the pool.
+        Yields a boolean per item, in the same order as items, as soon as that
+        item and the ones before it are done.
+        """
+        workers = max_workers or self.__max_connections
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(lambda item: self.save_QRIS(*item), items)
+
+    def close(self):
+        self.__http.clear()
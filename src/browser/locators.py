@@ -0,0 +1,149 @@
+from time import perf_counter
+
+from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+from ..metrics import metrics
+
+
+class Locator:
+    """A portal element, with a fast primary selector first and fallbacks after it."""
+
+    def __init__(self, name, *selectors):
+        self.name = name
+        self.selectors = selectors
+
+    def __repr__(self):
+        return f"Locator({self.name})"
+
+
+LOGIN_USERNAME = Locator(
+    "login_username",
+    (By.CSS_SELECTOR, "body > div > form > div:nth-of-type(1) > input"),
+    (By.CSS_SELECTOR, "form input[type='text'], form input[type='email']"),
+    (By.XPATH, "/html/body/div/form/div[1]/input"),
+)
+LOGIN_PASSWORD = Locator(
+    "login_password",
+    (By.CSS_SELECTOR, "body > div > form > div:nth-of-type(2) > input"),
+    (By.CSS_SELECTOR, "form input[type='password']"),
+    (By.XPATH, "/html/body/div/form/div[2]/input"),
+)
+LOGIN_BUTTON = Locator(
+    "login_button",
+    (By.CSS_SELECTOR, "body > div > form > button"),
+    (By.CSS_SELECTOR, "form button[type='submit'], form input[type='submit']"),
+    (By.XPATH, "/html/body/div/form/button"),
+)
+TOPUP_NAV = Locator(
+    "topup_nav",
+    (By.CSS_SELECTOR, "#navbarNav > ul > li:nth-child(4) > a"),
+    (By.CSS_SELECTOR, "#navbarNav a[href*='topup']"),
+    (By.XPATH, "//*[@id='navbarNav']/ul/li[4]/a"),
+)
+USER_IDS_FIELD = Locator(
+    "user_ids_field",
+    (By.ID, "user_ids"),
+    (By.CSS_SELECTOR, "textarea[name='user_ids']"),
+)
+TOPUP_SUBMIT = Locator(
+    "topup_submit",
+    (By.CSS_SELECTOR, "body > div > form > div:nth-of-type(2) > input"),
+    (By.CSS_SELECTOR, "form input[type='submit'], form button[type='submit']"),
+    (By.XPATH, "/html/body/div/form/div[2]/input"),
+)
+NEXT_BUTTON = Locator(
+    "next_button",
+    (By.CSS_SELECTOR, "#paginationControls > button:nth-of-type(2)"),
+    (By.XPATH, "//*[@id='paginationControls']/button[2]"),
+)
+
+
+class LocatorRegistry:
+    """
+    Resolves Locators against the current page and caches the WebElement
+    handles. A handle that went stale after a page change is resolved again
+    transparently by with_element(). Call invalidate() after navigating.
+    """
+
+    def __init__(self, driver, logger = None):
+        self.__driver = driver
+        self.__elements = {}
+        # Index of the selector that matched last time, tried first next time
+        self.__preferred = {}
+        self.__stats = {}
+        self.__logger = logger
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[LocatorRegistry] {msg}")
+
+    def __record(self, locator, kind, start):
+        s = self.__stats.setdefault(locator.name, {
+            "cached": 0, "cached_time": 0.0, "resolved": 0, "resolved_time": 0.0, "stale": 0
+        })
+        elapsed = perf_counter() - start
+        s[kind] += 1
+        s[f"{kind}_time"] += elapsed
+        metrics.observe("browser.locate", elapsed, locator=locator.name, lookup=kind)
+
+    def __ordered_selectors(self, locator):
+        preferred = self.__preferred.get(locator.name, 0)
+        selectors = list(enumerate(locator.selectors))
+        return [selectors[preferred]] + selectors[:preferred] + selectors[preferred + 1:]
+
+    def __try_resolve(self, locator):
+        for index, (by, value) in self.__ordered_selectors(locator):
+            elements = self.__driver.find_elements(by, value)
+            if elements:
+                if index != self.__preferred.get(locator.name, 0):
+                    self.__log(f"{locator.name} matched fallback selector {value}")
+                self.__preferred[locator.name] = index
+                return elements[0]
+        return None
+
+    def find(self, locator: Locator, timeout = 15):
+        """Returns the cached element, or resolves it, waiting up to timeout seconds."""
+        start = perf_counter()
+
+        element = self.__elements.get(locator.name)
+        if element is not None:
+            self.__record(locator, "cached", start)
+            return element
+
+        element = self.__try_resolve(locator)
+        if element is None and timeout:
+            try:
+                element = WebDriverWait(self.__driver, timeout, poll_frequency=0.1).until(
+                    lambda d: self.__try_resolve(locator)
+                )
+            except TimeoutException:
+                raise TimeoutException(f"{locator.name} not found")
+
+        if element is None:
+            raise TimeoutException(f"{locator.name} not found")
+
+        self.__elements[locator.name] = element
+        self.__record(locator, "resolved", start)
+        return element
+
+    def with_element(self, locator: Locator, action, timeout = 15):
+        """Runs action(element), re-resolving once if the cached handle went stale."""
+        try:
+            return action(self.find(locator, timeout))
+        except StaleElementReferenceException:
+            self.__stats[locator.name]["stale"] += 1
+            metrics.count("stale_elements", locator=locator.name)
+            self.__elements.pop(locator.name, None)
+            return action(self.find(locator, timeout))
+
+    def invalidate(self, locator: Locator = None):
+        if locator is None:
+            self.__elements.clear()
+        else:
+            self.__elements.pop(locator.name, None)
+
+    def stats(self):
+        """Per locator: lookups served from cache vs resolved, their total seconds, and stale re-resolves."""
+        return {name: dict(s) for name, s in self.__stats.items()}
@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import json
+import os
+from time import time
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+
+DEFAULT_SESSION_CACHE_PATH = ".session_cache"
+DEFAULT_MAX_AGE = 12 * 60 * 60
+
+
+def derive_key(base_url: str, username: str, password: str):
+    """Fernet key bound to the portal credentials, so a cache only opens for the account that wrote it."""
+    salt = f"qris-session:{base_url}:{username}".encode("utf-8")
+    raw = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 200_000)
+    return base64.urlsafe_b64encode(raw)
+
+
+class SessionCache:
+    """
+    Encrypted on-disk copy of the portal session (cookies and localStorage).
+
+    Nothing is written when the cryptography package is missing, the session is
+    never stored in plain text.
+    """
+
+    def __init__(self, path: str, key: bytes, max_age = DEFAULT_MAX_AGE, logger = None):
+        self.__path = path
+        self.__fernet = Fernet(key) if Fernet is not None else None
+        self.__max_age = max_age
+        self.__logger = logger
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[SessionCache] {msg}")
+
+    @property
+    def enabled(self):
+        return self.__fernet is not None
+
+    def save(self, cookies: list, local_storage: dict):
+        if not self.enabled:
+            self.__log("[WARN] cryptography is not installed, session not cached.")
+            return False
+
+        data = json.dumps({"cookies": cookies, "local_storage": local_storage}).encode("utf-8")
+        token = self.__fernet.encrypt(data)
+
+        directory = os.path.dirname(self.__path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write then rename so a crash never leaves a truncated cache behind
+        tmp_path = f"{self.__path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(token)
+        os.replace(tmp_path, self.__path)
+        return True
+
+    def load(self):
+        """Returns {"cookies": [...], "local_storage": {...}}, or None if missing, expired or unreadable."""
+        if not self.enabled or not os.path.isfile(self.__path):
+            return None
+
+        with open(self.__path, "rb") as f:
+            token = f.read()
+
+        try:
+            data = json.loads(self.__fernet.decrypt(token, ttl=self.__max_age))
+        except (InvalidToken, ValueError):
+            self.__log("[INFO] Cached session expired or unreadable.")
+            self.clear()
+            return None
+
+        now = time()
+        data["cookies"] = [c for c in data["cookies"] if c.get("expiry", now + 1) > now]
+        return data
+
+    def clear(self):
+        if os.path.isfile(self.__path):
+            os.remove(self.__path)
@@ -0,0 +1,165 @@
+from time import perf_counter, sleep
+
+from selenium.common.exceptions import JavascriptException, TimeoutException
+from selenium.webdriver.support.ui import WebDriverWait
+
+from ..metrics import metrics
+
+# What chromedriver reports when the page navigates while a script waits; the
+# wait is then resumed on the new document. Any other script error is a bug in
+# the script or the page refusing it (CSP) and would fail again right away.
+NAVIGATION_ERRORS = ("document unloaded", "navigated", "target frame detached", "execution context was destroyed")
+NAVIGATION_RETRY_PAUSE = 0.05
+
+# Each script resolves as soon as the browser reports the condition, or with
+# null once timeoutMs has elapsed. The last argument is Selenium's callback.
+
+PAGE_LOADED_JS = """
+var timeoutMs = arguments[0];
+var done = arguments[arguments.length - 1];
+if (document.readyState === 'complete') { done(true); return; }
+var timer = setTimeout(function () { done(null); }, timeoutMs);
+window.addEventListener('load', function () { clearTimeout(timer); done(true); });
+"""
+
+ELEMENT_PRESENT_JS = """
+var selector = arguments[0], timeoutMs = arguments[1];
+var done = arguments[arguments.length - 1];
+var found = document.querySelector(selector);
+if (found) { done(found); return; }
+var observer = new MutationObserver(function () {
+    var el = document.querySelector(selector);
+    if (el) { clearTimeout(timer); observer.disconnect(); done(el); }
+});
+var timer = setTimeout(function () { observer.disconnect(); done(null); }, timeoutMs);
+observer.observe(document.documentElement, {childList: true, subtree: true});
+"""
+
+LINK_CHANGED_JS = """
+var selector = arguments[0], previous = arguments[1], timeoutMs = arguments[2];
+var done = arguments[arguments.length - 1];
+function current() {
+    var el = document.querySelector(selector);
+    return el ? (el.href || el.src || null) : null;
+}
+function check() {
+    var url = current();
+    if (url && url !== previous) { clearTimeout(timer); observer.disconnect(); done(url); return true; }
+    return false;
+}
+var observer = new MutationObserver(check);
+var timer = setTimeout(function () { observer.disconnect(); done(null); }, timeoutMs);
+if (!check()) {
+    observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+}
+"""
+
+IMAGES_READY_JS = """
+var selector = arguments[0], timeoutMs = arguments[1];
+var done = arguments[arguments.length - 1];
+function isReady(el) {
+    if (el.tagName === 'CANVAS') return el.width > 0 && el.height > 0;
+    return el.complete && el.naturalWidth > 0;
+}
+function check() {
+    var els = document.querySelectorAll(selector);
+    if (!els.length) return false;
+    for (var i = 0; i < els.length; i++) { if (!isReady(els[i])) return false; }
+    clearTimeout(timer); observer.disconnect();
+    document.removeEventListener('load', check, true);
+    done(true);
+    return true;
+}
+var observer = new MutationObserver(check);
+var timer = setTimeout(function () {
+    observer.disconnect();
+    document.removeEventListener('load', check, true);
+    done(null);
+}, timeoutMs);
+if (!check()) {
+    // Image load events don't bubble, so listen in the capture phase
+    document.addEventListener('load', check, true);
+    observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+}
+"""
+
+
+class BrowserWaiter:
+    """
+    Waits that resolve on readiness signals raised inside the page (load event,
+    MutationObserver, image load) instead of fixed sleeps or 500ms polling.
+    Every wait is timed into the browser.wait metric, labelled with its name.
+    """
+
+    def __init__(self, driver, default_timeout = 15, logger = None):
+        self.__driver = driver
+        self.__default_timeout = default_timeout
+        self.__logger = logger
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[BrowserWaiter] {msg}")
+
+    def __record(self, name, start, timed_out = False):
+        elapsed = perf_counter() - start
+        metrics.observe("browser.wait", elapsed, wait=name)
+        if timed_out:
+            metrics.count("wait_timeouts", wait=name)
+        self.__log(f"{name}: {elapsed * 1000:.0f}ms{' (timeout)' if timed_out else ''}")
+
+    def __run_async(self, name, script, timeout, *args):
+        timeout = timeout or self.__default_timeout
+        start = perf_counter()
+        deadline = start + timeout
+
+        # Give the driver a little slack so the script's own timer fires first
+        self.__driver.set_script_timeout(timeout + 2)
+        remaining = timeout
+        while True:
+            try:
+                result = self.__driver.execute_async_script(script, *args, int(remaining * 1000))
+                break
+            except JavascriptException as e:
+                if not any(m in (e.msg or "").lower() for m in NAVIGATION_ERRORS):
+                    raise
+                # Let the new document start loading before waiting on it
+                sleep(NAVIGATION_RETRY_PAUSE)
+                remaining = deadline - perf_counter()
+                if remaining <= 0:
+                    result = None
+                    break
+
+        if result is None:
+            self.__record(name, start, timed_out=True)
+            raise TimeoutException(f"{name} timed out")
+
+        self.__record(name, start)
+        return result
+
+    def page_loaded(self, timeout = None):
+        return self.__run_async("page_loaded", PAGE_LOADED_JS, timeout)
+
+    def element(self, css_selector, timeout = None):
+        """Returns the first element matching css_selector once it is attached."""
+        return self.__run_async(f"element {css_selector}", ELEMENT_PRESENT_JS, timeout, css_selector)
+
+    def link_changed(self, css_selector, previous_url, timeout = None):
+        """Returns the new href/src of css_selector once it differs from previous_url."""
+        return self.__run_async(f"link_changed {css_selector}", LINK_CHANGED_JS, timeout, css_selector, previous_url)
+
+    def images_ready(self, css_selector = "img, canvas", timeout = None):
+        return self.__run_async(f"images_ready {css_selector}", IMAGES_READY_JS, timeout, css_selector)
+
+    def new_window(self, known_handles, timeout = None):
+        """Returns the handle of a window that is not in known_handles."""
+        start = perf_counter()
+        try:
+            WebDriverWait(self.__driver, timeout or self.__default_timeout, poll_frequency=0.05).until(
+                lambda d: len(d.window_handles) > len(known_handles)
+            )
+        except TimeoutException:
+            self.__record("new_window", start, timed_out=True)
+            raise
+
+        self.__record("new_window", start)
+        return [h for h in self.__driver.window_handles if h not in known_handles][0]
@@ -0,0 +1,840 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import monotonic, perf_counter
+
+from .adb_helpers import get_connected_devices
+from .media_staging import MediaStager
+from .metrics import metrics
+from .profiler import SamplingProfiler
+from .recovery import (
+    RecoveryPolicy, CircuitBreaker, classify_failure, BROWSER_LADDERS, DEVICE_LADDERS, FAILURE_TIMEOUT,
+    ACTION_RELOCATE, ACTION_RENAVIGATE, ACTION_RESTART
+)
+from .browser.browser_automator_v2 import BrowserAutomator, get_my_default_chrome_options
+from .browser.browser_pool import split_shards
+from .android.android_automator_v2 import AndroidAutomator, get_my_default_ui_automator2_options
+from .android.device_pool import DeviceSlot, DEFAULT_SYSTEM_PORT
+from .android.receipts import ReceiptWriter, DEFAULT_RECEIPTS_PATH, STATUS_FAILED
+
+DEFAULT_PREFETCH_DEPTH = 3
+
+STAGE_ENGINE = "engine"
+STAGE_GENERATE = "generate"
+STAGE_HARVEST = "harvest"
+STAGE_FETCH = "fetch"
+STAGE_STAGE = "stage"
+STAGE_PAY = "pay"
+STAGE_VERIFY = "verify"
+
+
+def _env_flag(name):
+    return os.getenv(name, "0") == "1"
+
+
+class EngineConfig:
+    """Settings of a payment run. from_env() reads them from the environment (.env)."""
+
+    def __init__(self, base_url, username, password, appium_server_url, pin, devices = None,
+                 prefetch_depth = DEFAULT_PREFETCH_DEPTH, browser_pool_size = 1, chunk_size = None,
+                 session_cache_path = None, receipts_path = DEFAULT_RECEIPTS_PATH, fast_profile = False,
+                 direct_driver = False, hot_join = False, max_retry = 3, max_restarts = 2, device_poll_interval = 2,
+                 keep_sessions = False, metrics_path = None, metrics_port = None, profile_dir = None,
+                 retry_backoff = 0.5, circuit_threshold = 3, circuit_cooldown = 5.0):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.appium_server_url = appium_server_url
+        self.pin = pin
+        # None pays on every connected device
+        self.devices = devices
+        self.prefetch_depth = max(1, prefetch_depth)
+        self.browser_pool_size = max(1, browser_pool_size)
+        self.chunk_size = chunk_size
+        self.session_cache_path = session_cache_path
+        self.receipts_path = receipts_path
+        self.fast_profile = fast_profile
+        self.direct_driver = direct_driver
+        self.hot_join = hot_join
+        # Recoveries per failed step, and tries per QRIS across devices
+        self.max_retry = max_retry
+        self.max_restarts = max_restarts
+        # Seconds before the first recovery, doubled for each further one
+        self.retry_backoff = retry_backoff
+        # Failures in a row after which a browser or device is paused for circuit_cooldown seconds
+        self.circuit_threshold = circuit_threshold
+        self.circuit_cooldown = circuit_cooldown
+        self.device_poll_interval = device_poll_interval
+        # Leave healthy browser and device sessions open for the next run
+        self.keep_sessions = keep_sessions
+        # Stage timings as JSON lines, and a Prometheus /metrics endpoint on localhost
+        self.metrics_path = metrics_path
+        self.metrics_port = metrics_port
+        # Sample every run and write its flame graph and hotspots here (None = off)
+        self.profile_dir = profile_dir
+
+    @classmethod
+    def from_env(cls, pin = None, devices = None):
+        device_pool = _env_flag("ANDROID_DEVICE_POOL")
+        if devices is None and not device_pool and os.getenv("DEVICE_UDID"):
+            devices = [os.getenv("DEVICE_UDID")]
+
+        return cls(
+            os.getenv("WEB_BASE_URL"),
+            os.getenv("WEB_CRED_USERNAME"),
+            os.getenv("WEB_CRED_PASSWORD"),
+            os.getenv("APPIUM_SERVER_URL"),
+            pin or os.getenv("NEO_PIN"),
+            devices=None if device_pool else devices,
+            prefetch_depth=int(os.getenv("QRIS_PREFETCH_DEPTH", DEFAULT_PREFETCH_DEPTH)),
+            browser_pool_size=int(os.getenv("BROWSER_POOL_SIZE", 1)),
+            chunk_size=int(os.getenv("QRIS_CHUNK_SIZE", 0)) or None,
+            session_cache_path=os.getenv("SESSION_CACHE_PATH") or None,
+            receipts_path=os.getenv("RECEIPTS_PATH", DEFAULT_RECEIPTS_PATH),
+            fast_profile=_env_flag("ANDROID_FAST_PROFILE"),
+            direct_driver=_env_flag("ANDROID_DIRECT_DRIVER"),
+            hot_join=device_pool,
+            metrics_path=os.getenv("METRICS_PATH") or None,
+            metrics_port=int(os.getenv("METRICS_PORT", 0)) or None,
+            profile_dir=os.getenv("PROFILE_DIR") or None,
+        )
+
+
+class PaymentEngine:
+    """
+    Runs a batch of user ids through explicit stages connected by asyncio
+    queues:
+
+        generate -> harvest -> fetch  (one task per browser shard)
+            -> ready queue (bounded by prefetch_depth) ->
+        stage -> pay                  (one task per device)
+            -> results queue ->
+        verify                        (receipts and accounting)
+
+    Every blocking Selenium/Appium/adb call runs on the executor of the browser
+    or device it belongs to, so the loop stays free. cancel() stops the run
+    right away, from any thread: the stage tasks are cancelled and the drivers
+    quit in the background, which makes their in-flight calls fail.
+
+    listener, if given, is called on the loop thread with a dict per event
+    (stage, message and details such as user_id and device).
+
+    An engine can run several batches one after another. With
+    config.keep_sessions the logged-in browsers and device sessions of a run
+    are reused by the next one, until close().
+    """
+
+    def __init__(self, config: EngineConfig, listener = None, android_automators = None, logger = None):
+        self.__config = config
+        self.__listener = listener
+        # Sessions created ahead of time or kept from the last run
+        self.__warm = dict(android_automators or {})
+        self.__idle_browsers = []
+        self.__ports = {}
+        self.__logger = logger
+
+        self.__loop = None
+        self.__task = None
+        self.__run_lock = threading.Lock()
+        self.__cancel_requested = False
+        self.__quitters = []
+
+        self.__slots = {}
+        self.__browser_tasks = []
+        self.__drained = False
+        self.__devices_gone = None
+        self.__total = 0
+        self.__fetched = 0
+        self.__paid = 0
+        self.__failed = []
+        self.__started_at = None
+        self.__cancelled = False
+        # QRIS a failing device gave back, paid before the next prefetched one
+        self.__retries = deque()
+        self.__attempts = {}
+
+        self.__browser_policy = RecoveryPolicy(BROWSER_LADDERS, config.max_retry, config.retry_backoff)
+        self.__device_policy = RecoveryPolicy(DEVICE_LADDERS, config.max_retry, config.retry_backoff)
+
+        if config.metrics_path:
+            metrics.open_jsonl(config.metrics_path)
+        if config.metrics_port:
+            metrics.serve(config.metrics_port)
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[PaymentEngine] {msg}")
+
+    def __emit(self, stage, message, **data):
+        self.__log(f"[{stage}] {message}")
+        if self.__listener is not None:
+            try:
+                self.__listener(dict(stage=stage, message=message, **data))
+            except Exception as e:
+                self.__log(f"[WARN] Listener failed: {e}")
+
+    def run(self, user_ids: list):
+        """Blocking entry point for threads and scripts. Returns the summary()."""
+        try:
+            return asyncio.run(self.run_async(user_ids))
+        finally:
+            for thread in self.__quitters:
+                thread.join(timeout=15)
+
+    def cancel(self):
+        """Cancels the current run. Between runs it does nothing, so a late call can't cancel the next one."""
+        with self.__run_lock:
+            if self.__task is None:
+                return
+            self.__cancel_requested = True
+            self.__loop.call_soon_threadsafe(self.__task.cancel)
+
+    def warm_up(self):
+        """Creates the browser and device sessions of the next run ahead of time. Needs keep_sessions."""
+        config = self.__config
+        devices = config.devices if config.devices is not None else get_connected_devices()
+        browsers = max(0, config.browser_pool_size - len(self.__idle_browsers))
+
+        with ThreadPoolExecutor(max_workers=max(1, browsers + len(devices))) as executor:
+            browser_futures = [executor.submit(self.__new_browser) for _ in range(browsers)]
+            device_futures = {
+                udid: executor.submit(self.__new_device, DeviceSlot(udid, self.__system_port(udid)))
+                for udid in devices if udid not in self.__warm
+            }
+
+        for future in browser_futures:
+            try:
+                self.__idle_browsers.append(future.result())
+            except Exception as e:
+                self.__emit(STAGE_GENERATE, f"Browser warm-up failed: {e}")
+        for udid, future in device_futures.items():
+            try:
+                self.__warm[udid] = future.result()
+            except Exception as e:
+                self.__emit(STAGE_PAY, f"{udid} warm-up failed: {e}", device=udid)
+
+        self.__emit(STAGE_ENGINE, f"Warm sessions: {len(self.__idle_browsers)} browser(s), "
+                                  f"{len(self.__warm)} device(s).")
+
+    def warm_sessions(self):
+        return {"browsers": len(self.__idle_browsers), "devices": sorted(self.__warm)}
+
+    def close(self):
+        """Quits the sessions kept between runs."""
+        automators = self.__idle_browsers + list(self.__warm.values())
+        self.__idle_browsers = []
+        self.__warm = {}
+        for automator in automators:
+            try:
+                automator.quit()
+            except Exception as e:
+                self.__log(f"[WARN] Quit failed: {e}")
+
+    def progress(self):
+        return {
+            "total": self.__total,
+            "fetched": self.__fetched,
+            "paid": self.__paid,
+            "failed": len(self.__failed),
+            "devices": {
+                udid: {
+                    "paid": slot.paid,
+                    "failed": len(slot.failed),
+                    "per_minute": slot.throughput(),
+                    "mean": slot.busy_time / slot.paid if slot.paid else 0.0,
+                    "connected": not slot.dropped,
+                }
+                for udid, slot in self.__slots.items()
+            },
+        }
+
+    def summary(self):
+        summary = self.progress()
+        summary["failed_user_ids"] = list(self.__failed)
+        summary["cancelled"] = self.__cancelled
+        summary["elapsed"] = monotonic() - self.__started_at if self.__started_at else 0.0
+        return summary
+
+    def __write_profile(self, profiler):
+        profiler.stop()
+        name = f"run-{datetime.now():%Y%m%d-%H%M%S}"
+        try:
+            paths = profiler.write(self.__config.profile_dir, name)
+        except OSError as e:
+            self.__emit(STAGE_ENGINE, f"Could not write the profile: {e}")
+            return
+        self.__emit(STAGE_ENGINE, f"Profile written to {paths[0].rsplit('.', 1)[0]}.*", profile=paths)
+
+    def __new_breaker(self):
+        return CircuitBreaker(self.__config.circuit_threshold, self.__config.circuit_cooldown)
+
+    async def __back_off(self, policy, side, stage, failure, action, attempt, what, **data):
+        metrics.count("recoveries", side=side, failure=failure, action=action)
+        delay = policy.delay(attempt)
+        self.__emit(stage, f"{what}: {failure}, {action} in {delay:.1f}s (recovery {attempt + 1}).", **data)
+        await asyncio.sleep(delay)
+
+    async def __call(self, executor, fn, *args):
+        return await self.__loop.run_in_executor(executor, fn, *args)
+
+    def __quit_in_background(self, automator):
+        """Quits without waiting, which also aborts whatever call is blocked on the driver."""
+        def quit():
+            try:
+                automator.quit()
+            except Exception:
+                pass
+        thread = threading.Thread(target=quit, daemon=True)
+        thread.start()
+        self.__quitters.append(thread)
+
+    async def __close(self, executor, automator, cancelled):
+        if automator is not None:
+            if cancelled:
+                self.__quit_in_background(automator)
+            else:
+                try:
+                    await self.__call(executor, automator.quit)
+                except Exception as e:
+                    self.__log(f"[WARN] Quit failed: {e}")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def __fail(self, user_id, reason):
+        self.__failed.append(user_id)
+        self.__emit(STAGE_ENGINE, f"{user_id} failed: {reason}", user_id=user_id)
+
+    async def run_async(self, user_ids: list):
+        with self.__run_lock:
+            self.__loop = asyncio.get_running_loop()
+            self.__task = asyncio.current_task()
+        self.__started_at = monotonic()
+        self.__total = len(user_ids)
+        self.__fetched = 0
+        self.__paid = 0
+        self.__failed = []
+        self.__slots = {}
+        self.__browser_tasks = []
+        self.__drained = False
+        self.__devices_gone = asyncio.Event()
+        self.__cancelled = False
+        self.__retries.clear()
+        self.__attempts = {}
+
+        config = self.__config
+        profiler = SamplingProfiler(logger=self.__logger).start() if config.profile_dir else None
+        ready = asyncio.Queue(maxsize=config.prefetch_depth)
+        results = asyncio.Queue()
+        receipts = ReceiptWriter(config.receipts_path)
+
+        shards = split_shards(user_ids, config.browser_pool_size)
+        for shard in shards:
+            shard.breaker = self.__new_breaker()
+        browser_tasks = self.__browser_tasks
+        watcher = None
+        sentinel = None
+        devices_gone = None
+        verifier = asyncio.create_task(self.__verify_stage(results, receipts))
+        try:
+            if self.__cancel_requested:
+                raise asyncio.CancelledError()
+
+            devices = config.devices
+            if devices is None:
+                devices = await self.__call(None, get_connected_devices)
+            for udid in devices:
+                self.__start_device(udid, ready, results)
+
+            if not self.__slots and not config.hot_join:
+                self.__emit(STAGE_ENGINE, "No Android device connected.")
+                for user_id in user_ids:
+                    self.__fail(user_id, "no device")
+                return self.summary()
+
+            if config.hot_join:
+                watcher = asyncio.create_task(self.__watch_devices(ready, results))
+
+            self.__emit(STAGE_ENGINE, f"Paying {len(user_ids)} QRIS on {len(self.__slots)} device(s).")
+            for shard in shards:
+                browser_tasks.append(asyncio.create_task(self.__browser_stage(shard, ready)))
+
+            await asyncio.gather(*browser_tasks, return_exceptions=True)
+            # Only short of the whole batch when the browsers were stopped for lack of devices
+            for shard in shards:
+                for user_id in shard.remaining_ids():
+                    self.__fail(user_id, "no device left")
+
+            # The marker waits on a full queue while the devices pay, and must
+            # not hold the run up once the last of them gave up
+            sentinel = asyncio.create_task(ready.put(None))
+            devices_gone = asyncio.create_task(self.__devices_gone.wait())
+            while not self.__devices_gone.is_set():
+                waiting = [slot.task for slot in self.__slots.values() if slot.is_running()]
+                if config.hot_join and not sentinel.done():
+                    # A device may still join to take the queued QRIS
+                    waiting.append(sentinel)
+                if not waiting:
+                    break
+                await asyncio.wait(waiting + [devices_gone], return_when=asyncio.FIRST_COMPLETED)
+
+            self.__drained = True
+            # Whatever is left has no device to be paid on
+            while not ready.empty():
+                item = ready.get_nowait()
+                if item is not None:
+                    self.__fail(item[0], "no device left")
+            self.__record_depth(ready)
+            while self.__retries:
+                self.__fail(self.__retries.popleft()[0], "no device left")
+
+            self.__emit(STAGE_ENGINE, f"Done: {self.__paid} paid, {len(self.__failed)} failed.")
+        except asyncio.CancelledError:
+            self.__cancel_requested = True
+            self.__cancelled = True
+            self.__emit(STAGE_ENGINE, "Cancelled.")
+        finally:
+            self.__drained = True
+            tasks = browser_tasks + [slot.task for slot in self.__slots.values() if slot.task]
+            tasks += [task for task in (sentinel, devices_gone) if task is not None]
+            if watcher is not None:
+                tasks.append(watcher)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+            await results.put(None)
+            await asyncio.gather(verifier, return_exceptions=True)
+            receipts.close()
+            if profiler is not None:
+                self.__write_profile(profiler)
+
+            with self.__run_lock:
+                self.__task = None
+                self.__cancel_requested = False
+
+        return self.summary()
+
+    # Browser side: generate -> harvest -> fetch
+
+    def __new_browser(self):
+        if self.__idle_browsers:
+            return self.__idle_browsers.pop()
+
+        config = self.__config
+        automator = BrowserAutomator(
+            config.base_url, get_my_default_chrome_options(), self.__logger,
+            session_cache_path=config.session_cache_path, chunk_size=config.chunk_size
+        )
+        try:
+            automator.set_credentials(config.username, config.password)
+            automator.setup()
+            self.__check_cancelled()
+        except Exception:
+            automator.quit()
+            raise
+        return automator
+
+    def __check_cancelled(self):
+        # Sessions still being created when the run is cancelled are not handed back to anyone
+        if self.__cancel_requested:
+            raise RuntimeError("Run cancelled")
+
+    async def __browser_stage(self, shard, ready):
+        config = self.__config
+        while shard.remaining_ids():
+            if shard.restarts > config.max_restarts:
+                self.__emit(STAGE_FETCH, f"Browser #{shard.index} gave up after {shard.restarts - 1} restarts.")
+                for user_id in shard.remaining_ids():
+                    self.__fail(user_id, "browser crashed")
+                shard.done = len(shard.user_ids)
+                break
+
+            if shard.breaker.remaining():
+                self.__emit(STAGE_FETCH, f"Browser #{shard.index} keeps crashing, "
+                                         f"restarting in {shard.breaker.remaining():.1f}s.")
+                await asyncio.sleep(shard.breaker.remaining())
+
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"browser-{shard.index}")
+            automator = None
+            cancelled = False
+            healthy = False
+            try:
+                self.__emit(STAGE_GENERATE, f"Browser #{shard.index}: logging in..")
+                automator = await self.__call(executor, self.__new_browser)
+                await self.__fetch_shard(executor, automator, shard, ready)
+                healthy = True
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            except Exception as e:
+                shard.restarts += 1
+                shard.breaker.record_failure()
+                metrics.count("recoveries", side="browser", failure=classify_failure(e), action=ACTION_RESTART)
+                self.__emit(STAGE_FETCH, f"Browser #{shard.index} crashed at {shard.done}/{len(shard.user_ids)}: {e}")
+            finally:
+                if healthy and config.keep_sessions:
+                    self.__idle_browsers.append(automator)
+                    automator = None
+                await self.__close(executor, automator, cancelled)
+
+        shard.finished = True
+
+    async def __fetch_shard(self, executor, automator, shard, ready):
+        user_ids = shard.remaining_ids()
+        automator.set_user_ids(user_ids)
+
+        idx = 0
+        while idx < len(user_ids):
+            self.__emit(STAGE_GENERATE, f"Generating QRIS from #{idx + 1} of {len(user_ids)}..")
+            await self.__generate(executor, automator, shard, idx)
+            start, end = automator.generated_range()
+
+            manifest = await self.__call(executor, automator.harvest_payment_urls)
+            if manifest:
+                self.__emit(STAGE_HARVEST, f"Harvested {len(manifest)} payment URLs.")
+                downloads = automator.download_manifest(manifest)
+                while True:
+                    with metrics.span("engine.fetch", browser=shard.index):
+                        item = await self.__call(executor, next, downloads, None)
+                    if item is None:
+                        break
+                    await self.__fetched_one(shard, *item, ready)
+            else:
+                self.__emit(STAGE_HARVEST, "No payment URL manifest, walking the pages.")
+                for i in range(start, end):
+                    with metrics.span("engine.fetch", browser=shard.index):
+                        filename = await self.__download(executor, automator, shard, user_ids, i, start)
+                    await self.__fetched_one(shard, user_ids[i], filename, ready)
+
+            idx = end
+
+    async def __generate(self, executor, automator, shard, idx):
+        """Submits the user ids from idx, submitting again on failures the browser policy recovers in place."""
+        attempt = 0
+        while True:
+            try:
+                await self.__call(executor, automator.generate_QRIS, idx)
+                return
+            except Exception as e:
+                failure = classify_failure(e)
+                action = self.__browser_policy.next_action(failure, attempt)
+                if action in (None, ACTION_RESTART):
+                    raise
+                await self.__back_off(self.__browser_policy, "browser", STAGE_GENERATE, failure, action, attempt,
+                                      f"Browser #{shard.index} generating from #{idx + 1}")
+                attempt += 1
+
+    async def __download(self, executor, automator, shard, user_ids, i, start):
+        """
+        Downloads the i-th QRIS while walking the pages, recovering as the
+        browser policy says: a QRIS that did not show up is retried on the page
+        as it is (relocate), then on a result page submitted again from this
+        user id (renavigate). Raises when the browser has to be restarted;
+        None when the QRIS is given up.
+        """
+        action = None
+        attempt = 0
+        while True:
+            error = None
+            try:
+                if action == ACTION_RENAVIGATE:
+                    await self.__call(executor, automator.generate_QRIS, i)
+                # Only the first try pages forward, a recovery retries the QRIS already shown
+                filename = await self.__call(executor, automator.download_QRIS, i, action is None and i > start)
+                if filename:
+                    return filename
+                failure = FAILURE_TIMEOUT
+            except Exception as e:
+                error = e
+                failure = classify_failure(e)
+
+            action = self.__browser_policy.next_action(failure, attempt)
+            if action == ACTION_RELOCATE and error is not None:
+                # The error may have come before the page moved to this QRIS
+                action = ACTION_RENAVIGATE
+            if action in (None, ACTION_RESTART):
+                if error is not None:
+                    raise error
+                return None
+            await self.__back_off(self.__browser_policy, "browser", STAGE_FETCH, failure, action, attempt,
+                                  f"Browser #{shard.index} on {user_ids[i]}", user_id=user_ids[i])
+            attempt += 1
+
+    def __record_depth(self, ready):
+        metrics.gauge("ready_depth", ready.qsize())
+
+    async def __fetched_one(self, shard, user_id, filename, ready):
+        if filename is None:
+            metrics.count("download_failed")
+            shard.done += 1
+            shard.failed.append(user_id)
+            self.__fail(user_id, "QRIS download failed")
+            return
+
+        self.__fetched += 1
+        shard.breaker.record_success()
+        metrics.count("downloaded")
+        self.__emit(STAGE_FETCH, f"QRIS {user_id} downloaded ({ready.qsize()}/{ready.maxsize} prefetched).",
+                    user_id=user_id)
+        # Blocks while the devices are prefetch_depth QRIS behind
+        with metrics.span("engine.backpressure", browser=shard.index):
+            await ready.put((user_id, filename))
+        self.__record_depth(ready)
+        shard.done += 1
+
+    # Device side: stage -> pay
+
+    def __system_port(self, udid):
+        # Fixed per device for the life of the engine, so kept sessions never clash
+        if udid not in self.__ports:
+            self.__ports[udid] = DEFAULT_SYSTEM_PORT + len(self.__ports)
+        return self.__ports[udid]
+
+    def __start_device(self, udid, ready, results):
+        slot = self.__slots.get(udid)
+        if slot is None:
+            slot = DeviceSlot(udid, self.__system_port(udid), self.__new_breaker())
+            self.__slots[udid] = slot
+        slot.dropped = False
+        slot.task = asyncio.create_task(self.__device_stage(slot, ready, results))
+
+    def __new_device(self, slot):
+        config = self.__config
+        automator = self.__warm.pop(slot.udid, None)
+        if automator is not None and not automator.is_alive():
+            self.__emit(STAGE_PAY, f"{slot.udid} kept session expired, creating a new one.", device=slot.udid)
+            try:
+                automator.quit()
+            except Exception as e:
+                self.__log(f"[WARN] Quit failed: {e}")
+            automator = None
+        if automator is None:
+            options = get_my_default_ui_automator2_options(slot.udid, slot.system_port, config.fast_profile)
+            automator = AndroidAutomator(
+                config.appium_server_url, options, self.__logger, fast_profile=config.fast_profile,
+                direct_driver=config.direct_driver
+            )
+        automator.set_credentials(config.pin)
+        if self.__cancel_requested or slot.dropped:
+            automator.quit()
+            raise RuntimeError("Run cancelled")
+        return automator
+
+    async def __next_item(self, slot, ready):
+        """A QRIS handed back by a failing device first, then the next prefetched one."""
+        if self.__retries:
+            return self.__retries.popleft()
+        with metrics.span("engine.ready_wait", device=slot.udid):
+            item = await ready.get()
+        self.__record_depth(ready)
+        if item is None and self.__retries:
+            # Leave the marker for the other devices, the handed back QRIS still have to be paid
+            ready.put_nowait(None)
+            return self.__retries.popleft()
+        return item
+
+    def __hand_back(self, slot, item, reason):
+        """Lets any device pay a QRIS this one could not, until it has been tried max_retry times."""
+        user_id = item[0]
+        self.__attempts[user_id] = self.__attempts.get(user_id, 0) + 1
+        if self.__attempts[user_id] > self.__config.max_retry:
+            slot.failed.append(user_id)
+            self.__fail(user_id, reason)
+            return
+        self.__retries.append(item)
+        self.__emit(STAGE_PAY, f"{slot.udid}: {user_id} handed back ({reason}).", user_id=user_id, device=slot.udid)
+
+    async def __wait_circuit(self, slot):
+        if slot.breaker.remaining():
+            self.__emit(STAGE_PAY, f"{slot.udid} keeps failing, pausing it for {slot.breaker.remaining():.1f}s.",
+                        device=slot.udid)
+            await asyncio.sleep(slot.breaker.remaining())
+
+    async def __recover_device(self, slot, executor, automator, error):
+        """
+        Brings the device back to the bank app's main screen after a failed
+        payment when the device policy allows it. Raises error when the session
+        has to be restarted instead.
+        """
+        failure = classify_failure(error)
+        attempt = 0
+        while self.__device_policy.next_action(failure, attempt) == ACTION_RENAVIGATE:
+            await self.__back_off(self.__device_policy, "device", STAGE_PAY, failure, ACTION_RENAVIGATE, attempt,
+                                  slot.udid, device=slot.udid)
+            if await self.__call(executor, automator.return_to_main):
+                slot.breaker.record_failure()
+                return
+            attempt += 1
+        raise error
+
+    async def __device_stage(self, slot, ready, results):
+        config = self.__config
+        while not slot.dropped:
+            await self.__wait_circuit(slot)
+
+            executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"device-{slot.udid}")
+            automator = None
+            item = None
+            paying = False
+            cancelled = False
+            healthy = False
+            try:
+                self.__emit(STAGE_STAGE, f"{slot.udid}: starting session..", device=slot.udid)
+                automator = await self.__call(executor, self.__new_device, slot)
+                stager = MediaStager(slot.udid, logger=self.__logger)
+                await self.__call(executor, stager.purge)
+
+                while True:
+                    await self.__wait_circuit(slot)
+                    item = await self.__next_item(slot, ready)
+                    if item is None:
+                        # Leave the marker for the other devices
+                        ready.put_nowait(None)
+                        self.__report_timings(slot, automator)
+                        healthy = True
+                        return
+
+                    user_id, filename = item
+                    start = perf_counter()
+                    remote_path = None
+
+                    try:
+                        remote_path, size, latency = await self.__call(executor, stager.stage_file, filename)
+                        if not size or latency is None:
+                            # Paying now would pick whatever image the gallery shows first
+                            raise RuntimeError(f"{user_id} could not be staged "
+                                               f"({'push failed' if not size else 'not indexed'})")
+                        self.__emit(STAGE_STAGE, f"{slot.udid}: staged {user_id} ({size / 1024:.1f} KB, "
+                                                 f"{latency * 1000:.0f} ms).", user_id=user_id, device=slot.udid)
+
+                        self.__emit(STAGE_PAY, f"{slot.udid}: paying {user_id}..", user_id=user_id, device=slot.udid)
+                        paying = True
+                        receipt = await self.__call(executor, automator.pay_qris_transaction, remote_path, user_id)
+                        paying = False
+                    except Exception as e:
+                        failure = classify_failure(e)
+                        if paying and automator.payment_submitted():
+                            self.__settle(slot, item, True, f"state unknown after the PIN ({failure})")
+                        else:
+                            self.__settle(slot, item, False, failure)
+                            if remote_path is not None:
+                                # Handed back, so it must not stay around to be picked from the gallery here
+                                await self.__call(executor, stager.release, remote_path)
+                        item = None
+                        paying = False
+                        await self.__recover_device(slot, executor, automator, e)
+                        continue
+
+                    slot.breaker.record_success()
+                    slot.busy_time += perf_counter() - start
+                    metrics.observe("engine.payment", perf_counter() - start, device=slot.udid)
+                    await results.put((slot, receipt))
+                    item = None
+                    await self.__call(executor, stager.release, remote_path)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            except Exception as e:
+                self.__emit(STAGE_PAY, f"{slot.udid} stopped: {e}", device=slot.udid)
+                metrics.count("recoveries", side="device", failure=classify_failure(e), action=ACTION_RESTART)
+                slot.restarts += 1
+                slot.breaker.record_failure()
+            finally:
+                if item is not None:
+                    # Cancelled mid-payment: by the run, or because the device disconnected.
+                    # Cancelling doesn't stop the executor thread, which may still type the
+                    # PIN, so a QRIS being paid is never handed back to another device.
+                    reason = "disconnected" if slot.dropped else "interrupted"
+                    self.__settle(slot, item, paying or not slot.dropped, reason)
+                if healthy and config.keep_sessions:
+                    self.__warm[slot.udid] = automator
+                    automator = None
+                await self.__close(executor, automator, cancelled)
+
+            if slot.restarts > config.max_restarts:
+                self.__emit(STAGE_PAY, f"{slot.udid} gave up after {slot.restarts - 1} restarts.", device=slot.udid)
+                slot.gave_up = True
+                self.__stop_browsers_if_alone(slot)
+                return
+
+    def __settle(self, slot, item, final, reason):
+        """
+        A QRIS whose payment failed on slot. It is failed for good when final
+        (e.g. the PIN was already typed, so paying it again could pay twice),
+        otherwise handed back to be paid on any device.
+        """
+        if final:
+            slot.failed.append(item[0])
+            self.__fail(item[0], f"payment {reason} on {slot.udid}")
+        else:
+            self.__hand_back(slot, item, f"{reason} on {slot.udid}")
+
+    def __stop_browsers_if_alone(self, slot):
+        """Without hot join nothing would drain the ready queue anymore, so the browsers must not wait on it."""
+        if self.__config.hot_join or any(s.is_running() for s in self.__slots.values() if s is not slot):
+            return
+        self.__emit(STAGE_ENGINE, "No device left, stopping the browsers.")
+        for task in self.__browser_tasks:
+            task.cancel()
+        # Wakes run_async to fail what is still queued
+        self.__devices_gone.set()
+
+    def __report_timings(self, slot, automator):
+        timings = automator.timings()
+        for step, durations in timings["steps"].items():
+            self.__emit(STAGE_PAY, f"{slot.udid} {step}: mean {sum(durations) / len(durations):.2f}s "
+                                   f"over {len(durations)} payments", device=slot.udid)
+        for activity, offsets in timings["activities"].items():
+            self.__emit(STAGE_PAY, f"{slot.udid} {activity} resumed {sum(offsets) / len(offsets):.2f}s "
+                                   f"into a payment", device=slot.udid)
+
+    async def __watch_devices(self, ready, results):
+        while not self.__drained:
+            await asyncio.sleep(self.__config.device_poll_interval)
+            try:
+                connected = set(await self.__call(None, get_connected_devices))
+            except Exception as e:
+                self.__log(f"[WARN] Device poll failed: {e}")
+                continue
+
+            for udid, slot in self.__slots.items():
+                if udid not in connected and slot.is_running():
+                    self.__emit(STAGE_ENGINE, f"{udid} disconnected, dropping it.", device=udid)
+                    slot.dropped = True
+                    slot.task.cancel()
+
+            for udid in connected:
+                slot = self.__slots.get(udid)
+                if slot is not None and (slot.is_running() or slot.gave_up):
+                    continue
+                if not self.__drained:
+                    self.__emit(STAGE_ENGINE, f"{udid} joined.", device=udid)
+                    self.__start_device(udid, ready, results)
+
+    # verify
+
+    async def __verify_stage(self, results, receipts):
+        while True:
+            item = await results.get()
+            if item is None:
+                return
+
+            slot, receipt = item
+            receipts.write(receipt)
+            metrics.count("payments", status=receipt.status, device=slot.udid)
+
+            if receipt.status == STATUS_FAILED:
+                slot.failed.append(receipt.user_id)
+                self.__fail(receipt.user_id, "rejected by the bank app")
+                continue
+
+            slot.paid += 1
+            self.__paid += 1
+            self.__emit(
+                STAGE_VERIFY,
+                f"{receipt.user_id} paid on {slot.udid}: {receipt.amount}, ref {receipt.reference} "
+                f"({self.__paid}/{self.__total})",
+                user_id=receipt.user_id, device=slot.udid, receipt=receipt.to_dict()
+            )
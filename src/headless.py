@@ -0,0 +1,475 @@
+"""
+Headless runner for machines without a display. From the repository root:
+
+    python -m src.headless run user_ids.txt [--profile [DIR]]
+    python -m src.headless serve [--host 127.0.0.1 --port 8765 | --socket /tmp/qris.sock]
+    python -m src.headless submit user_ids.txt [--url http://127.0.0.1:8765 | --socket /tmp/qris.sock]
+
+`serve` keeps the logged-in browsers and device sessions warm between batches
+and takes batches over a local HTTP API (TCP or Unix socket):
+
+    POST   /batches              user ids, one per line (or {"user_ids": [...]}),
+                                 streams the batch's events as JSON lines;
+                                 ?stream=0 only returns the batch id
+    GET    /batches/<id>         state and summary of a batch
+    GET    /batches/<id>/events  streams the batch's events from the start
+    DELETE /batches/<id>         cancels a queued or running batch
+    GET    /status               warm sessions and queued batches
+    GET    /metrics              stage latencies and counters, Prometheus text
+
+With a token (--token or HEADLESS_TOKEN in .env) every request needs an
+`Authorization: Bearer <token>` header. `serve` refuses to listen on anything
+but a loopback address without one, since whoever reaches the API can spend
+the account's balance.
+
+--profile samples every run and writes its flame graph and hotspots to DIR
+(PROFILE_DIR in .env does the same). Everything else (PIN, portal
+credentials, devices) comes from .env.
+"""
+import argparse
+import hmac
+import http.client
+import ipaddress
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from dotenv import load_dotenv
+
+from .engine import EngineConfig, PaymentEngine
+from .metrics import metrics, PROMETHEUS_CONTENT_TYPE
+from .profiler import DEFAULT_PROFILE_DIR
+from .utils import get_user_ids
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+BATCH_QUEUED = "queued"
+BATCH_RUNNING = "running"
+BATCH_DONE = "done"
+BATCH_CANCELLED = "cancelled"
+
+
+class Batch:
+    """A submitted list of user ids and the events of its run, which any number of clients can follow."""
+
+    def __init__(self, batch_id, user_ids):
+        self.id = batch_id
+        self.user_ids = user_ids
+        self.state = BATCH_QUEUED
+        self.summary = None
+        self.__events = []
+        self.__condition = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.state in (BATCH_DONE, BATCH_CANCELLED)
+
+    def publish(self, event):
+        with self.__condition:
+            self.__events.append(dict(event, batch=self.id))
+            self.__condition.notify_all()
+
+    def finish(self, state, summary = None):
+        with self.__condition:
+            self.state = state
+            self.summary = summary
+            self.__events.append({"batch": self.id, "stage": state, "summary": summary})
+            self.__condition.notify_all()
+
+    def follow(self):
+        """Yields every event of the batch, from the first one until it finishes."""
+        seen = 0
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: len(self.__events) > seen or self.finished)
+                events = self.__events[seen:]
+                finished = self.finished
+            seen += len(events)
+            yield from events
+            if finished and seen == len(self.__events):
+                return
+
+    def to_dict(self):
+        return {"batch": self.id, "state": self.state, "size": len(self.user_ids), "summary": self.summary}
+
+
+class PaymentDaemon:
+    """
+    Runs submitted batches one at a time on a single PaymentEngine that keeps
+    its sessions between batches, so only the first batch pays for browser
+    startup, login and Appium session creation.
+    """
+
+    def __init__(self, config: EngineConfig, logger = None):
+        config.keep_sessions = True
+        self.__engine = PaymentEngine(config, listener=self.__on_event, logger=logger)
+        self.__logger = logger
+
+        self.__ids = itertools.count(1)
+        self.__batches = {}
+        self.__pending = queue.Queue()
+        self.__current = None
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[PaymentDaemon] {msg}")
+
+    def __on_event(self, event):
+        batch = self.__current
+        if batch is not None:
+            batch.publish(event)
+        else:
+            self.__log(f"[{event['stage']}] {event['message']}")
+
+    def start(self, warm_up = True):
+        self.__thread = threading.Thread(target=self.__run_batches, args=(warm_up,), daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        self.__pending.put(None)
+        with self.__lock:
+            for batch in self.__batches.values():
+                if batch.state == BATCH_QUEUED:
+                    batch.finish(BATCH_CANCELLED)
+            if self.__current is not None:
+                self.__engine.cancel()
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def submit(self, user_ids):
+        with self.__lock:
+            batch = Batch(next(self.__ids), user_ids)
+            self.__batches[batch.id] = batch
+        batch.publish({"stage": BATCH_QUEUED, "message": f"Batch {batch.id} queued with {len(user_ids)} user ids."})
+        self.__pending.put(batch)
+        return batch
+
+    def batch(self, batch_id):
+        return self.__batches.get(batch_id)
+
+    def cancel(self, batch_id):
+        with self.__lock:
+            batch = self.__batches.get(batch_id)
+            if batch is None or batch.finished:
+                return False
+            if batch is self.__current:
+                self.__engine.cancel()
+            else:
+                batch.finish(BATCH_CANCELLED)
+            return True
+
+    def status(self):
+        with self.__lock:
+            queued = [b.id for b in self.__batches.values() if b.state == BATCH_QUEUED]
+            current = self.__current.id if self.__current else None
+        return {"running": current, "queued": queued, "sessions": self.__engine.warm_sessions()}
+
+    def __run_batches(self, warm_up):
+        if warm_up:
+            try:
+                self.__engine.warm_up()
+            except Exception as e:
+                self.__log(f"[WARN] Warm-up failed: {e}")
+
+        try:
+            while True:
+                batch = self.__pending.get()
+                if batch is None:
+                    break
+
+                with self.__lock:
+                    if batch.finished:
+                        continue
+                    batch.state = BATCH_RUNNING
+                    self.__current = batch
+
+                try:
+                    summary = self.__engine.run(batch.user_ids)
+                    batch.finish(BATCH_CANCELLED if summary["cancelled"] else BATCH_DONE, summary)
+                except Exception as e:
+                    batch.publish({"stage": "engine", "message": f"Error: {e}"})
+                    batch.finish(BATCH_DONE)
+                finally:
+                    with self.__lock:
+                        self.__current = None
+        finally:
+            self.__engine.close()
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    @property
+    def payment_daemon(self) -> PaymentDaemon:
+        return self.server.payment_daemon
+
+    def log_message(self, format, *args):
+        # client_address is empty on Unix sockets, which the default implementation indexes
+        logging.getLogger(__name__).debug(format % args)
+
+    def __send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __send_metrics(self):
+        data = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def __stream(self, batch):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for event in batch.follow():
+                self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; the batch keeps running
+            pass
+
+    def __authorized(self):
+        token = self.server.token
+        if not token:
+            return True
+        given = self.headers.get("Authorization", "")
+        if hmac.compare_digest(given.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+            return True
+        self.__send_json(401, {"error": "unauthorized"})
+        return False
+
+    def __batch_from_path(self, path):
+        parts = path.strip("/").split("/")
+        if len(parts) < 2 or parts[0] != "batches" or not parts[1].isdigit():
+            return None, parts
+        return self.payment_daemon.batch(int(parts[1])), parts
+
+    def __read_user_ids(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("utf-8")
+        if self.headers.get("Content-Type", "").startswith("application/json"):
+            user_ids = json.loads(body)["user_ids"]
+        else:
+            user_ids = body.splitlines()
+        return [str(user_id).strip() for user_id in user_ids if str(user_id).strip()]
+
+    def do_GET(self):
+        if not self.__authorized():
+            return
+        url = urlparse(self.path)
+        if url.path == "/status":
+            return self.__send_json(200, self.payment_daemon.status())
+        if url.path == "/metrics":
+            return self.__send_metrics()
+
+        batch, parts = self.__batch_from_path(url.path)
+        if batch is None:
+            return self.__send_json(404, {"error": "not found"})
+        if parts[2:] == ["events"]:
+            return self.__stream(batch)
+        return self.__send_json(200, batch.to_dict())
+
+    def do_POST(self):
+        if not self.__authorized():
+            return
+        url = urlparse(self.path)
+        if url.path != "/batches":
+            return self.__send_json(404, {"error": "not found"})
+
+        try:
+            user_ids = self.__read_user_ids()
+        except (ValueError, KeyError, TypeError) as e:
+            return self.__send_json(400, {"error": f"invalid batch: {e}"})
+        if not user_ids:
+            return self.__send_json(400, {"error": "no user ids"})
+
+        batch = self.payment_daemon.submit(user_ids)
+        if parse_qs(url.query).get("stream", ["1"])[0] == "0":
+            return self.__send_json(202, batch.to_dict())
+        self.__stream(batch)
+
+    def do_DELETE(self):
+        if not self.__authorized():
+            return
+        batch, _ = self.__batch_from_path(urlparse(self.path).path)
+        if batch is None:
+            return self.__send_json(404, {"error": "not found"})
+        if not self.payment_daemon.cancel(batch.id):
+            return self.__send_json(409, {"error": f"batch is {batch.state}"})
+        self.__send_json(202, batch.to_dict())
+
+
+if hasattr(socket, "AF_UNIX"):
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def make_server(payment_daemon, host = DEFAULT_HOST, port = DEFAULT_PORT, socket_path = None, token = None):
+    if socket_path:
+        if not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("Unix sockets are not supported on this platform, use --port")
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, DaemonRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+    server.payment_daemon = payment_daemon
+    server.token = token
+    return server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout = None):
+        super().__init__("localhost", timeout=timeout)
+        self.__socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.__socket_path)
+
+
+def print_event(event):
+    if event.get("summary") is not None:
+        summary = event["summary"]
+        print(f"[{event['stage'].upper()}] {summary['paid']} paid, {summary['failed']} failed "
+              f"in {summary['elapsed']:.1f}s")
+        if summary["failed_user_ids"]:
+            print(f"[{event['stage'].upper()}] Failed: {', '.join(summary['failed_user_ids'])}")
+    elif event.get("message"):
+        print(f"[{event['stage'].upper()}] {event['message']}")
+    else:
+        print(f"[{event['stage'].upper()}]")
+
+
+def engine_config(args):
+    config = EngineConfig.from_env()
+    if args.profile:
+        config.profile_dir = args.profile
+    return config
+
+
+def run(args):
+    engine = PaymentEngine(engine_config(args), listener=print_event)
+    try:
+        summary = engine.run(get_user_ids(args.user_ids))
+    except KeyboardInterrupt:
+        return 130
+    print_event({"stage": "done", "summary": summary})
+    return 1 if summary["failed_user_ids"] else 0
+
+
+def serve(args):
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format="%(asctime)s %(message)s")
+    logger = logging.getLogger("qris") if args.verbose else None
+
+    if not args.socket and not args.token and not is_loopback(args.host):
+        print(f"[ERROR] Refusing to serve on {args.host} without a token, set --token or HEADLESS_TOKEN")
+        return 2
+
+    payment_daemon = PaymentDaemon(engine_config(args), logger=logger)
+    server = make_server(payment_daemon, args.host, args.port, args.socket, args.token)
+    payment_daemon.start(warm_up=not args.no_warm_up)
+
+    print(f"[INFO] Listening on {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        payment_daemon.stop()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    return 0
+
+
+def submit(args):
+    with open(args.user_ids, "rb") as f:
+        body = f.read()
+
+    if args.socket:
+        connection = UnixHTTPConnection(args.socket)
+    else:
+        url = urlparse(args.url)
+        connection = http.client.HTTPConnection(url.hostname, url.port or 80)
+
+    headers = {"Content-Type": "text/plain"}
+    if args.token:
+        headers["Authorization"] = f"Bearer {args.token}"
+    connection.request("POST", "/batches", body, headers)
+    response = connection.getresponse()
+    if response.status != 200:
+        print(f"[ERROR] {response.status}: {response.read().decode('utf-8')}")
+        return 1
+
+    state = None
+    for line in response:
+        event = json.loads(line)
+        print_event(event)
+        state = event["stage"]
+    connection.close()
+    return 0 if state == BATCH_DONE else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pays QRIS batches without the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="pay one batch and exit")
+    run_parser.add_argument("user_ids", help="file with one user id per line")
+    run_parser.add_argument("--profile", nargs="?", const=DEFAULT_PROFILE_DIR, default=None, metavar="DIR",
+                            help=f"write a flame graph and hotspots of the run to DIR ({DEFAULT_PROFILE_DIR})")
+
+    serve_parser = commands.add_parser("serve", help="keep sessions warm and take batches over HTTP")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--socket", default=None, help="listen on this Unix socket instead of TCP")
+    serve_parser.add_argument("--no-warm-up", action="store_true", help="create the sessions with the first batch")
+    serve_parser.add_argument("--profile", nargs="?", const=DEFAULT_PROFILE_DIR, default=None, metavar="DIR",
+                              help=f"write a flame graph and hotspots of every batch to DIR ({DEFAULT_PROFILE_DIR})")
+    serve_parser.add_argument("--token", default=None, help="require this bearer token (HEADLESS_TOKEN)")
+    serve_parser.add_argument("--verbose", action="store_true")
+
+    submit_parser = commands.add_parser("submit", help="send a batch to a running daemon and follow it")
+    submit_parser.add_argument("user_ids", help="file with one user id per line")
+    submit_parser.add_argument("--url", default=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+    submit_parser.add_argument("--socket", default=None)
+    submit_parser.add_argument("--token", default=None, help="bearer token of the daemon (HEADLESS_TOKEN)")
+
+    args = parser.parse_args()
+    load_dotenv()
+    if args.command != "run":
+        args.token = args.token or os.getenv("HEADLESS_TOKEN") or None
+    return {"run": run, "serve": serve, "submit": submit}[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
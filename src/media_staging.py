@@ -0,0 +1,166 @@
+import os
+import shlex
+from collections import deque
+from time import perf_counter, sleep, time
+
+from .adb_helpers import PICTURES_DIR, push_bytes_to_android, run_shell, trigger_scan_file
+from .metrics import metrics
+
+IMAGES_URI = "content://media/external/images/media"
+STAGING_DIR = f"{PICTURES_DIR}/QRIS"
+DEFAULT_KEEP = 3
+
+
+def _sql_quote(value):
+    """value as an SQL string literal, for MediaStore --where clauses."""
+    return "'" + value.replace("'", "''") + "'"
+
+
+class MediaStager:
+    """
+    Stages QR images on the device by pushing them into a dedicated Pictures
+    folder and inserting their rows into MediaStore directly, then confirms
+    they are indexed by querying MediaStore instead of sleeping. Paid images are
+    released (row and file deleted), and at most keep images are left staged,
+    so the gallery the bank app opens stays small.
+    """
+
+    def __init__(self, serial = None, folder = STAGING_DIR, keep = DEFAULT_KEEP, index_timeout = 5, logger = None):
+        self.__serial = serial
+        self.__folder = folder
+        self.__keep = keep
+        self.__index_timeout = index_timeout
+        self.__staged = deque()
+        self.__latencies = []
+        self.__folder_ready = False
+        self.__logger = logger
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[MediaStager] {msg}")
+
+    def __shell(self, command):
+        return run_shell(command, self.__serial) or ""
+
+    def __indexed(self, remote_paths):
+        where = "_data IN (" + ",".join(_sql_quote(p) for p in remote_paths) + ")"
+        output = self.__shell(f"content query --uri {IMAGES_URI} --projection _data --where {shlex.quote(where)}")
+        found = set()
+        for line in output.splitlines():
+            if "_data=" in line:
+                found.add(line.rsplit("_data=", 1)[1].strip())
+        return found
+
+    def __insert_all(self, remote_paths):
+        now = int(time())
+        # A --bind value is taken as it is, not as SQL, so it is only shell quoted
+        commands = [
+            f"content insert --uri {IMAGES_URI}"
+            f" --bind {shlex.quote('_data:s:' + p)}"
+            f" --bind {shlex.quote('_display_name:s:' + os.path.basename(p))}"
+            f" --bind mime_type:s:image/png"
+            f" --bind date_added:l:{now} --bind date_modified:l:{now}"
+            for p in remote_paths
+        ]
+        self.__shell("; ".join(commands))
+
+    def stage(self, items: list):
+        """
+        Stages many (name, png bytes) pairs with one insert and one confirmation
+        loop. Returns (remote path, size in bytes, seconds until indexed) per
+        item, with None seconds for an image that never showed up in MediaStore.
+        """
+        if not self.__folder_ready:
+            self.__shell(f"mkdir -p {shlex.quote(self.__folder)}")
+            self.__folder_ready = True
+
+        started = {}
+        sizes = {}
+        for name, data in items:
+            remote_path = f"{self.__folder}/{name}"
+            started[remote_path] = perf_counter()
+            with metrics.span("adb.push", device=self.__serial):
+                pushed = push_bytes_to_android(data, remote_path, self.__serial)
+            if pushed:
+                sizes[remote_path] = len(data)
+
+        pending = set(sizes)
+        latencies = {}
+        index_start = perf_counter()
+        if pending:
+            self.__insert_all(sorted(pending))
+
+        deadline = perf_counter() + self.__index_timeout
+        scanned = False
+        while pending and perf_counter() < deadline:
+            for remote_path in self.__indexed(sorted(pending)):
+                latencies[remote_path] = perf_counter() - started[remote_path]
+                pending.discard(remote_path)
+
+            if pending and not scanned:
+                # The insert was refused (e.g. _data is read-only on this Android
+                # version), let the media scanner pick the files up instead
+                self.__log(f"[WARN] {len(pending)} image(s) not indexed by insert, asking the media scanner")
+                for remote_path in pending:
+                    trigger_scan_file(remote_path, self.__serial)
+                scanned = True
+            elif pending:
+                sleep(0.1)
+
+        metrics.observe("media.index", perf_counter() - index_start, device=self.__serial)
+
+        results = []
+        for remote_path in started:
+            latency = latencies.get(remote_path)
+            if latency is None:
+                self.__log(f"[WARN] {remote_path} was not indexed")
+            else:
+                self.__latencies.append(latency)
+                self.__staged.append(remote_path)
+            results.append((remote_path, sizes.get(remote_path, 0), latency))
+
+        while len(self.__staged) > self.__keep:
+            self.release(self.__staged[0])
+
+        return results
+
+    def stage_files(self, filenames: list):
+        items = []
+        for filename in filenames:
+            with open(filename, "rb") as f:
+                items.append((os.path.basename(filename), f.read()))
+        return self.stage(items)
+
+    def stage_file(self, filename):
+        return self.stage_files([filename])[0]
+
+    def release(self, remote_path):
+        """Removes a staged image from MediaStore and from the device."""
+        try:
+            self.__staged.remove(remote_path)
+        except ValueError:
+            pass
+        with metrics.span("media.release", device=self.__serial):
+            where = f"_data={_sql_quote(remote_path)}"
+            self.__shell(
+                f"content delete --uri {IMAGES_URI} --where {shlex.quote(where)}; rm -f {shlex.quote(remote_path)}"
+            )
+
+    def purge(self):
+        """Removes every image left in the staging folder, e.g. by an earlier run."""
+        where = f"_data LIKE {_sql_quote(self.__folder + '/%')}"
+        self.__shell(
+            f"content delete --uri {IMAGES_URI} --where {shlex.quote(where)};"
+            f" rm -f {shlex.quote(self.__folder)}/*"
+        )
+        self.__staged.clear()
+
+    def stats(self):
+        """Count, mean and max seconds from push start until an image was indexed."""
+        if not self.__latencies:
+            return {"count": 0, "mean": 0.0, "max": 0.0}
+        return {
+            "count": len(self.__latencies),
+            "mean": sum(self.__latencies) / len(self.__latencies),
+            "max": max(self.__latencies),
+        }
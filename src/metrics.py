@@ -0,0 +1,243 @@
+import json
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, time
+
+# Upper bounds in seconds, from a quick adb call up to a slow payment
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Estimated from the buckets, like Prometheus' histogram_quantile()."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.buckets, self.counts):
+            if seen + count >= rank and count:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return self.buckets[-1]
+
+
+def _labels_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class MetricsRegistry:
+    """
+    Latency histograms of the automation stages (one per stage and label set),
+    event counters and gauges. Exported as Prometheus text, and optionally
+    appended to a JSON lines file as every span ends or a gauge is set.
+    """
+
+    def __init__(self, prefix = "qris", buckets = DEFAULT_BUCKETS):
+        self.__prefix = prefix
+        self.__buckets = buckets
+        self.__histograms = {}
+        self.__counters = {}
+        self.__gauges = {}
+        self.__lock = threading.Lock()
+        self.__jsonl = None
+        self.__server = None
+
+    def open_jsonl(self, path):
+        """Appends every span, counter increment and gauge value to path from now on."""
+        with self.__lock:
+            if self.__jsonl is None:
+                self.__jsonl = open(path, "a", encoding="utf-8")
+
+    def close(self):
+        with self.__lock:
+            if self.__jsonl is not None:
+                self.__jsonl.close()
+                self.__jsonl = None
+        if self.__server is not None:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+
+    def __write(self, record):
+        # Called with the lock held
+        if self.__jsonl is not None:
+            self.__jsonl.write(json.dumps(record) + "\n")
+            self.__jsonl.flush()
+
+    def observe(self, stage, seconds, **labels):
+        key = (stage, _labels_key(labels))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = Histogram(self.__buckets)
+            histogram.observe(seconds)
+            self.__write({"ts": time(), "span": stage, "seconds": seconds, **dict(key[1])})
+
+    def count(self, name, value = 1, **labels):
+        key = (name, _labels_key(labels))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+            self.__write({"ts": time(), "counter": name, "value": value, **dict(key[1])})
+
+    def gauge(self, name, value, **labels):
+        """Sets the current value of name, e.g. a queue depth; the JSON lines file keeps every value."""
+        key = (name, _labels_key(labels))
+        with self.__lock:
+            self.__gauges[key] = value
+            self.__write({"ts": time(), "gauge": name, "value": value, **dict(key[1])})
+
+    @contextmanager
+    def span(self, stage, **labels):
+        """Times the block as stage; a block that raises is also counted in stage_errors."""
+        start = perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.count("stage_errors", stage=stage, **labels)
+            raise
+        finally:
+            self.observe(stage, perf_counter() - start, **labels)
+
+    def snapshot(self, by_stage = False):
+        """
+        Per stage and label set: count, mean, p50 and p95; plus the counters
+        and the gauges' current values.
+        by_stage merges the label sets of a stage, e.g. all devices into one row.
+        """
+        with self.__lock:
+            histograms = list(self.__histograms.items())
+            counters = list(self.__counters.items())
+            gauges = list(self.__gauges.items())
+
+        if by_stage:
+            merged = {}
+            for (stage, _), h in histograms:
+                if stage not in merged:
+                    merged[stage] = Histogram(h.buckets)
+                merged[stage].merge(h)
+            histograms = [((stage, ()), h) for stage, h in merged.items()]
+
+        return {
+            "spans": [
+                {
+                    "stage": stage,
+                    **dict(labels),
+                    "count": h.count,
+                    "mean": h.sum / h.count if h.count else 0.0,
+                    "p50": h.quantile(0.5),
+                    "p95": h.quantile(0.95),
+                }
+                for (stage, labels), h in sorted(histograms)
+            ],
+            "counters": [{"name": name, **dict(labels), "value": value} for (name, labels), value in sorted(counters)],
+            "gauges": [{"name": name, **dict(labels), "value": value} for (name, labels), value in sorted(gauges)],
+        }
+
+    def reset(self):
+        with self.__lock:
+            self.__histograms.clear()
+            self.__counters.clear()
+            self.__gauges.clear()
+
+    def render_prometheus(self):
+        with self.__lock:
+            histograms = sorted(self.__histograms.items())
+            counters = sorted(self.__counters.items())
+            gauges = sorted(self.__gauges.items())
+
+        seconds = f"{self.__prefix}_stage_seconds"
+        lines = [
+            f"# HELP {seconds} Duration of each automation stage.",
+            f"# TYPE {seconds} histogram",
+        ]
+        for (stage, labels), h in histograms:
+            pairs = (("stage", stage),) + labels
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append(f"{seconds}_bucket{_format_labels(pairs + (('le', repr(float(bound))),))} {cumulative}")
+            lines.append(f"{seconds}_bucket{_format_labels(pairs + (('le', '+Inf'),))} {h.count}")
+            lines.append(f"{seconds}_sum{_format_labels(pairs)} {h.sum}")
+            lines.append(f"{seconds}_count{_format_labels(pairs)} {h.count}")
+
+        typed = set()
+        for (name, labels), value in counters:
+            metric = f"{self.__prefix}_{name}_total"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} counter")
+                typed.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            metric = f"{self.__prefix}_{name}"
+            if metric not in typed:
+                lines.append(f"# TYPE {metric} gauge")
+                typed.add(metric)
+            lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host = "127.0.0.1"):
+        """Serves GET /metrics on a background thread. Only the first call starts a server."""
+        if self.__server is not None:
+            return self.__server.server_address[1]
+
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.__server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.__server.serve_forever, daemon=True).start()
+        return self.__server.server_address[1]
+
+
+# Shared by every automator of the process, like adb_client
+metrics = MetricsRegistry()
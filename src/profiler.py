@@ -0,0 +1,192 @@
+import os
+import sys
+import threading
+import zlib
+from collections import Counter
+from html import escape
+from time import perf_counter
+
+DEFAULT_PROFILE_DIR = "profiles"
+DEFAULT_INTERVAL = 0.005
+DEFAULT_TOP = 25
+
+# Where the innermost Python frame of a sample is decides what the time went to.
+# A C call (time.sleep, a socket read) has no frame, so it counts for the caller.
+CATEGORIES = [
+    ("network", ("/socket.py", "/ssl.py", "/http/client.py", "/urllib3/")),
+    ("json", ("/json/",)),
+    ("waiting", ("/threading.py", "/queue.py", "/selectors.py", "/concurrent/futures/", "/asyncio/")),
+    ("webdriver", ("/selenium/", "/appium/")),
+    ("ours", ("/src/",)),
+]
+
+FLAME_WIDTH = 1200
+FLAME_ROW = 16
+FLAME_FONT = 11
+
+
+def _frame_name(code):
+    # ";" separates frames in the folded format
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _category(filename):
+    path = filename.replace(os.sep, "/")
+    for name, markers in CATEGORIES:
+        if any(marker in path for marker in markers):
+            return name
+    return "other"
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler: a background thread records the stack of
+    every other thread of the process every interval seconds. Nothing is hooked
+    into the profiled code, so a run without a started profiler costs nothing
+    and a profiled one one stack walk per thread and sample.
+
+    write() saves the samples as folded stacks (flamegraph.pl, speedscope), an
+    SVG flame graph and a text summary of the hotspots.
+    """
+
+    def __init__(self, interval = DEFAULT_INTERVAL, logger = None):
+        self.__interval = interval
+        self.__stacks = Counter()
+        self.__categories = Counter()
+        self.__samples = 0
+        self.__elapsed = 0.0
+        self.__started_at = None
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.__logger = logger
+
+    def __log(self, msg):
+        if self.__logger is None: return
+        self.__logger.debug(f"[SamplingProfiler] {msg}")
+
+    def start(self):
+        if self.__thread is None:
+            self.__stop.clear()
+            self.__started_at = perf_counter()
+            self.__thread = threading.Thread(target=self.__run, name="sampling-profiler", daemon=True)
+            self.__thread.start()
+            self.__log(f"[INFO] Sampling every {self.__interval * 1000:.0f}ms.")
+        return self
+
+    def stop(self):
+        if self.__thread is not None:
+            self.__stop.set()
+            self.__thread.join()
+            self.__thread = None
+            self.__elapsed += perf_counter() - self.__started_at
+        return self
+
+    def __run(self):
+        own = threading.get_ident()
+        while not self.__stop.wait(self.__interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                self.__categories[_category(frame.f_code.co_filename)] += 1
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                stack.reverse()
+                self.__stacks[tuple(stack)] += 1
+            self.__samples += 1
+
+    def folded(self):
+        """One `thread;outer;...;inner count` line per distinct stack."""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.__stacks.most_common())
+
+    def hotspots(self, top = DEFAULT_TOP):
+        """(self, total) lists of (frame, samples): innermost frame only, and anywhere on the stack."""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.__stacks.items():
+            frames = stack[1:]
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return own.most_common(top), total.most_common(top)
+
+    def summary(self, top = DEFAULT_TOP):
+        thread_samples = sum(self.__stacks.values()) or 1
+        lines = [
+            f"{self.__elapsed:.1f}s, {self.__samples} samples every {self.__interval * 1000:.0f}ms, "
+            f"{len({stack[0] for stack in self.__stacks})} threads",
+            "",
+            "Time by innermost frame:",
+        ]
+        for name, count in self.__categories.most_common():
+            lines.append(f"  {count / thread_samples:>6.1%}  {name}")
+
+        own, total = self.hotspots(top)
+        for title, rows in (("Top frames (self):", own), ("Top frames (total):", total)):
+            lines += ["", title]
+            lines += [f"  {count / thread_samples:>6.1%}  {count:>7}  {frame}" for frame, count in rows]
+        return "\n".join(lines) + "\n"
+
+    def flame_graph(self, title = "Profile"):
+        """The samples as a static SVG flame graph, callers at the bottom."""
+        root = {"children": {}, "count": 0}
+        for stack, count in self.__stacks.items():
+            root["count"] += count
+            node = root
+            for frame in stack:
+                node = node["children"].setdefault(frame, {"children": {}, "count": 0})
+                node["count"] += count
+
+        def depth_of(node):
+            return 1 + max((depth_of(child) for child in node["children"].values()), default=0)
+
+        depth = depth_of(root) - 1
+        height = (depth + 2) * FLAME_ROW
+        scale = FLAME_WIDTH / (root["count"] or 1)
+        rects = []
+
+        def layout(node, x, level):
+            for name, child in sorted(node["children"].items()):
+                width = child["count"] * scale
+                if width >= 0.5:
+                    y = height - (level + 1) * FLAME_ROW
+                    # Warm colours, varied per frame so neighbours stand apart
+                    hue = zlib.crc32(name.encode("utf-8")) % 40
+                    label = name if width > FLAME_FONT * 2 else ""
+                    label = label[:int(width / (FLAME_FONT * 0.6))]
+                    rects.append(
+                        f'<g><title>{escape(name)} ({child["count"]} samples, '
+                        f'{child["count"] / (root["count"] or 1):.1%})</title>'
+                        f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{FLAME_ROW - 1}" '
+                        f'fill="hsl({hue},80%,60%)"/>'
+                        f'<text x="{x + 3:.1f}" y="{y + FLAME_ROW - 4}">{escape(label)}</text></g>'
+                    )
+                    layout(child, x, level + 1)
+                x += width
+
+        layout(root, 0.0, 0)
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{FLAME_WIDTH}" height="{height}" '
+            f'font-family="monospace" font-size="{FLAME_FONT}">'
+            f'<text x="4" y="{FLAME_ROW - 4}">{escape(title)}</text>'
+            + "".join(rects) + "</svg>\n"
+        )
+
+    def write(self, directory, name, top = DEFAULT_TOP):
+        """Writes <name>.folded, <name>.svg and <name>.txt to directory. Returns their paths."""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, name)
+        outputs = [
+            (base + ".folded", self.folded()),
+            (base + ".svg", self.flame_graph(name)),
+            (base + ".txt", self.summary(top)),
+        ]
+        for path, content in outputs:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+        self.__log(f"[INFO] {self.__samples} samples written to {base}.*")
+        return [path for path, _ in outputs]
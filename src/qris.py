@@ -0,0 +1,121 @@
+import base64
+import re
+from urllib.parse import urljoin
+
+try:
+    import qrcode
+except ImportError:
+    qrcode = None
+
+# EMVCo merchant-presented payloads always start with the payload format
+# indicator (tag 00, "01") and end with the CRC field (tag 63, length 04).
+_PAYLOAD_START = "000201"
+_CRC_TAG = "6304"
+_MAX_PAYLOAD_LEN = 512
+
+_IMG_SRC_RE = re.compile(r"<img\b[^>]*?\bsrc\s*=\s*[\"']([^\"']+)[\"']", re.IGNORECASE)
+_DATA_URL_RE = re.compile(r"^data:image/[\w.+-]+;base64,(.+)$", re.DOTALL)
+
+
+def crc16_ccitt(data: str):
+    crc = 0xFFFF
+    for byte in data.encode("utf-8"):
+        crc ^= byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+    return crc
+
+
+def is_valid_qris_payload(payload: str):
+    if not payload.startswith(_PAYLOAD_START) or len(payload) < len(_PAYLOAD_START) + 8:
+        return False
+    if payload[-8:-4] != _CRC_TAG:
+        return False
+    try:
+        expected = int(payload[-4:], 16)
+    except ValueError:
+        return False
+    return crc16_ccitt(payload[:-4]) == expected
+
+
+def find_qris_payload(text: str):
+    """Return the first CRC-valid EMVCo QRIS payload embedded in text, or None."""
+    if not text:
+        return None
+
+    start = text.find(_PAYLOAD_START)
+    while start != -1:
+        end = text.find(_CRC_TAG, start)
+        while end != -1 and end - start <= _MAX_PAYLOAD_LEN:
+            candidate = text[start:end + len(_CRC_TAG) + 4]
+            if is_valid_qris_payload(candidate):
+                return candidate
+            end = text.find(_CRC_TAG, end + 1)
+        start = text.find(_PAYLOAD_START, start + 1)
+
+    return None
+
+
+def find_qr_image_src(html: str):
+    """Return the src of the first <img> in html, preferring inline data URLs."""
+    if not html:
+        return None
+
+    sources = _IMG_SRC_RE.findall(html)
+    for src in sources:
+        if src.startswith("data:image/"):
+            return src
+    return sources[0] if sources else None
+
+
+def decode_data_url(data_url: str):
+    match = _DATA_URL_RE.match(data_url or "")
+    if match is None:
+        return None
+    return base64.b64decode(match.group(1))
+
+
+def render_qris_png(payload: str, filename: str, box_size = 8, border = 4):
+    """Render payload as a 1-bit QR PNG. Returns False if qrcode is not installed."""
+    if qrcode is None:
+        return False
+
+    qr = qrcode.QRCode(
+        error_correction=qrcode.constants.ERROR_CORRECT_M,
+        box_size=box_size,
+        border=border,
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    qr.make_image(fill_color="black", back_color="white").save(filename)
+    return True
+
+
+def save_QRIS_from_html(html: str, page_url: str, filename: str, fetch_bytes):
+    """
+    Writes the QRIS found in a payment page to filename, rendering it from the
+    EMVCo payload when present, else saving the page's QR image. fetch_bytes(url)
+    is used to download a non-inline image. Returns False if neither is found.
+    """
+    payload = find_qris_payload(html)
+    if payload is not None and render_qris_png(payload, filename):
+        return True
+
+    img_src = find_qr_image_src(html)
+    if img_src is None:
+        return False
+
+    if img_src.startswith("data:"):
+        data = decode_data_url(img_src)
+    else:
+        data = fetch_bytes(urljoin(page_url, img_src))
+
+    if not data:
+        return False
+
+    with open(filename, "wb") as f:
+        f.write(data)
+    return True
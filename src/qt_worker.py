@@ -0,0 +1,37 @@
+from PyQt5.QtCore import pyqtSignal, QThread
+
+from .engine import PaymentEngine
+
+
+class EngineWorker(QThread):
+    """Runs a PaymentEngine off the GUI thread and relays its events through log_message."""
+    payment_finished = pyqtSignal()
+    log_message = pyqtSignal(str)
+
+    def __init__(self, config, user_ids, android_automators = None, logger = None):
+        super().__init__()
+        self.user_ids = user_ids
+        self.summary = None
+        self.__stopped = False
+        self.engine = PaymentEngine(
+            config, listener=self.__on_event, android_automators=android_automators, logger=logger
+        )
+
+    def __on_event(self, event):
+        self.log_message.emit(f"[{event['stage']}] {event['message']}")
+
+    def stop(self):
+        """Cancels the run right away; payment_finished follows once the drivers are released."""
+        # The engine ignores a cancel before its run starts, so a stop that early skips the run
+        self.__stopped = True
+        self.engine.cancel()
+
+    def run(self):
+        try:
+            if not self.__stopped:
+                self.summary = self.engine.run(self.user_ids)
+        except Exception as e:
+            self.log_message.emit(f"Error: {str(e)}")
+        finally:
+            self.log_message.emit("Payment automation stopped.")
+            self.payment_finished.emit()
@@ -0,0 +1,145 @@
+import random
+import socket
+from time import monotonic
+
+import urllib3
+from selenium.common.exceptions import (
+    InvalidSessionIdException, NoSuchElementException, NoSuchWindowException, StaleElementReferenceException,
+    TimeoutException, WebDriverException
+)
+
+from .adb_client import AdbError
+
+FAILURE_TIMEOUT = "timeout"
+FAILURE_STALE = "stale_element"
+FAILURE_SESSION = "session_dead"
+FAILURE_DEVICE = "device_offline"
+FAILURE_OTHER = "other"
+
+# Cheapest first: look the element up again, go back to a known page or screen
+# (the topup form resubmitted from the failed id / the bank app's main screen),
+# then a new session.
+ACTION_RELOCATE = "relocate"
+ACTION_RENAVIGATE = "renavigate"
+ACTION_RESTART = "restart"
+
+# A QRIS download that never showed up is given up after the ladder, since a
+# new browser would not make the portal generate it. A stale page renavigates
+# right away: it is unknown which QRIS the pagination stopped at.
+BROWSER_LADDERS = {
+    FAILURE_TIMEOUT: (ACTION_RELOCATE, ACTION_RENAVIGATE),
+    FAILURE_STALE: (ACTION_RENAVIGATE, ACTION_RESTART),
+    FAILURE_SESSION: (ACTION_RESTART,),
+    FAILURE_OTHER: (ACTION_RENAVIGATE, ACTION_RESTART),
+}
+
+DEVICE_LADDERS = {
+    FAILURE_TIMEOUT: (ACTION_RENAVIGATE, ACTION_RESTART),
+    FAILURE_STALE: (ACTION_RENAVIGATE, ACTION_RESTART),
+    FAILURE_SESSION: (ACTION_RESTART,),
+    FAILURE_DEVICE: (ACTION_RESTART,),
+    FAILURE_OTHER: (ACTION_RENAVIGATE, ACTION_RESTART),
+}
+
+SESSION_MESSAGES = ("invalid session id", "session deleted", "no such session", "not reachable", "disconnected",
+                    "target window already closed", "session not created")
+DEVICE_MESSAGES = ("device offline", "not found", "no devices", "device unauthorized", "closed", "not reachable")
+
+
+def classify_failure(error):
+    """What kind of failure error is, which decides how it is recovered from."""
+    message = str(error).lower()
+    if isinstance(error, AdbError):
+        return FAILURE_DEVICE if any(m in message for m in DEVICE_MESSAGES) else FAILURE_OTHER
+    if isinstance(error, (InvalidSessionIdException, NoSuchWindowException)):
+        return FAILURE_SESSION
+    if isinstance(error, (StaleElementReferenceException, NoSuchElementException)):
+        return FAILURE_STALE
+    if isinstance(error, (TimeoutException, socket.timeout, TimeoutError, urllib3.exceptions.TimeoutError)):
+        return FAILURE_TIMEOUT
+    if isinstance(error, (ConnectionError, urllib3.exceptions.HTTPError)):
+        # The driver or the Appium server is gone
+        return FAILURE_SESSION
+    if isinstance(error, WebDriverException):
+        if any(m in message for m in SESSION_MESSAGES):
+            return FAILURE_SESSION
+        if "offline" in message or ("device" in message and "not found" in message):
+            return FAILURE_DEVICE
+        return FAILURE_OTHER
+    if "not found on the" in message:
+        # AndroidAutomator could not find a node on the expected screen
+        return FAILURE_STALE
+    return FAILURE_OTHER
+
+
+class RecoveryPolicy:
+    """
+    Maps the kind of a failure and how many recoveries were already tried for
+    the same step to the next recovery action, and the backoff before it.
+    """
+
+    def __init__(self, ladders, max_attempts = 3, backoff = 0.5, max_backoff = 10):
+        self.__ladders = ladders
+        self.__max_attempts = max_attempts
+        self.__backoff = backoff
+        self.__max_backoff = max_backoff
+
+    def next_action(self, failure, attempt):
+        """The action for the attempt-th recovery (from 0), or None to give the step up."""
+        ladder = self.__ladders.get(failure) or self.__ladders[FAILURE_OTHER]
+        if attempt >= self.__max_attempts or attempt >= len(ladder):
+            return None
+        return ladder[attempt]
+
+    def delay(self, attempt):
+        """Exponential backoff with jitter, so devices or browsers failing together don't retry in step."""
+        delay = min(self.__max_backoff, self.__backoff * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+
+class CircuitBreaker:
+    """
+    Opens after threshold failures in a row, so whatever it guards stops taking
+    work for cooldown seconds. The first call after that is a trial: a success
+    closes the circuit, a failure opens it again for twice as long (up to
+    max_cooldown).
+    """
+
+    def __init__(self, threshold = 3, cooldown = 5.0, max_cooldown = 60.0):
+        self.__threshold = threshold
+        self.__base_cooldown = cooldown
+        self.__cooldown = cooldown
+        self.__max_cooldown = max_cooldown
+        self.__failures = 0
+        self.__opened_at = None
+        self.trips = 0
+
+    @property
+    def is_open(self):
+        return self.__opened_at is not None
+
+    def remaining(self):
+        """Seconds until the circuit lets a trial through, 0 when closed."""
+        if self.__opened_at is None:
+            return 0.0
+        return max(0.0, self.__opened_at + self.__cooldown - monotonic())
+
+    def record_success(self):
+        self.__failures = 0
+        self.__opened_at = None
+        self.__cooldown = self.__base_cooldown
+
+    def record_failure(self):
+        """Returns True when this failure opened the circuit."""
+        self.__failures += 1
+        if self.__opened_at is not None:
+            # The trial failed
+            self.__cooldown = min(self.__max_cooldown, self.__cooldown * 2)
+            self.__opened_at = monotonic()
+            self.trips += 1
+            return True
+        if self.__failures >= self.__threshold:
+            self.__opened_at = monotonic()
+            self.trips += 1
+            return True
+        return False
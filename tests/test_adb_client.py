@@ -0,0 +1,93 @@
+import socket
+import threading
+
+import pytest
+
+from benchmarks.fake_adb import FakeAdbServer
+from benchmarks.fake_device import FakeDevice
+from src.adb_client import AdbClient, AdbError, AdbResultLost
+
+
+@pytest.fixture
+def device():
+    return FakeDevice("fake-1")
+
+
+@pytest.fixture
+def client(device):
+    server = FakeAdbServer([device]).start()
+    client = AdbClient(port=server.port, timeout=2)
+    yield client
+    client.close()
+    server.stop()
+
+
+def test_devices(client):
+    assert client.devices() == [("fake-1", "device")]
+
+
+def test_shell_returns_exit_code_and_output(client, device):
+    assert client.shell("settings put global animator_duration_scale 0; settings get global animator_duration_scale",
+                        "fake-1") == (0, b"0\n")
+    assert device.settings["animator_duration_scale"] == "0"
+    assert client.shell("nope", "fake-1") == (127, b"/system/bin/sh: nope: not found\n")
+
+
+def test_shell_is_reused_across_commands(client):
+    for i in range(20):
+        assert client.shell(f"echo {i}", "fake-1") == (0, f"{i}\n".encode())
+
+
+def test_unknown_device_fails(client):
+    with pytest.raises(AdbError):
+        client.shell("echo hi", "missing")
+
+
+def test_push_bytes_over_sync(client, device):
+    data = bytes(range(256)) * 600
+    client.push_bytes(data, "/sdcard/Pictures/QRIS/a.png", "fake-1")
+    assert device.files["/sdcard/Pictures/QRIS/a.png"] == data
+
+
+def test_forward_and_remove_forward(client, device):
+    device.driver_port = 47231
+    port = client.forward("tcp:0", "tcp:6790", "fake-1")
+    assert port == 47231
+    client.remove_forward(f"tcp:{port}", "fake-1")
+    with pytest.raises(AdbError):
+        client.remove_forward(f"tcp:{port}", "fake-1")
+
+
+def drops_after_the_command(commands):
+    """An adb server that takes every command and closes the connection before answering it."""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+
+    def read_request(conn):
+        length = int(conn.recv(4), 16)
+        return conn.recv(length).decode()
+
+    def serve():
+        while True:
+            conn, _ = server.accept()
+            with conn:
+                read_request(conn)
+                conn.sendall(b"OKAY")
+                commands.append(read_request(conn))
+                conn.sendall(b"OKAY")
+                if commands[-1] == "exec:sh":
+                    commands.append(conn.recv(4096).decode())
+
+    threading.Thread(target=serve, daemon=True).start()
+    return server
+
+
+def test_lost_result_is_not_run_again():
+    commands = []
+    server = drops_after_the_command(commands)
+    client = AdbClient(port=server.getsockname()[1], timeout=2)
+    with pytest.raises(AdbResultLost):
+        client.shell("am start -n com.bnc.finance/.PayActivity", "fake-1")
+    assert sum("am start" in command for command in commands) == 1
+    server.close()
@@ -0,0 +1,173 @@
+import threading
+import time
+
+import pytest
+from selenium.common.exceptions import TimeoutException
+
+from src import engine
+from src.android.receipts import PaymentReceipt, STATUS_SUCCESS
+from src.engine import EngineConfig, PaymentEngine
+
+
+class FakeBrowser:
+    """Hands out one QRIS file per user id, in chunks of three like the portal."""
+    downloads = 0
+
+    def __init__(self, *args, **kwargs):
+        self.user_ids = []
+        self.range = (0, 0)
+
+    def set_credentials(self, username, password):
+        pass
+
+    def setup(self):
+        pass
+
+    def set_user_ids(self, user_ids):
+        self.user_ids = user_ids
+
+    def generate_QRIS(self, start = 0):
+        self.range = (start, min(len(self.user_ids), start + 3))
+
+    def generated_range(self):
+        return self.range
+
+    def harvest_payment_urls(self):
+        return None
+
+    def download_QRIS(self, index, next_page = True, refresh = False):
+        FakeBrowser.downloads += 1
+        return f"/tmp/{self.user_ids[index]}.png"
+
+    def quit(self):
+        pass
+
+
+class FakeAndroid:
+    """Pays through FakeAndroid.pay(automator, user_id), which sets submitted once the PIN would be typed."""
+    pay = None
+
+    def __init__(self, *args, **kwargs):
+        self.submitted = False
+
+    def set_credentials(self, pin):
+        pass
+
+    def pay_qris_transaction(self, image_path, user_id):
+        self.submitted = False
+        return FakeAndroid.pay(self, user_id)
+
+    def payment_submitted(self):
+        return self.submitted
+
+    def return_to_main(self):
+        return True
+
+    def timings(self):
+        return {"session": 0.0, "steps": {}, "activities": {}}
+
+    def is_alive(self):
+        return True
+
+    def quit(self):
+        pass
+
+
+class FakeStager:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def purge(self):
+        pass
+
+    def stage_file(self, filename):
+        return filename, 100, 0.001
+
+    def release(self, remote_path):
+        pass
+
+
+@pytest.fixture
+def attempts(monkeypatch, tmp_path):
+    """user id -> number of times a device tried to pay it."""
+    # Receipts go to the working directory
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(engine, "BrowserAutomator", FakeBrowser)
+    monkeypatch.setattr(engine, "AndroidAutomator", FakeAndroid)
+    monkeypatch.setattr(engine, "MediaStager", FakeStager)
+    monkeypatch.setattr(engine, "get_my_default_chrome_options", lambda: None)
+    monkeypatch.setattr(engine, "get_my_default_ui_automator2_options", lambda *args: None)
+    FakeBrowser.downloads = 0
+    return {}
+
+
+def run(attempts, pay, user_ids, devices = ("d1", "d2"), **config):
+    lock = threading.Lock()
+
+    def counted_pay(automator, user_id):
+        with lock:
+            attempts[user_id] = attempts.get(user_id, 0) + 1
+        return pay(automator, user_id)
+
+    FakeAndroid.pay = counted_pay
+    config = EngineConfig("http://portal", "user", "password", None, "123456", devices=list(devices),
+                          retry_backoff=0, circuit_threshold=100, **config)
+    return PaymentEngine(config).run(user_ids)
+
+
+def success(automator, user_id):
+    return PaymentReceipt(user_id, STATUS_SUCCESS, "Rp1", reference="1")
+
+
+def test_failure_before_the_pin_is_handed_back_and_paid(attempts):
+    failed_once = set()
+
+    def pay(automator, user_id):
+        if user_id == "u2" and user_id not in failed_once:
+            failed_once.add(user_id)
+            raise TimeoutException("pay screen not shown")
+        return success(automator, user_id)
+
+    summary = run(attempts, pay, ["u1", "u2", "u3"])
+    assert summary["paid"] == 3
+    assert summary["failed_user_ids"] == []
+    assert attempts["u2"] == 2
+
+
+def test_failure_after_the_pin_is_never_paid_again(attempts):
+    def pay(automator, user_id):
+        if user_id == "u2":
+            automator.submitted = True
+            raise TimeoutException("result screen not shown")
+        return success(automator, user_id)
+
+    summary = run(attempts, pay, ["u1", "u2", "u3"])
+    assert summary["paid"] == 2
+    assert summary["failed_user_ids"] == ["u2"]
+    assert attempts["u2"] == 1
+
+
+def test_hand_back_stops_after_max_retry(attempts):
+    def pay(automator, user_id):
+        if user_id == "u2":
+            raise TimeoutException("pay screen not shown")
+        return success(automator, user_id)
+
+    summary = run(attempts, pay, ["u1", "u2", "u3"], max_retry=2)
+    assert summary["failed_user_ids"] == ["u2"]
+    assert attempts["u2"] == 3
+
+
+def test_browsers_stay_at_most_prefetch_depth_ahead(attempts):
+    ahead = []
+
+    def pay(automator, user_id):
+        ahead.append(FakeBrowser.downloads - len(attempts))
+        time.sleep(0.01)
+        return success(automator, user_id)
+
+    user_ids = [f"u{i}" for i in range(15)]
+    summary = run(attempts, pay, user_ids, devices=["d1"], prefetch_depth=2)
+    assert summary["paid"] == 15
+    # The queue, plus one QRIS waiting to be put and one being downloaded
+    assert max(ahead) <= 2 + 2
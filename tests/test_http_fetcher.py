@@ -0,0 +1,17 @@
+import pytest
+
+from src.browser.http_fetcher import path_matches
+
+
+@pytest.mark.parametrize("request_path, cookie_path, matches", [
+    ("/", "/", True),
+    ("/pay", "/", True),
+    ("/pay", "/pay", True),
+    ("/pay/qr/123", "/pay", True),
+    ("/pay/qr", "/pay/", True),
+    ("/payment", "/pay", False),
+    ("/pay", "/pay/", False),
+    ("/", "/pay", False),
+])
+def test_path_matches(request_path, cookie_path, matches):
+    assert path_matches(request_path, cookie_path) == matches
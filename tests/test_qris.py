@@ -0,0 +1,54 @@
+import base64
+
+from src.qris import crc16_ccitt, is_valid_qris_payload, find_qris_payload, find_qr_image_src, decode_data_url
+
+
+def make_payload(merchant = "TOKO SUKSES JAYA"):
+    body = f"00020101021226280010ID.CO.QRIS0112ID1234567890520454995303360540425005802ID59{len(merchant):02d}{merchant}6304"
+    return body + f"{crc16_ccitt(body):04X}"
+
+
+def test_crc16_ccitt_check_value():
+    # CRC-16/CCITT-FALSE, the variant EMVCo uses
+    assert crc16_ccitt("123456789") == 0x29B1
+    assert crc16_ccitt("") == 0xFFFF
+
+
+def test_valid_payload():
+    payload = make_payload()
+    assert is_valid_qris_payload(payload)
+    assert is_valid_qris_payload(payload[:-4] + payload[-4:].lower())
+
+
+def test_payload_with_a_wrong_crc_or_shape_is_rejected():
+    payload = make_payload()
+    assert not is_valid_qris_payload(payload[:-1] + ("0" if payload[-1] != "0" else "1"))
+    assert not is_valid_qris_payload(payload.replace("TOKO", "TOKI"))
+    assert not is_valid_qris_payload(payload[:-4] + "ZZZZ")
+    assert not is_valid_qris_payload("000201")
+    assert not is_valid_qris_payload("1" + payload[1:])
+
+
+def test_payload_is_found_in_a_page():
+    payload = make_payload()
+    html = f'<div data-x="000201 not a payload 6304ABCD"></div><input value="{payload}"><p>6304</p>'
+    assert find_qris_payload(html) == payload
+
+
+def test_no_payload_in_a_page():
+    assert find_qris_payload("") is None
+    assert find_qris_payload("<p>000201 ... 63041234</p>") is None
+
+
+def test_inline_image_is_preferred():
+    html = '<img src="/logo.png"><IMG alt="qr" SRC=\'data:image/png;base64,iVBORw0K\'>'
+    assert find_qr_image_src(html) == "data:image/png;base64,iVBORw0K"
+    assert find_qr_image_src('<img class="qr" src="/qr/123.png">') == "/qr/123.png"
+    assert find_qr_image_src("<p>no image</p>") is None
+
+
+def test_decode_data_url():
+    data = b"\x89PNG\r\n\x1a\n"
+    assert decode_data_url("data:image/png;base64," + base64.b64encode(data).decode()) == data
+    assert decode_data_url("/qr/123.png") is None
+    assert decode_data_url(None) is None
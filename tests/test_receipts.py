@@ -0,0 +1,29 @@
+from src.android.receipts import parse_receipt, STATUS_SUCCESS, STATUS_FAILED, STATUS_UNKNOWN
+from src.android.ui_state import UISnapshot, BANK_PKG, CONFIRM_BUTTON_ID, RESULT_ACTIVITY
+
+
+def result_snapshot(title, merchant, activity = None):
+    texts = [title, "Total", "Rp25.000", "Merchant", merchant, "No. Referensi", "123456789012",
+             "Waktu", "18 Okt 2026 10:15"]
+    nodes = [{"package": BANK_PKG, "text": text, "resource-id": ""} for text in texts]
+    nodes.append({"package": BANK_PKG, "text": "Selesai", "resource-id": CONFIRM_BUTTON_ID})
+    return UISnapshot(nodes, activity)
+
+
+def test_failed_payment_to_a_merchant_named_sukses():
+    receipt = parse_receipt(result_snapshot("Transaksi Gagal", "Toko Sukses"), "U1")
+    assert receipt.status == STATUS_FAILED
+    assert receipt.merchant == "Toko Sukses"
+
+
+def test_successful_payment_to_a_merchant_named_gagal():
+    receipt = parse_receipt(result_snapshot("Pembayaran Berhasil", "Gagal Move On Cafe"), "U1")
+    assert receipt.status == STATUS_SUCCESS
+    assert receipt.amount_value() == 25000
+    assert receipt.reference == "123456789012"
+    assert receipt.timestamp == "18 Okt 2026 10:15"
+
+
+def test_unknown_title_is_not_guessed_from_other_texts():
+    snapshot = result_snapshot("Terima kasih", "Toko Sukses", "com.bnc.finance" + RESULT_ACTIVITY)
+    assert parse_receipt(snapshot).status == STATUS_UNKNOWN
@@ -0,0 +1,103 @@
+import socket
+
+import pytest
+from selenium.common.exceptions import (
+    InvalidSessionIdException, StaleElementReferenceException, TimeoutException, WebDriverException
+)
+
+from src import recovery
+from src.adb_client import AdbError
+from src.recovery import (
+    classify_failure, CircuitBreaker, RecoveryPolicy, BROWSER_LADDERS, DEVICE_LADDERS,
+    FAILURE_TIMEOUT, FAILURE_STALE, FAILURE_SESSION, FAILURE_DEVICE, FAILURE_OTHER,
+    ACTION_RELOCATE, ACTION_RENAVIGATE, ACTION_RESTART
+)
+
+
+@pytest.mark.parametrize("error, failure", [
+    (TimeoutException("QRIS not shown"), FAILURE_TIMEOUT),
+    (socket.timeout("timed out"), FAILURE_TIMEOUT),
+    (StaleElementReferenceException("stale"), FAILURE_STALE),
+    (InvalidSessionIdException("invalid session id"), FAILURE_SESSION),
+    (ConnectionRefusedError("refused"), FAILURE_SESSION),
+    (WebDriverException("A session is either terminated or not started: session deleted"), FAILURE_SESSION),
+    (WebDriverException("Device emulator-5554 was not found"), FAILURE_DEVICE),
+    (AdbError("device offline"), FAILURE_DEVICE),
+    (AdbError("unexpected adb response b'ABCD'"), FAILURE_OTHER),
+    (RuntimeError("Confirm button not found on the pay screen"), FAILURE_STALE),
+    (RuntimeError("Bank app shows an error: Saldo tidak cukup"), FAILURE_OTHER),
+])
+def test_classify_failure(error, failure):
+    assert classify_failure(error) == failure
+
+
+def test_policy_walks_the_ladder_then_gives_up():
+    policy = RecoveryPolicy(BROWSER_LADDERS, max_attempts=3)
+    assert [policy.next_action(FAILURE_TIMEOUT, attempt) for attempt in range(3)] == [
+        ACTION_RELOCATE, ACTION_RENAVIGATE, None
+    ]
+    assert policy.next_action(FAILURE_SESSION, 0) == ACTION_RESTART
+    assert policy.next_action(FAILURE_SESSION, 1) is None
+
+
+def test_policy_caps_the_ladder_at_max_attempts():
+    policy = RecoveryPolicy(DEVICE_LADDERS, max_attempts=1)
+    assert policy.next_action(FAILURE_TIMEOUT, 0) == ACTION_RENAVIGATE
+    assert policy.next_action(FAILURE_TIMEOUT, 1) is None
+
+
+def test_unknown_failure_uses_the_other_ladder():
+    policy = RecoveryPolicy(DEVICE_LADDERS)
+    assert policy.next_action("something new", 0) == DEVICE_LADDERS[FAILURE_OTHER][0]
+
+
+def test_delay_backs_off_with_jitter_up_to_the_cap():
+    policy = RecoveryPolicy(DEVICE_LADDERS, backoff=0.5, max_backoff=3)
+    for attempt, full in [(0, 0.5), (1, 1.0), (2, 2.0), (5, 3.0)]:
+        assert full * 0.5 <= policy.delay(attempt) <= full
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(recovery, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_threshold_failures_in_a_row(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=5)
+    assert not breaker.record_failure()
+    breaker.record_success()
+    assert not breaker.record_failure()
+    assert not breaker.record_failure()
+    assert breaker.record_failure()
+    assert breaker.is_open
+    assert breaker.remaining() == 5
+    clock[0] += 2
+    assert breaker.remaining() == 3
+
+
+def test_failed_trial_doubles_the_cooldown_up_to_the_cap(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=5, max_cooldown=15)
+    breaker.record_failure()
+    clock[0] += 5
+    assert breaker.remaining() == 0
+    assert breaker.record_failure()
+    assert breaker.remaining() == 10
+    clock[0] += 10
+    breaker.record_failure()
+    assert breaker.remaining() == 15
+    assert breaker.trips == 3
+
+
+def test_successful_trial_closes_and_resets_the_cooldown(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=5)
+    breaker.record_failure()
+    clock[0] += 5
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.remaining() == 0
+    breaker.record_failure()
+    assert breaker.remaining() == 5
@@ -0,0 +1,55 @@
+import pytest
+
+from src.android.ui_state import (
+    classify, BANK_PKG, CONFIRM_BUTTON_ID, QRIS_BUTTON_ID, PAY_ACTIVITY, RESULT_ACTIVITY,
+    SCREEN_MAIN, SCREEN_PAY, SCREEN_RESULT, SCREEN_ERROR
+)
+
+MERCHANTS = ["Toko Sukses Jaya", "Warung Error Kopi", "CV Berhasil Makmur", "Gagal Move On Cafe", "Indomaret"]
+
+
+def bank_node(text = "", resource_id = ""):
+    return {"package": BANK_PKG, "text": text, "resource-id": resource_id}
+
+
+def pay_screen(merchant):
+    return [bank_node(merchant), bank_node("Rp25.000"), bank_node("Bayar", CONFIRM_BUTTON_ID)]
+
+
+def result_screen(title, merchant):
+    return [bank_node(title), bank_node("Total"), bank_node("Rp25.000"), bank_node("Merchant"),
+            bank_node(merchant), bank_node("No. Referensi"), bank_node("123456789012"),
+            bank_node("Selesai", CONFIRM_BUTTON_ID)]
+
+
+@pytest.mark.parametrize("merchant", MERCHANTS)
+def test_pay_screen_is_not_told_by_merchant_name(merchant):
+    assert classify(pay_screen(merchant)) == SCREEN_PAY
+    assert classify(pay_screen(merchant), "com.bnc.finance" + PAY_ACTIVITY) == SCREEN_PAY
+
+
+@pytest.mark.parametrize("merchant", MERCHANTS)
+@pytest.mark.parametrize("title, screen", [
+    ("Transaksi Berhasil", SCREEN_RESULT),
+    ("Pembayaran Berhasil!", SCREEN_RESULT),
+    ("Transaksi Gagal", SCREEN_ERROR),
+    ("Pembayaran Tidak Berhasil", SCREEN_ERROR),
+])
+def test_result_screen_status_comes_from_its_title(merchant, title, screen):
+    assert classify(result_screen(title, merchant)) == screen
+
+
+def test_result_activity_without_a_known_title():
+    nodes = result_screen("Terima kasih", "Warung Error Kopi")
+    assert classify(nodes) == SCREEN_PAY
+    assert classify(nodes, "com.bnc.finance" + RESULT_ACTIVITY) == SCREEN_RESULT
+
+
+def test_main_screen_with_error_in_a_text():
+    nodes = [bank_node("Promo Warung Error Kopi"), bank_node(resource_id=QRIS_BUTTON_ID)]
+    assert classify(nodes) == SCREEN_MAIN
+
+
+def test_error_dialog():
+    nodes = [bank_node("Terjadi kesalahan, coba lagi", "android:id/message"), bank_node("OK", "android:id/button1")]
+    assert classify(nodes) == SCREEN_ERROR